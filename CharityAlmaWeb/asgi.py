@@ -1,7 +1,10 @@
 """
 ASGI config for CharityAlmaWeb project.
 
-It exposes the ASGI callable as a module-level variable named ``application``.
+The single entry point for HTTP and WebSockets. In production it is
+served by gunicorn with uvicorn workers (see gunicorn.conf.py):
+
+    gunicorn CharityAlmaWeb.asgi:application -c gunicorn.conf.py
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
@@ -10,13 +13,22 @@ https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
 import os
 
 from django.core.asgi import get_asgi_application
-from channels.routing import ProtocolTypeRouter, URLRouter
-from channels.auth import AuthMiddlewareStack
-import core.apps.chat.routing as chat_routing
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'CharityAlmaWeb.settings')
 
+# Django настраивается до импорта консьюмеров: они тянут модели
+django_asgi_app = get_asgi_application()
+
+from channels.auth import AuthMiddlewareStack  # noqa: E402
+from channels.routing import ProtocolTypeRouter, URLRouter  # noqa: E402
+from channels.security.websocket import AllowedHostsOriginValidator  # noqa: E402
+
+import core.apps.chat.routing as chat_routing  # noqa: E402
+import core.routing as core_routing  # noqa: E402
+
 application = ProtocolTypeRouter({
-    "http": get_asgi_application(),
-    "websocket": AuthMiddlewareStack(URLRouter(chat_routing.websocket_urlpatterns)),
+    "http": django_asgi_app,
+    "websocket": AllowedHostsOriginValidator(AuthMiddlewareStack(URLRouter(
+        chat_routing.websocket_urlpatterns + core_routing.websocket_urlpatterns
+    ))),
 })
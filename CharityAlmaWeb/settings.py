@@ -1,6 +1,7 @@
 ﻿import os
 from pathlib import Path
 from dotenv import load_dotenv
+from django.core.exceptions import ImproperlyConfigured
 
 BASE_DIR = Path(__file__).resolve().parent.parent
 load_dotenv(BASE_DIR / ".env")  # не падает, если .env нет
@@ -50,6 +51,7 @@ SITE_ID = int(os.getenv("SITE_ID", "1"))
 MIDDLEWARE = [
     "django.middleware.security.SecurityMiddleware",
     "whitenoise.middleware.WhiteNoiseMiddleware",  # статика
+    "core.middleware.QueryBudgetMiddleware",  # счётчик SQL-запросов (X-DB-Queries)
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
@@ -107,6 +109,65 @@ else:
         }
     }
 
+# --- Кэш ---
+# Версии закэшированных данных (дерево категорий, catalog_version) должны быть
+# общими для всех воркеров: при наличии Redis кэш держим в нём, иначе — в файлах
+# каталога CACHE_DIR, общего для воркеров одного хоста (чтение версии — без
+# запроса к базе). Кэш в памяти процесса не годится: сброс версии видел бы
+# только воркер, сделавший правку.
+# Фрагменты карточек (fragments) без Redis остаются в памяти процесса: в ключе
+# updated_at товара и общая версия дерева, так что устаревший фрагмент просто
+# перестаёт находиться.
+REDIS_URL = os.getenv("REDIS_URL", "")
+
+if REDIS_URL:
+    _redis_cache = {
+        "BACKEND": "django.core.cache.backends.redis.RedisCache",
+        "LOCATION": REDIS_URL,
+    }
+    CACHES = {"default": _redis_cache, "fragments": _redis_cache}
+else:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+            "LOCATION": os.getenv("CACHE_DIR", str(BASE_DIR / "cache")),
+        },
+        "fragments": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+            "OPTIONS": {"MAX_ENTRIES": 5000},
+        },
+    }
+
+# --- Channels ---
+# Слой каналов должен быть общим для всех процессов, иначе group_send не
+# доходит до сокетов в соседних воркерах. CHANNEL_LAYER:
+#   redis  — channels_redis, для нескольких машин (CHANNEL_REDIS_URL или REDIS_URL);
+#   unix   — один хост без Redis, брокер `manage.py channel_broker` на CHANNEL_SOCKET;
+#   memory — только один процесс (разработка, тесты).
+CHANNEL_LAYER = os.getenv("CHANNEL_LAYER", "redis" if REDIS_URL else "memory")
+CHANNEL_SOCKET = os.getenv("CHANNEL_SOCKET", str(BASE_DIR / "channels.sock"))
+
+if CHANNEL_LAYER == "redis":
+    CHANNEL_LAYERS = {
+        "default": {
+            "BACKEND": "channels_redis.core.RedisChannelLayer",
+            "CONFIG": {"hosts": [os.getenv("CHANNEL_REDIS_URL", REDIS_URL)]},
+        }
+    }
+elif CHANNEL_LAYER == "unix":
+    CHANNEL_LAYERS = {
+        "default": {
+            "BACKEND": "core.channel_layers.UnixSocketChannelLayer",
+            "CONFIG": {"path": CHANNEL_SOCKET},
+        }
+    }
+elif CHANNEL_LAYER == "memory":
+    CHANNEL_LAYERS = {
+        "default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}
+    }
+else:
+    raise ImproperlyConfigured(f"Неизвестный CHANNEL_LAYER: {CHANNEL_LAYER!r} (redis, unix или memory)")
+
 # --- Статика/медиа ---
 STATIC_URL = "/static/"
 STATIC_ROOT = BASE_DIR / "staticfiles"
@@ -132,6 +193,9 @@ if not DEBUG:
     SECURE_CONTENT_TYPE_NOSNIFF = True
     X_FRAME_OPTIONS = "DENY"
 
+# Запросы с большим числом SQL-запросов пишутся в лог (см. core.middleware)
+QUERY_BUDGET_WARN = int(os.getenv("QUERY_BUDGET_WARN", "50"))
+
 # --- Логирование (минимум) ---
 LOGGING = {
     "version": 1,
@@ -161,18 +225,6 @@ ROOT_URLCONF = "CharityAlmaWeb.urls"     # <-- имя_проекта.urls
 WSGI_APPLICATION = "CharityAlmaWeb.wsgi.application"
 ASGI_APPLICATION = "CharityAlmaWeb.asgi.application"
 
-# Channels: channel layer configuration
-CHANNEL_LAYERS = {
-    "default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}
-}
-
-# Channels: channel layer configuration
-# For development, use InMemoryChannelLayer. For production, use channels_redis with external Redis.
-CHANNEL_LAYERS = {
-    "default": {
-        "BACKEND": "channels.layers.InMemoryChannelLayer"
-    }
-}
 
 # === allauth: новые параметры вместо устаревших ===
 # было:
@@ -1,16 +1,69 @@
+from django import forms
 from django.contrib import admin, messages
-from .models import Category, Product, TradeRequest
+from django.forms.models import BaseInlineFormSet
+from django.shortcuts import redirect
+from django.urls import reverse
+from django.utils.html import format_html
+
+from .counters import set_approved
+from .models import Category, ConcurrentModification, Product, TradeRequest
+from .pagination import EstimatedCountPaginator
 from .populate_categories import create_categories
 
+INLINE_LIMIT = 20
+
+
+class LatestRequestsFormSet(BaseInlineFormSet):
+    # Только последние заявки: у популярного товара их могут быть тысячи.
+    # Срез выбирается один раз: формсет зовёт get_queryset()[i] на каждую форму
+    def get_queryset(self):
+        if not hasattr(self, '_latest'):
+            self._latest = list(
+                super().get_queryset().select_related('requester').order_by('-created_at')[:INLINE_LIMIT]
+            )
+            # Товар у всех заявок — тот, что открыт (его читает TradeRequest.__str__)
+            for trade_request in self._latest:
+                trade_request.product = self.instance
+        return self._latest
+
+
 # Показываем заявки прямо в карточке товара
 class TradeRequestInline(admin.TabularInline):
     model = TradeRequest
+    formset = LatestRequestsFormSet
     extra = 0
     fields = ('action', 'requester', 'status', 'created_at')
-    readonly_fields = ('created_at', 'updated_at')
+    readonly_fields = ('action', 'requester', 'status', 'created_at')
     can_delete = False
     verbose_name = "Заявка"
-    verbose_name_plural = "Заявки по этому товару"
+    verbose_name_plural = f"Последние {INLINE_LIMIT} заявок по этому товару"
+
+    def has_add_permission(self, request, obj=None):
+        return False
+
+class ProductAdminForm(forms.ModelForm):
+    # Версия товара на момент открытия формы (оптимистичная блокировка)
+    loaded_version = forms.IntegerField(widget=forms.HiddenInput, required=False)
+
+    class Meta:
+        model = Product
+        fields = '__all__'
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        if self.instance.pk:
+            self.fields['loaded_version'].initial = self.instance.version
+
+    def clean(self):
+        cleaned = super().clean()
+        version = cleaned.get('loaded_version')
+        if self.instance.pk and version is not None and version != self.instance.version:
+            raise forms.ValidationError(
+                "Пока форма была открыта, товар изменили (например, забронировали). "
+                "Обновите страницу и внесите правки заново."
+            )
+        return cleaned
+
 
 # Админка товаров с возможностью модерации
 @admin.register(Product)
@@ -28,12 +81,17 @@ class ProductAdmin(admin.ModelAdmin):
     list_filter = ('type', 'status', 'main_category', 'is_approved', 'created_at')  # Фильтр по модерации
     search_fields = ('title', 'description', 'user__username', 'phone')
     list_editable = ('is_approved',)  # Можно редактировать прямо в списке
+    list_select_related = ('user', 'main_category')
+    autocomplete_fields = ('user', 'main_category', 'subcategory', 'sub_subcategory')
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
     inlines = [TradeRequestInline]
+    form = ProductAdminForm
     actions = ['approve_selected_products', 'disapprove_selected_products']  # Действия на модерацию
     
     fieldsets = (
         ('Основная информация', {
-            'fields': ('user', 'title', 'description', 'type', 'status', 'is_approved')
+            'fields': ('user', 'title', 'description', 'type', 'status', 'is_approved', 'loaded_version')
         }),
         ('Категории', {
             'fields': ('main_category', 'subcategory', 'sub_subcategory')
@@ -44,16 +102,44 @@ class ProductAdmin(admin.ModelAdmin):
         ('Медиа', {
             'fields': ('image',)
         }),
+        ('Заявки', {
+            'fields': ('all_requests',)
+        }),
         ('Даты', {
             'fields': ('created_at',),
             'classes': ('collapse',)
         }),
     )
-    readonly_fields = ('created_at',)
+    readonly_fields = ('created_at', 'all_requests')
+
+    def save_model(self, request, obj, form, change):
+        if change and form.cleaned_data.get('loaded_version') is not None:
+            # Сохраняем поверх той версии, что видел модератор
+            obj._loaded_version = form.cleaned_data['loaded_version']
+        obj.save(check_version=change)
+
+    def changeform_view(self, request, object_id=None, form_url='', extra_context=None):
+        try:
+            return super().changeform_view(request, object_id, form_url, extra_context)
+        except ConcurrentModification:
+            # Товар изменили между проверкой формы и сохранением — транзакция админки откатилась
+            self.message_user(
+                request,
+                "Пока форма была открыта, товар изменили. Проверьте его и внесите правки заново.",
+                level=messages.ERROR,
+            )
+            return redirect(request.path)
+
+    @admin.display(description="Все заявки")
+    def all_requests(self, obj):
+        if not obj.pk:
+            return "—"
+        url = reverse('admin:core_traderequest_changelist') + f'?product__id__exact={obj.pk}'
+        return format_html('<a href="{}">Открыть список заявок</a>', url)
 
     @admin.action(description="✅ Одобрить выбранные товары")
     def approve_selected_products(self, request, queryset):
-        updated = queryset.update(is_approved=True)
+        updated = set_approved(queryset, True)
         self.message_user(
             request,
             f"✅ {updated} объявлений успешно одобрено.",
@@ -62,7 +148,7 @@ class ProductAdmin(admin.ModelAdmin):
     
     @admin.action(description="❌ Отклонить выбранные товары")
     def disapprove_selected_products(self, request, queryset):
-        updated = queryset.update(is_approved=False)
+        updated = set_approved(queryset, False)
         self.message_user(
             request,
             f"❌ {updated} объявлений отклонено.",
@@ -75,14 +161,25 @@ class TradeRequestAdmin(admin.ModelAdmin):
     list_display = ('product', 'action', 'requester', 'owner', 'status', 'created_at')
     list_filter = ('action', 'status')
     search_fields = ('product__title', 'requester__username', 'owner__username')
+    list_select_related = ('product', 'requester', 'owner')
+    autocomplete_fields = ('product', 'requester', 'owner')
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
 
 # Админка категорий
 @admin.register(Category)
 class CategoryAdmin(admin.ModelAdmin):
     list_display = ('name', 'parent')
+    list_select_related = ('parent',)
+    search_fields = ('name',)
     actions = ['load_default_categories']
 
     def load_default_categories(self, request, queryset):
-        create_categories()
-        self.message_user(request, "Категории успешно загружены!", level=messages.SUCCESS)
+        report = create_categories()
+        self.message_user(
+            request,
+            f"Категории загружены: добавлено {len(report['created'])}, переименовано {len(report['renamed'])}, "
+            f"перемещено {len(report['moved'])}, без изменений {report['unchanged']}.",
+            level=messages.SUCCESS
+        )
     load_default_categories.short_description = "Загрузить стандартные категории"
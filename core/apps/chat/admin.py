@@ -1,15 +1,34 @@
 from django.contrib import admin
-from .models import Chat, Message
+from django.utils.html import format_html
+
+from core.pagination import EstimatedCountPaginator
+from .models import Chat, ChatParticipant, Message
+
+
+class ChatParticipantInline(admin.TabularInline):
+    # M2M с промежуточной моделью админка сама не показывает — участники редактируются здесь
+    model = ChatParticipant
+    extra = 0
+    autocomplete_fields = ('user',)
+    readonly_fields = ('last_read_message_id',)
 
 
 @admin.register(Chat)
 class ChatAdmin(admin.ModelAdmin):
     list_display = ('id', 'get_participants', 'product', 'created_at', 'updated_at')
-    list_filter = ('created_at', 'updated_at', 'product')
+    list_filter = ('created_at', 'updated_at')
     search_fields = ('participants__username', 'product__title')
-    filter_horizontal = ('participants',)
-    readonly_fields = ('created_at', 'updated_at')
-    
+    list_select_related = ('product',)
+    autocomplete_fields = ('product',)
+    readonly_fields = ('pair_key', 'created_at', 'updated_at')
+    inlines = (ChatParticipantInline,)
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    def get_queryset(self, request):
+        # Участники всех чатов страницы — одним запросом
+        return super().get_queryset(request).prefetch_related('participants')
+
     def get_participants(self, obj):
         return ", ".join([p.username for p in obj.participants.all()])
     get_participants.short_description = 'Участники'
@@ -17,12 +36,22 @@ class ChatAdmin(admin.ModelAdmin):
 
 @admin.register(Message)
 class MessageAdmin(admin.ModelAdmin):
-    list_display = ('id', 'chat', 'sender', 'text_preview', 'has_image', 'is_read', 'created_at')
-    list_filter = ('is_read', 'created_at', 'chat')
+    list_display = ('id', 'chat_link', 'sender', 'text_preview', 'has_image', 'is_read', 'created_at')
+    # Фильтр по чату — через ссылку в колонке "Чат" (?chat__id__exact=), а не через список всех чатов
+    list_filter = ('is_read', 'created_at')
     search_fields = ('text', 'sender__username')
+    list_select_related = ('sender',)
+    autocomplete_fields = ('chat', 'sender')
     readonly_fields = ('created_at',)
     date_hierarchy = 'created_at'
-    
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    @admin.display(description='Чат', ordering='chat')
+    def chat_link(self, obj):
+        # str(chat) запрашивает участников — показываем только номер
+        return format_html('<a href="?chat__id__exact={}">Чат #{}</a>', obj.chat_id, obj.chat_id)
+
     def text_preview(self, obj):
         return obj.text[:50] + "..." if obj.text and len(obj.text) > 50 else (obj.text if obj.text else "(изображение)")
     text_preview.short_description = 'Текст'
@@ -1,14 +1,24 @@
 from channels.generic.websocket import AsyncWebsocketConsumer
 import json
+from urllib.parse import parse_qs
 from channels.db import database_sync_to_async
-from .models import Chat, Message
-from django.contrib.auth import get_user_model
+from .history import REPLAY_LIMIT, message_event, message_page, message_payload
+from .models import ChatParticipant, Message, apply_read_state
 
-User = get_user_model()
 
 class ChatConsumer(AsyncWebsocketConsumer):
+    """
+    Сокет одного чата.
+
+    Участие в чате проверяется один раз в connect; дальше пользователь и
+    чат известны по id, и новое сообщение — это один INSERT (плюс
+    обновление last_message в Message.save). Событие сериализуется один
+    раз отправителем и уходит получателям готовой строкой; is_own клиент
+    считает сам, сравнивая sender_id со своим id.
+    """
+
     async def connect(self):
-        self.chat_id = self.scope['url_route']['kwargs']['chat_id']
+        self.chat_id = int(self.scope['url_route']['kwargs']['chat_id'])
         self.group_name = f'chat_{self.chat_id}'
 
         # Проверим, что пользователь аутентифицирован и является участником чата
@@ -16,14 +26,33 @@ class ChatConsumer(AsyncWebsocketConsumer):
         if not user or user.is_anonymous:
             await self.close()
             return
+        self.user_id = user.id
+        self.username = user.username
 
-        is_participant = await self._is_participant(user.id, self.chat_id)
-        if not is_participant:
+        # ?last_id= — последнее сообщение, которое клиент уже показал
+        query = parse_qs(self.scope.get('query_string', b'').decode())
+        try:
+            last_id = int(query['last_id'][0])
+        except (KeyError, ValueError):
+            last_id = None
+
+        # В группу — до выборки пропущенного: всё, что придёт после выборки, доставит group_send
+        await self.channel_layer.group_add(self.group_name, self.channel_name)
+        replay = await self._replay(self.user_id, self.chat_id, last_id)
+        if replay is None:
+            await self.channel_layer.group_discard(self.group_name, self.channel_name)
             await self.close()
             return
 
-        await self.channel_layer.group_add(self.group_name, self.channel_name)
         await self.accept()
+        messages, has_more = replay
+        if has_more:
+            # Пропущено слишком много — дешевле перечитать страницу, чем досылать всё
+            await self.send(text_data=json.dumps({'type': 'chat.resync'}))
+        for payload in messages:
+            await self.send(text_data=json.dumps({'type': 'chat.message', **payload}))
+        # Живые сообщения, уже отправленные повтором, не дублируем
+        self.replayed_up_to = messages[-1]['id'] if messages else 0
 
     async def disconnect(self, close_code):
         await self.channel_layer.group_discard(self.group_name, self.channel_name)
@@ -37,47 +66,31 @@ class ChatConsumer(AsyncWebsocketConsumer):
         if not text:
             return
 
-        user = self.scope['user']
-        # create message in DB
-        message = await self._create_message(user.id, self.chat_id, text)
-
-        payload = {
-            'type': 'chat.message',
-            'id': message.id,
-            'sender': user.username,
-            'sender_id': user.id,
-            'text': message.text,
-            'status': message.status,
-            'is_read': message.is_read,
-            'created_at': message.created_at.isoformat(),
-            'is_own': True,
-        }
-
+        message = await self._create_message(text)
         # Broadcast to group
-        await self.channel_layer.group_send(self.group_name, {
-            'type': 'chat_message',
-            'message': payload
-        })
+        await self.channel_layer.group_send(self.group_name, message_event(message, self.username))
 
     # Called by group_send
     async def chat_message(self, event):
-        message = event['message']
-        # If message sender isn't this consumer's user, mark is_own False
-        if message.get('sender') != (self.scope['user'].username if self.scope.get('user') else None):
-            message['is_own'] = False
-        await self.send(text_data=json.dumps(message))
+        if event['id'] <= getattr(self, 'replayed_up_to', 0):
+            return
+        await self.send(text_data=event['text'])
 
     @database_sync_to_async
-    def _is_participant(self, user_id, chat_id):
-        try:
-            chat = Chat.objects.get(id=chat_id)
-            return chat.participants.filter(id=user_id).exists()
-        except Chat.DoesNotExist:
-            return False
+    def _replay(self, user_id, chat_id, last_id):
+        """
+        None, если пользователь не участник чата; иначе пропущенные после
+        last_id сообщения и флаг "пропущено больше REPLAY_LIMIT".
+        """
+        cursors = dict(ChatParticipant.objects.filter(chat_id=chat_id).values_list('user_id', 'last_read_message_id'))
+        if user_id not in cursors:
+            return None
+        if last_id is None:
+            return [], False
+        messages, has_more = message_page(chat_id, after_id=last_id, limit=REPLAY_LIMIT)
+        return [message_payload(m, user_id) for m in apply_read_state(messages, cursors)], has_more
 
     @database_sync_to_async
-    def _create_message(self, user_id, chat_id, text):
-        user = User.objects.get(id=user_id)
-        chat = Chat.objects.get(id=chat_id)
-        msg = Message.objects.create(chat=chat, sender=user, text=text)
-        return msg
+    def _create_message(self, text):
+        # Только id: участие проверено в connect, лишние SELECT пользователя и чата не нужны
+        return Message.objects.create(chat_id=self.chat_id, sender_id=self.user_id, text=text)
@@ -0,0 +1,67 @@
+import json
+
+from .models import Message
+
+PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+# Сколько пропущенных сообщений сокет досылает при переподключении; больше — клиент перечитывает страницу
+REPLAY_LIMIT = 100
+
+
+def message_page(chat_id, before_id=None, after_id=None, limit=PAGE_SIZE):
+    """
+    Страница сообщений чата по курсору id, в порядке возрастания id.
+
+    after_id — сообщения новее курсора, before_id — старше, без курсоров —
+    последние limit сообщений. Выборка — диапазон по индексу (chat, id),
+    отправитель подтягивается JOIN-ом. Возвращает (messages, has_more):
+    есть ли ещё сообщения за дальним краем страницы.
+    """
+    messages = Message.objects.filter(chat_id=chat_id).select_related('sender')
+    if after_id is not None:
+        rows = list(messages.filter(pk__gt=after_id).order_by('pk')[:limit + 1])
+        return rows[:limit], len(rows) > limit
+
+    if before_id is not None:
+        messages = messages.filter(pk__lt=before_id)
+    rows = list(messages.order_by('-pk')[:limit + 1])
+    return rows[:limit][::-1], len(rows) > limit
+
+
+def message_payload(message, user_id):
+    """Сообщение для JSON API и WebSocket (is_read/status — после apply_read_state)"""
+    return {
+        'id': message.id,
+        'sender': message.sender.username,
+        'sender_id': message.sender_id,
+        'text': message.text,
+        'image': message.image.url if message.image else None,
+        'status': message.status,
+        'is_read': message.is_read,
+        'created_at': message.created_at.isoformat(),
+        'is_own': message.sender_id == user_id,
+    }
+
+
+def message_event(message, username):
+    """
+    Событие group_send о новом сообщении для сокетов чата.
+
+    JSON собирается один раз и уходит получателям готовой строкой; is_own
+    клиент считает сам по sender_id.
+    """
+    return {
+        'type': 'chat_message',
+        'id': message.id,
+        'text': json.dumps({
+            'type': 'chat.message',
+            'id': message.id,
+            'sender': username,
+            'sender_id': message.sender_id,
+            'text': message.text,
+            'image': message.image.url if message.image else None,
+            'status': 'sent',
+            'is_read': False,
+            'created_at': message.created_at.isoformat(),
+        }),
+    }
@@ -0,0 +1,48 @@
+# Generated by Django 5.2.8 on 2026-10-18 13:17
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Min, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def backfill_cursors(apps, schema_editor):
+    # Курсор — перед первым непрочитанным чужим сообщением, иначе на последнем сообщении чата
+    Chat = apps.get_model('chat', 'Chat')
+    ChatParticipant = apps.get_model('chat', 'ChatParticipant')
+    Message = apps.get_model('chat', 'Message')
+
+    first_unread = (
+        Message.objects.filter(chat=OuterRef('chat'), is_read=False).exclude(sender=OuterRef('user'))
+        .order_by().values('chat').annotate(first=Min('id')).values('first')
+    )
+    ChatParticipant.objects.update(last_read_message_id=Coalesce(
+        Subquery(first_unread) - 1,
+        Subquery(Chat.objects.filter(pk=OuterRef('chat')).values('last_message_id')),
+        Value(0),
+    ))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0005_participant_inbox'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chatparticipant',
+            name='last_read_message_id',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['chat', 'id'], name='message_chat_id_idx'),
+        ),
+        migrations.RunPython(backfill_cursors, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='chatparticipant',
+            name='unread_count',
+        ),
+    ]
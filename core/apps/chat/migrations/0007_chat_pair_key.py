@@ -0,0 +1,66 @@
+# Generated by Django 5.2.8 on 2026-10-18 13:42
+
+from collections import defaultdict
+
+from django.db import migrations, models
+from django.db.models import Max
+
+
+def merge_pair_chats(apps, schema_editor):
+    # Ключ получает каждый чат ровно двух пользователей. Дубли (та же пара и товар)
+    # сливаются в самый ранний: сообщения переезжают в него, курсор каждого участника —
+    # дальний из слитых, last_message и updated_at — по самому новому
+    Chat = apps.get_model('chat', 'Chat')
+    ChatParticipant = apps.get_model('chat', 'ChatParticipant')
+    Message = apps.get_model('chat', 'Message')
+
+    members = defaultdict(list)
+    for chat_id, user_id in ChatParticipant.objects.order_by('chat_id', 'user_id').values_list('chat_id', 'user_id'):
+        members[chat_id].append(user_id)
+    products = dict(Chat.objects.values_list('id', 'product_id'))
+
+    by_key = defaultdict(list)
+    for chat_id, users in members.items():
+        if len(users) == 2:
+            by_key[f'{users[0]}:{users[1]}:{products[chat_id] or 0}'].append(chat_id)
+
+    for key, chat_ids in by_key.items():
+        keep, *duplicates = sorted(chat_ids)
+        if duplicates:
+            Message.objects.filter(chat_id__in=duplicates).update(chat_id=keep)
+            cursors = (
+                ChatParticipant.objects.filter(chat_id__in=chat_ids)
+                .values('user_id').annotate(cursor=Max('last_read_message_id'))
+            )
+            for row in cursors:
+                ChatParticipant.objects.filter(chat_id=keep, user_id=row['user_id']).update(
+                    last_read_message_id=row['cursor'],
+                )
+            updated_at = Chat.objects.filter(pk__in=chat_ids).aggregate(latest=Max('updated_at'))['latest']
+            Chat.objects.filter(pk__in=duplicates).delete()
+            Chat.objects.filter(pk=keep).update(
+                last_message_id=Message.objects.filter(chat_id=keep).aggregate(latest=Max('id'))['latest'],
+                updated_at=updated_at,
+            )
+        Chat.objects.filter(pk=keep).update(pair_key=key)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0006_read_cursor'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chat',
+            name='pair_key',
+            field=models.CharField(blank=True, editable=False, max_length=64, null=True),
+        ),
+        migrations.RunPython(merge_pair_chats, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='chat',
+            name='pair_key',
+            field=models.CharField(blank=True, editable=False, max_length=64, null=True, unique=True),
+        ),
+    ]
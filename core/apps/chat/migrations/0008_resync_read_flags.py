@@ -0,0 +1,28 @@
+from django.db import migrations
+from django.db.models import Case, Exists, OuterRef, Value, When
+
+
+def resync_read_flags(apps, schema_editor):
+    # После 0006 столбцы is_read/status не обновлялись — выставляем их по курсорам участников
+    ChatParticipant = apps.get_model('chat', 'ChatParticipant')
+    Message = apps.get_model('chat', 'Message')
+
+    read = Exists(
+        ChatParticipant.objects.filter(chat=OuterRef('chat'), last_read_message_id__gte=OuterRef('pk'))
+        .exclude(user=OuterRef('sender'))
+    )
+    Message.objects.update(
+        is_read=read,
+        status=Case(When(read, then=Value('read')), default=Value('sent')),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0007_chat_pair_key'),
+    ]
+
+    operations = [
+        migrations.RunPython(resync_read_flags, migrations.RunPython.noop),
+    ]
@@ -1,11 +1,22 @@
-from django.db import models
+from django.db import IntegrityError, models, transaction
+from django.db.models import Count, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
 from django.contrib.auth.models import User
 
+from core.notifications import chat_events, chat_read_event, notify
+
 
 class Chat(models.Model):
     """Модель чата между пользователями"""
-    participants = models.ManyToManyField(User, related_name='chats')
+    participants = models.ManyToManyField(User, related_name='chats', through='ChatParticipant')
     product = models.ForeignKey('core.Product', on_delete=models.SET_NULL, null=True, blank=True, related_name='chats', verbose_name='Товар')
+    # Последнее сообщение — для списка чатов без выборки по messages
+    last_message = models.ForeignKey(
+        'Message', on_delete=models.SET_NULL, null=True, blank=True, related_name='+', editable=False,
+    )
+    # Личный чат двух пользователей: "меньший id:больший id:товар" (0 — без товара).
+    # Уникальный индекс — один чат на пару и товар; NULL — чаты, созданные не через between
+    pair_key = models.CharField(max_length=64, unique=True, null=True, blank=True, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
@@ -13,15 +24,118 @@ class Chat(models.Model):
         ordering = ['-updated_at']
 
     def __str__(self):
-        participants_list = self.participants.all()[:2]
-        names = [p.username for p in participants_list]
-        return f"Chat: {', '.join(names)}"
+        # Имена участников — только если они уже подгружены prefetch_related
+        participants = getattr(self, '_prefetched_objects_cache', {}).get('participants')
+        if participants is None:
+            return f"Chat #{self.pk}"
+        return f"Chat: {', '.join(p.username for p in list(participants)[:2])}"
+
+    def save(self, *args, **kwargs):
+        # last_message ведёт Message.save; сохранение устаревшей копии чата его не затирает
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                f.name for f in self._meta.concrete_fields if not f.primary_key and f.name != 'last_message'
+            ]
+        super().save(*args, **kwargs)
+
+    @staticmethod
+    def make_pair_key(user_id, other_id, product_id=None):
+        low, high = sorted((user_id, other_id))
+        return f'{low}:{high}:{product_id or 0}'
+
+    @classmethod
+    def between(cls, user, other, product=None):
+        """
+        Чат двух пользователей (о товаре или без него), создаётся при первом обращении.
+
+        Поиск — одна проба по уникальному pair_key. Чат и участники создаются
+        в одной транзакции; одновременный второй запрос упирается в индекс
+        и получает уже созданный чат.
+        """
+        key = cls.make_pair_key(user.pk, other.pk, product.pk if product else None)
+        chat = cls.objects.filter(pair_key=key).first()
+        if chat is not None:
+            return chat
+        try:
+            with transaction.atomic():
+                chat = cls.objects.create(pair_key=key, product=product)
+                chat.participants.add(user, other)
+        except IntegrityError:
+            return cls.objects.get(pair_key=key)
+        return chat
+
+    def _newly_read(self, user, cursor):
+        # Чужие сообщения между прежним курсором и последним — диапазон по индексу (chat, id)
+        return Message.objects.filter(
+            chat=self, pk__gt=cursor, pk__lte=self.last_message_id, is_read=False,
+        ).exclude(sender=user)
+
+    def mark_read(self, user, cursor=0):
+        """
+        Пользователь открыл чат: курсор прочтения сдвигается на последнее сообщение.
+
+        cursor — прежний курсор пользователя. Сообщения правее него одним
+        UPDATE получают is_read/status: столбцы остаются согласованными с
+        курсорами для админки, фильтров и прямых запросов.
+        """
+        if self.last_message_id and ChatParticipant.objects.filter(
+            chat=self, user=user, last_read_message_id__lt=self.last_message_id,
+        ).update(last_read_message_id=self.last_message_id):
+            self._newly_read(user, cursor).update(is_read=True, status='read')
+            notify([(user.pk, chat_read_event(self.pk))])
 
     def get_other_participant(self, user):
         """Получить другого участника чата"""
         return self.participants.exclude(id=user.id).first()
 
 
+class ChatParticipant(models.Model):
+    """
+    Участник чата и его курсор прочтения.
+
+    Таблица — бывшая автоматическая M2M-таблица Chat.participants. Всё с id
+    не больше last_read_message_id пользователь прочитал; непрочитанные —
+    чужие сообщения правее курсора (диапазон по индексу message_chat_id_idx).
+    """
+    chat = models.ForeignKey(Chat, on_delete=models.CASCADE, related_name='memberships')
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='chat_memberships')
+    last_read_message_id = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        db_table = 'chat_chat_participants'
+        unique_together = [('chat', 'user')]
+
+    def __str__(self):
+        return f'{self.user_id} в чате {self.chat_id}'
+
+
+def unread_count():
+    """Выражение для ChatParticipant: число чужих сообщений правее курсора"""
+    unread = (
+        Message.objects.filter(chat=OuterRef('chat'), pk__gt=OuterRef('last_read_message_id'))
+        .exclude(sender=OuterRef('user'))
+        .order_by().values('chat').annotate(n=Count('pk')).values('n')
+    )
+    return Coalesce(Subquery(unread), 0)
+
+
+def apply_read_state(messages, cursors):
+    """
+    Проставить is_read/status по курсорам {user_id: last_read_message_id}.
+
+    Курсоры загружаются вместе с чатом, поэтому флаги считаются по ним —
+    так же, как их пишет в столбцы mark_read: сообщение прочитано, если его
+    прочитал кто-то кроме отправителя.
+    """
+    messages = list(messages)
+    for message in messages:
+        message.is_read = any(
+            cursor >= message.pk for user_id, cursor in cursors.items() if user_id != message.sender_id
+        )
+        message.status = 'read' if message.is_read else 'sent'
+    return messages
+
+
 class Message(models.Model):
     """Модель сообщения в чате"""
     STATUS_CHOICES = (
@@ -39,7 +153,27 @@ class Message(models.Model):
 
     class Meta:
         ordering = ['created_at']
+        indexes = [
+            # Непрочитанные и подгрузка истории — диапазоны id внутри чата
+            models.Index(fields=['chat', 'id'], name='message_chat_id_idx'),
+        ]
 
     def __str__(self):
         return f"{self.sender.username}: {self.text[:50]}"
 
+    def save(self, *args, **kwargs):
+        adding = self._state.adding
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            if adding:
+                self._update_inbox()
+
+    def _update_inbox(self):
+        """Новое сообщение становится последним в чате; списки чатов участников получают дельту"""
+        # Условие по id: при гонке двух отправок последним остаётся более новое сообщение
+        Chat.objects.filter(pk=self.chat_id).filter(
+            Q(last_message__isnull=True) | Q(last_message_id__lt=self.pk),
+        ).update(last_message=self, updated_at=self.created_at)
+        # Участники и имя отправителя — одним запросом; уходит после коммита
+        members = dict(ChatParticipant.objects.filter(chat_id=self.chat_id).values_list('user_id', 'user__username'))
+        notify(chat_events(self, members))
@@ -0,0 +1,241 @@
+import json
+
+from asgiref.sync import sync_to_async
+from asgiref.testing import ApplicationCommunicator
+from django.contrib.auth.models import User
+from django.test import TestCase
+from django.urls import reverse
+
+from core.apps.chat.consumers import ChatConsumer
+from core.apps.chat.models import Chat, Message
+from core.consumers import NotificationConsumer
+from core.models import Product
+from core.testing import QueryBudgetMixin
+
+
+class ChatQueryBudgetTest(QueryBudgetMixin, TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='me', password='pass')
+        self.other = User.objects.create_user(username='other', password='pass')
+        self.client.force_login(self.user)
+        self.chat = Chat.objects.create()
+        self.chat.participants.add(self.user, self.other)
+        for i in range(10):
+            Message.objects.create(chat=self.chat, sender=self.other if i % 2 else self.user, text=f'm{i}')
+
+    def test_chat_detail(self):
+        # Плюс один UPDATE флагов is_read/status при сдвиге курсора
+        with self.assertQueryBudget(7, max_duplicates=0):
+            self.client.get(reverse('chat_detail', args=[self.chat.id]))
+
+    def test_get_messages(self):
+        with self.assertQueryBudget(7, max_duplicates=0):
+            self.client.get(reverse('get_messages', args=[self.chat.id]))
+        # Повторный опрос ничего не пишет: курсор уже на последнем сообщении
+        with self.assertQueryBudget(5, max_duplicates=0):
+            self.client.get(reverse('get_messages', args=[self.chat.id]))
+
+    def test_read_state_follows_cursors(self):
+        url = reverse('get_messages', args=[self.chat.id])
+
+        def own():
+            return [m['is_read'] for m in self.client.get(url).json()['messages'] if m['is_own']]
+
+        self.assertEqual(own(), [False] * 5)
+
+        self.client.force_login(self.other)
+        self.client.get(url)
+        self.client.force_login(self.user)
+        Message.objects.create(chat=self.chat, sender=self.user, text='late')
+        self.assertEqual(own(), [True] * 5 + [False])
+        # Столбцы в базе совпадают с тем, что отдаёт API
+        self.assertEqual(
+            list(Message.objects.filter(sender=self.user).order_by('pk').values_list('is_read', 'status')),
+            [(True, 'read')] * 5 + [(False, 'sent')],
+        )
+
+    def test_chat_list_does_not_grow_with_chats(self):
+        for i in range(15):
+            chat = Chat.objects.create()
+            other = User.objects.create_user(username=f'u{i}', password='pass')
+            chat.participants.add(self.user, other)
+            Message.objects.create(chat=chat, sender=other, text=f'hi {i}')
+        with self.assertQueryBudget(7, max_duplicates=0):
+            resp = self.client.get(reverse('chat_list_with_id', args=[self.chat.id]))
+        inbox = {item['chat'].id: item for item in resp.context['chats']}
+        self.assertEqual(len(inbox), 16)
+        self.assertEqual(resp.context['chats'][0]['last_message'].text, 'hi 14')
+        # Выбранный чат прочитан, остальные ждут
+        self.assertEqual(inbox[self.chat.id]['unread_count'], 0)
+        self.assertEqual(resp.context['chats'][0]['unread_count'], 1)
+        self.assertEqual(resp.context['chats'][0]['other_user'].username, 'u14')
+
+        with self.assertQueryBudget(5, max_duplicates=0):
+            self.client.get(reverse('chat_list_with_id', args=[self.chat.id]))
+
+
+class StartChatTest(QueryBudgetMixin, TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='me', password='pass')
+        self.other = User.objects.create_user(username='other', password='pass')
+        self.product = Product.objects.create(
+            user=self.other, name='n', phone='0', title='Item', description='d', type='free', is_approved=True,
+        )
+
+    def start(self, user, other, **params):
+        self.client.force_login(user)
+        return self.open(other, **params)
+
+    def open(self, other, **params):
+        response = self.client.get(reverse('start_chat', args=[other.id]), params)
+        return int(response['Location'].rsplit('=', 1)[1])
+
+    def test_one_chat_per_pair_and_product(self):
+        general = self.start(self.user, self.other)
+        self.assertEqual(self.start(self.other, self.user), general)
+        about_item = self.start(self.user, self.other, product_id=self.product.id)
+        self.assertNotEqual(about_item, general)
+        self.client.force_login(self.other)
+        # Сессия, пользователь, собеседник (тот же SELECT по auth_user), товар, чат по pair_key
+        with self.assertQueryBudget(5, max_duplicates=1):
+            self.assertEqual(self.open(self.user, product_id=self.product.id), about_item)
+        self.assertEqual(Chat.objects.count(), 2)
+        self.assertEqual(Chat.objects.get(pk=about_item).participants.count(), 2)
+
+
+class MessageHistoryTest(QueryBudgetMixin, TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='me', password='pass')
+        self.other = User.objects.create_user(username='other', password='pass')
+        self.chat = Chat.objects.create()
+        self.chat.participants.add(self.user, self.other)
+        Message.objects.bulk_create(
+            Message(chat=self.chat, sender=self.other if i % 2 else self.user, text=f'm{i}') for i in range(120)
+        )
+        self.ids = list(Message.objects.order_by('pk').values_list('pk', flat=True))
+
+    def test_get_messages_is_cursor_paginated(self):
+        self.client.force_login(self.user)
+        url = reverse('get_messages', args=[self.chat.id])
+        with self.assertQueryBudget(5, max_duplicates=0):
+            page = self.client.get(url).json()
+        self.assertEqual([m['id'] for m in page['messages']], self.ids[-50:])
+        self.assertTrue(page['has_more'])
+
+        page = self.client.get(url, {'before_id': self.ids[-100]}).json()
+        self.assertEqual([m['id'] for m in page['messages']], self.ids[:20])
+        self.assertFalse(page['has_more'])
+
+        page = self.client.get(url, {'after_id': self.ids[-3], 'limit': 2}).json()
+        self.assertEqual([m['text'] for m in page['messages']], ['m118', 'm119'])
+        self.assertFalse(page['has_more'])
+
+    async def connect(self, last_id):
+        communicator = ApplicationCommunicator(ChatConsumer.as_asgi(), {
+            'type': 'websocket', 'path': f'/ws/chat/{self.chat.id}/', 'headers': [], 'subprotocols': [],
+            'query_string': f'last_id={last_id}'.encode(), 'user': self.user,
+            'url_route': {'args': (), 'kwargs': {'chat_id': str(self.chat.id)}},
+        })
+        await communicator.send_input({'type': 'websocket.connect'})
+        self.assertEqual((await communicator.receive_output())['type'], 'websocket.accept')
+        return communicator
+
+    async def receive(self, communicator):
+        return json.loads((await communicator.receive_output())['text'])
+
+    async def test_reconnect_replays_only_missed_messages(self):
+        communicator = await self.connect(self.ids[-3])
+        self.assertEqual([(await self.receive(communicator))['text'] for _ in range(2)], ['m118', 'm119'])
+
+        await communicator.send_input({'type': 'websocket.receive', 'text': json.dumps({'text': 'live'})})
+        live = await self.receive(communicator)
+        self.assertEqual((live['text'], live['sender_id']), ('live', self.user.id))
+        self.assertTrue(await communicator.receive_nothing())
+        await communicator.send_input({'type': 'websocket.disconnect', 'code': 1000})
+        await communicator.wait()
+
+    async def test_form_post_reaches_open_sockets(self):
+        communicator = await self.connect(self.ids[-1])
+        await self.async_client.aforce_login(self.other)
+        response = await self.async_client.post(reverse('send_message', args=[self.chat.id]), {'text': 'form'})
+        self.assertEqual(response.status_code, 302)
+        event = await self.receive(communicator)
+        self.assertEqual((event['text'], event['sender_id'], event['image']), ('form', self.other.id, None))
+        await communicator.send_input({'type': 'websocket.disconnect', 'code': 1000})
+        await communicator.wait()
+
+        stranger = await User.objects.acreate(username='stranger')
+        await self.async_client.aforce_login(stranger)
+        response = await self.async_client.get(reverse('get_messages', args=[self.chat.id]))
+        self.assertEqual(response.status_code, 404)
+
+    async def test_long_gap_asks_for_resync(self):
+        communicator = await self.connect(0)
+        self.assertEqual(await self.receive(communicator), {'type': 'chat.resync'})
+        await communicator.send_input({'type': 'websocket.disconnect', 'code': 1000})
+        await communicator.wait()
+
+
+class InboxStreamTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='me', password='pass')
+        self.other = User.objects.create_user(username='other', password='pass')
+        self.chat = Chat.objects.create()
+        self.chat.participants.add(self.user, self.other)
+
+    async def connect(self, user):
+        communicator = ApplicationCommunicator(NotificationConsumer.as_asgi(), {
+            'type': 'websocket', 'path': '/ws/notifications/', 'headers': [], 'subprotocols': [], 'user': user,
+        })
+        await communicator.send_input({'type': 'websocket.connect'})
+        self.assertEqual((await communicator.receive_output())['type'], 'websocket.accept')
+        return communicator
+
+    async def receive(self, communicator):
+        return json.loads((await communicator.receive_output())['text'])
+
+    def send(self, text):
+        with self.captureOnCommitCallbacks(execute=True):
+            return Message.objects.create(chat=self.chat, sender=self.other, text=text)
+
+    def open_chat(self):
+        self.client.force_login(self.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.get(reverse('get_messages', args=[self.chat.id]))
+
+    async def test_message_and_read_deltas(self):
+        mine, theirs = await self.connect(self.user), await self.connect(self.other)
+        message = await sync_to_async(self.send)('one two three four')
+        delta = await self.receive(mine)
+        self.assertEqual(delta, {
+            'kind': 'chat', 'event': 'message', 'id': self.chat.id, 'message_id': message.id,
+            'sender': 'other', 'sender_id': self.other.id, 'preview': 'one two three …',
+            'created_at': message.created_at.isoformat(), 'unread': 1,
+        })
+        self.assertEqual((await self.receive(theirs))['unread'], 0)
+
+        # Открыл чат — другим вкладкам сбросить счётчик
+        await sync_to_async(self.open_chat)()
+        self.assertEqual(await self.receive(mine), {'kind': 'chat', 'event': 'read', 'id': self.chat.id, 'unread': 0})
+        await sync_to_async(self.open_chat)()
+        self.assertTrue(await mine.receive_nothing())
+
+        for communicator in (mine, theirs):
+            await communicator.send_input({'type': 'websocket.disconnect', 'code': 1000})
+            await communicator.wait()
+
+
+class ChatAdminTest(QueryBudgetMixin, TestCase):
+    def setUp(self):
+        admin = User.objects.create_superuser(username='admin', password='pass')
+        self.client.force_login(admin)
+        for i in range(6):
+            chat = Chat.objects.create()
+            chat.participants.add(admin, User.objects.create_user(username=f'u{i}', password='pass'))
+            Message.objects.create(chat=chat, sender=admin, text='hi')
+
+    def test_changelists_do_not_grow_with_rows(self):
+        with self.assertQueryBudget(5, max_duplicates=0):
+            self.client.get(reverse('admin:chat_chat_changelist'))
+        with self.assertQueryBudget(6, max_duplicates=0):
+            self.client.get(reverse('admin:chat_message_changelist'))
@@ -1,83 +1,121 @@
+import logging
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
 from django.shortcuts import render, get_object_or_404, redirect
 from django.contrib.auth.decorators import login_required
-from django.http import JsonResponse
+from django.http import Http404, JsonResponse
 from django.views.decorators.http import require_http_methods
-from django.db.models import Q, Max
 from django.contrib import messages
 from django.urls import reverse
 
-from .models import Chat, Message
+from .history import MAX_PAGE_SIZE, PAGE_SIZE, message_event, message_page, message_payload
+from .models import Chat, ChatParticipant, Message, apply_read_state, unread_count
 from django.contrib.auth.models import User
 
+logger = logging.getLogger(__name__)
+
+
+def _id_param(request, name):
+    try:
+        return int(request.GET[name])
+    except (KeyError, ValueError):
+        return None
+
 
 @login_required
 def chat_list(request, chat_id=None):
     """Список всех чатов пользователя с деталями выбранного чата"""
-    # Получаем все чаты, где пользователь является участником
-    user_chats = Chat.objects.filter(participants=request.user).annotate(
-        last_message_time=Max('messages__created_at')
-    ).order_by('-last_message_time', '-updated_at')
-    
-    # Для каждого чата получаем последнее сообщение и другого участника
-    chats_with_info = []
-    for chat in user_chats:
-        other_user = chat.get_other_participant(request.user)
-        last_message = chat.messages.last()
-        unread_count = chat.messages.filter(is_read=False).exclude(sender=request.user).count()
-        
-        chats_with_info.append({
-            'chat': chat,
-            'other_user': other_user,
-            'last_message': last_message,
-            'unread_count': unread_count,
-        })
-    
-    # Определяем выбранный чат из URL параметра, GET параметра или берем первый
-    selected_chat = None
-    selected_other_user = None
-    selected_messages = []
-    
-    # Сначала проверяем URL параметр (chat_id из path), потом GET параметр
-    chat_id = chat_id or request.GET.get('chat_id')
+    user = request.user
+    # Выбранный чат из URL параметра, GET параметра, иначе — первый в списке
+    chat_id = chat_id or _id_param(request, 'chat_id')
+
+    # Чаты пользователя с последним сообщением и числом непрочитанных — одним запросом
+    memberships = (
+        ChatParticipant.objects.filter(user=user)
+        .select_related('chat__last_message', 'chat__product')
+        .annotate(unread=unread_count())
+        .order_by('-chat__updated_at', '-chat_id')
+    )
+    chats_with_info = [{
+        'chat': membership.chat,
+        'last_message': membership.chat.last_message,
+        'unread_count': membership.unread,
+        'cursor': membership.last_read_message_id,
+    } for membership in memberships]
+
+    # Собеседники во всех чатах (с их курсорами) — вторым запросом
+    others = {
+        membership.chat_id: membership
+        for membership in ChatParticipant.objects.filter(chat__memberships__user=user)
+        .exclude(user=user).select_related('user')
+    }
+    for item in chats_with_info:
+        other = others.get(item['chat'].id)
+        item['other_user'] = other.user if other else None
+        item['other_cursor'] = other.last_read_message_id if other else 0
+
+    selected = None
     if chat_id:
-        try:
-            selected_chat = Chat.objects.get(id=chat_id, participants=request.user)
-            selected_other_user = selected_chat.get_other_participant(request.user)
-            # Помечаем сообщения как прочитанные
-            selected_chat.messages.filter(is_read=False).exclude(sender=request.user).update(is_read=True)
-            selected_messages = selected_chat.messages.all()
-        except (Chat.DoesNotExist, ValueError):
-            pass
+        selected = next((item for item in chats_with_info if item['chat'].id == chat_id), None)
     elif chats_with_info:
-        # Если чат не выбран, берем первый
-        selected_chat = chats_with_info[0]['chat']
-        selected_other_user = chats_with_info[0]['other_user']
-        selected_chat.messages.filter(is_read=False).exclude(sender=request.user).update(is_read=True)
-        selected_messages = selected_chat.messages.all()
-    
+        selected = chats_with_info[0]
+
+    selected_chat = selected_other_user = None
+    selected_messages, has_more = [], False
+    if selected:
+        selected_chat = selected['chat']
+        selected_other_user = selected['other_user']
+        if selected['cursor'] < (selected_chat.last_message_id or 0):
+            selected_chat.mark_read(user, selected['cursor'])
+            selected['unread_count'] = 0
+        # Только последняя страница; более ранние догружаются через get_messages?before_id=
+        page, has_more = message_page(selected_chat.id)
+        selected_messages = apply_read_state(page, {
+            user.id: selected_chat.last_message_id or 0,
+            getattr(selected_other_user, 'id', None): selected['other_cursor'],
+        })
+
     return render(request, 'chat/index.html', {
         'chats': chats_with_info,
         'selected_chat': selected_chat,
         'selected_other_user': selected_other_user,
         'selected_messages': selected_messages,
+        'has_more': has_more,
     })
 
 
+def _open_chat(user, chat_id, **page):
+    """
+    Чат пользователя, собеседник и страница сообщений (см. message_page)
+    с проставленным is_read: (chat, other_user, messages, has_more).
+
+    Курсор пользователя сдвигается на последнее сообщение — запись одной
+    строки и только если в чате было что-то новое.
+    """
+    chat = Chat.objects.select_related('product').filter(id=chat_id).first()
+    memberships = list(ChatParticipant.objects.filter(chat_id=chat_id).select_related('user'))
+    cursors = {m.user_id: m.last_read_message_id for m in memberships}
+    if chat is None or user.id not in cursors:
+        raise Http404("Чат не найден")
+    rows, has_more = message_page(chat_id, **page)
+    if cursors[user.id] < (chat.last_message_id or 0):
+        chat.mark_read(user, cursors[user.id])
+        cursors[user.id] = chat.last_message_id
+    other_user = next((m.user for m in memberships if m.user_id != user.id), None)
+    return chat, other_user, apply_read_state(rows, cursors), has_more
+
+
 @login_required
 def chat_detail(request, chat_id):
     """Открыть конкретный чат"""
-    chat = get_object_or_404(Chat, id=chat_id, participants=request.user)
-    other_user = chat.get_other_participant(request.user)
-    
-    # Помечаем сообщения как прочитанные
-    chat.messages.filter(is_read=False).exclude(sender=request.user).update(is_read=True)
-    
-    messages_list = chat.messages.all()
-    
+    chat, other_user, page, has_more = _open_chat(request.user, chat_id)
+
     return render(request, 'chat/detail.html', {
         'chat': chat,
         'other_user': other_user,
-        'messages': messages_list,
+        'messages': page,
+        'has_more': has_more,
     })
 
 
@@ -85,7 +123,8 @@ def chat_detail(request, chat_id):
 @require_http_methods(["POST"])
 def send_message(request, chat_id):
     """Отправить сообщение"""
-    chat = get_object_or_404(Chat, id=chat_id, participants=request.user)
+    if not ChatParticipant.objects.filter(chat_id=chat_id, user=request.user).exists():
+        raise Http404("Чат не найден")
     text = request.POST.get('text', '').strip()
     image = request.FILES.get('image')
     
@@ -94,43 +133,41 @@ def send_message(request, chat_id):
         messages.error(request, "Сообщение не может быть пустым")
         return redirect(f'{reverse("chat_list")}?chat_id={chat_id}')
     
-    message = Message.objects.create(
-        chat=chat,
-        sender=request.user,
-        text=text if text else '',
-        image=image if image else None
-    )
-    
-    # Обновляем время последнего обновления чата
-    chat.save()  # Это обновит updated_at
-    
+    message = Message.objects.create(chat_id=chat_id, sender=request.user, text=text, image=image or None)
+
+    # updated_at и last_message чата обновляет Message.save. Открытым сокетам чата —
+    # то же событие, что шлёт ChatConsumer (иначе фото доходили только после перезагрузки)
+    try:
+        async_to_sync(get_channel_layer().group_send)(
+            f'chat_{chat_id}', message_event(message, request.user.username),
+        )
+    except Exception:
+        # Сообщение уже сохранено; клиенты увидят его при переподключении
+        logger.exception("Не удалось разослать сообщение %s в чат %s", message.pk, chat_id)
+
     messages.success(request, "Сообщение отправлено")
     return redirect(f'{reverse("chat_list")}?chat_id={chat_id}')
 
 
 @login_required
 def get_messages(request, chat_id):
-    """Получить сообщения конкретного чата (для AJAX)"""
-    chat = get_object_or_404(Chat, id=chat_id, participants=request.user)
-    
-    messages_list = chat.messages.all()
-    
-    # Помечаем сообщения как прочитанные
-    chat.messages.filter(is_read=False).exclude(sender=request.user).update(is_read=True)
-    
-    messages_data = [{
-        'id': msg.id,
-        'sender': msg.sender.username,
-        'text': msg.text,
-        'image': msg.image.url if msg.image else None,
-        'is_read': msg.is_read,
-        'created_at': msg.created_at.isoformat(),
-        'is_own': msg.sender == request.user,
-    } for msg in messages_list]
-    
+    """
+    Сообщения чата страницами (для AJAX).
+
+    ?before_id= — более ранние сообщения (прокрутка вверх), ?after_id= —
+    пришедшие после последнего известного клиенту; без параметров —
+    последняя страница. ?limit= — размер страницы, не больше MAX_PAGE_SIZE.
+    """
+    limit = min(max(_id_param(request, 'limit') or PAGE_SIZE, 1), MAX_PAGE_SIZE)
+    _, _, page, has_more = _open_chat(
+        request.user, chat_id,
+        before_id=_id_param(request, 'before_id'), after_id=_id_param(request, 'after_id'), limit=limit,
+    )
+
     return JsonResponse({
-        'messages': messages_data,
+        'messages': [message_payload(msg, request.user.id) for msg in page],
         'chat_id': chat_id,
+        'has_more': has_more,
     })
 
 
@@ -154,27 +191,6 @@ def start_chat(request, user_id):
         except Product.DoesNotExist:
             pass
     
-    # Ищем существующий чат между этими пользователями
-    # Если есть product_id, ищем чат с этим товаром
-    if product:
-        existing_chat = Chat.objects.filter(
-            participants=request.user,
-            product=product
-        ).filter(
-            participants=other_user
-        ).distinct().first()
-    else:
-        existing_chat = Chat.objects.filter(
-            participants=request.user
-        ).filter(
-            participants=other_user
-        ).distinct().first()
-    
-    if existing_chat:
-        return redirect(f'{reverse("chat_list")}?chat_id={existing_chat.id}')
-    
-    # Создаем новый чат
-    new_chat = Chat.objects.create(product=product)
-    new_chat.participants.add(request.user, other_user)
-    
-    return redirect(f'{reverse("chat_list")}?chat_id={new_chat.id}')
+    # Один чат на пару пользователей и товар — см. Chat.pair_key
+    chat = Chat.between(request.user, other_user, product)
+    return redirect(f'{reverse("chat_list")}?chat_id={chat.id}')
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.8 on 2026-10-18 12:36
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0008_product_traderequest_indexes'),
+        ('rentals', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='rentitem',
+            index=models.Index(fields=['status', 'product'], name='rentitem_status_product_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='rentitem',
+            index=models.Index(fields=['renter', 'created_at'], name='rentitem_renter_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='rentitem',
+            index=models.Index(fields=['owner', 'created_at'], name='rentitem_owner_idx'),
+        ),
+    ]
@@ -1,6 +1,7 @@
 from django.db import models
 from django.contrib.auth.models import User
 from core.models import Product
+from core.notifications import notify, rental_events
 
 
 class RentItem(models.Model):
@@ -25,7 +26,27 @@ class RentItem(models.Model):
         ordering = ['-created_at']
         verbose_name = 'Аренда'
         verbose_name_plural = 'Аренды'
+        indexes = [
+            # Подзапрос "товары в активной аренде" в rentals_list
+            models.Index(fields=['status', 'product'], name='rentitem_status_product_idx'),
+            models.Index(fields=['renter', 'created_at'], name='rentitem_renter_idx'),
+            models.Index(fields=['owner', 'created_at'], name='rentitem_owner_idx'),
+        ]
     
     def __str__(self):
         return f"{self.renter.username} арендует {self.product.title} ({self.get_status_display()})"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_status = instance.__dict__.get('status')
+        return instance
+
+    def save(self, *args, **kwargs):
+        adding = self._state.adding
+        super().save(*args, **kwargs)
+        # Владелец и арендатор узнают о новой аренде и смене статуса без перезагрузки страниц
+        old_status = None if adding else getattr(self, '_loaded_status', None)
+        if adding or (old_status and old_status != self.status):
+            notify(rental_events(self, 'created' if adding else 'status'))
+        self._loaded_status = self.status
@@ -0,0 +1,60 @@
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.test import TestCase
+from django.urls import reverse
+
+from core.apps.rentals.models import RentItem
+from core.models import Product
+from core.testing import QueryBudgetMixin
+
+
+class RentalsQueryBudgetTest(QueryBudgetMixin, TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='renter', password='pass')
+        self.client.force_login(self.user)
+        for i in range(8):
+            owner = User.objects.create_user(username=f'owner{i}', password='pass')
+            product = Product.objects.create(
+                user=owner, name='n', phone='0', title=f'Rental {i}', description='d',
+                type='rental', is_approved=True,
+            )
+            if i % 2:
+                RentItem.objects.create(product=product, renter=self.user, owner=owner)
+
+    def test_rentals_list(self):
+        with self.assertQueryBudget(4, max_duplicates=0):
+            self.client.get(reverse('rentals_list'))
+        with self.assertQueryBudget(3, max_duplicates=0):
+            self.client.get(reverse('rentals_list'), {'format': 'json'})
+
+    def test_my_rentals(self):
+        with self.assertQueryBudget(4, max_duplicates=0):
+            self.client.get(reverse('my_rentals'))
+        with self.assertQueryBudget(4, max_duplicates=0):
+            self.client.get(reverse('my_rentals'), {'format': 'json'})
+
+
+class RentalNotificationTest(TestCase):
+    def test_created_and_status_events(self):
+        owner = User.objects.create_user(username='owner', password='pass')
+        renter = User.objects.create_user(username='renter', password='pass')
+        product = Product.objects.create(
+            user=owner, name='n', phone='0', title='Drill', description='d', type='rental', is_approved=True,
+        )
+        with mock.patch('core.notifications._send') as send, self.captureOnCommitCallbacks(execute=True):
+            rental = RentItem.objects.create(product=product, renter=renter, owner=owner)
+            rental = RentItem.objects.get(pk=rental.pk)
+            rental.save()  # статус не менялся — событий нет
+            rental.status = 'returned'
+            rental.save()
+
+        created, changed = [call.args[0] for call in send.call_args_list]
+        self.assertEqual(created, [(owner.pk, {
+            'kind': 'rental', 'event': 'created', 'id': rental.pk,
+            'product_id': product.pk, 'status': 'rented', 'direction': 'in',
+        })])
+        self.assertEqual(
+            [(user_id, event['status']) for user_id, event in changed],
+            [(owner.pk, 'returned'), (renter.pk, 'returned')],
+        )
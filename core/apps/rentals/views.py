@@ -18,7 +18,7 @@ def rentals_list(request):
         type='rental',
         status='available',
         is_approved=True
-    ).exclude(user=request.user)
+    ).exclude(user=request.user).select_related('user')
     
     # Получаем ID товаров, которые уже арендуются (активная аренда)
     rented_product_ids = RentItem.objects.filter(
@@ -57,10 +57,10 @@ def rentals_list(request):
 def my_rentals(request):
     """Список всех аренд пользователя"""
     # Аренды, где пользователь - арендатор
-    rented_items = RentItem.objects.filter(renter=request.user)
+    rented_items = RentItem.objects.filter(renter=request.user).select_related('product', 'owner')
     
     # Аренды, где пользователь - владелец товара
-    owned_rentals = RentItem.objects.filter(owner=request.user)
+    owned_rentals = RentItem.objects.filter(owner=request.user).select_related('product', 'renter')
     
     # Фильтруем по статусу, если передан параметр
     status_filter = request.GET.get('status')
@@ -122,7 +122,7 @@ def my_rentals(request):
 def rental_detail(request, rental_id):
     """Детали аренды"""
     rental = get_object_or_404(
-        RentItem,
+        RentItem.objects.select_related('product', 'renter', 'owner'),
         id=rental_id
     )
     
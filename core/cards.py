@@ -0,0 +1,40 @@
+from django.core.cache import caches
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+
+from .category_tree import current_version
+
+CARD_TEMPLATE = 'product_card.html'
+CARD_TIMEOUT = 60 * 60 * 24
+
+
+def card_key(product, tree_version):
+    """
+    Ключ карточки: id + updated_at товара + версия дерева категорий.
+
+    Сохранение товара меняет updated_at, переименование категории — версию
+    дерева, поэтому устаревшая карточка просто перестаёт находиться и
+    вытесняется по таймауту; удалять ключи явно не нужно.
+    """
+    return f'core:card:{product.pk}:{product.updated_at.timestamp():.6f}:{tree_version}'
+
+
+def render_product_cards(products):
+    """HTML карточек в порядке products: готовые берутся из кэша одним запросом, остальные рендерятся"""
+    version = current_version()
+    keys = [card_key(p, version) for p in products]
+    cache = caches['fragments']
+    cached = cache.get_many(keys)
+
+    missing = {}
+    cards = []
+    for key, product in zip(keys, products):
+        html = cached.get(key)
+        if html is None:
+            html = render_to_string(CARD_TEMPLATE, {'product': product})
+            missing[key] = html
+        cards.append(mark_safe(html))
+
+    if missing:
+        cache.set_many(missing, CARD_TIMEOUT)
+    return cards
@@ -0,0 +1,89 @@
+import threading
+import uuid
+from collections import defaultdict
+
+from django.core.cache import cache
+from django.db import connection, transaction
+
+VERSION_KEY = 'core:category_tree_version'
+
+_lock = threading.Lock()
+_tree = None
+
+
+class CategoryTree:
+    """Снимок дерева категорий в памяти процесса"""
+
+    def __init__(self, version, categories):
+        self.version = version
+        self.nodes = {}
+        self._children = defaultdict(list)
+        for cat in categories:
+            self.nodes[cat.pk] = cat
+            self._children[cat.parent_id].append(cat)
+
+    def get(self, pk):
+        return self.nodes.get(pk)
+
+    def roots(self):
+        return self._children[None]
+
+    def children(self, pk):
+        return self._children.get(pk, [])
+
+    def ancestors(self, pk):
+        """Узлы от корня до pk включительно"""
+        node = self.nodes.get(pk)
+        if node is None:
+            return []
+        return [self.nodes[int(i)] for i in node.path.split('/')[:-1] if int(i) in self.nodes]
+
+
+def current_version():
+    """Общая для всех процессов версия дерева (хранится в кэше Django)"""
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        cache.add(VERSION_KEY, uuid.uuid4().hex, None)
+        version = cache.get(VERSION_KEY)
+    return version
+
+
+def get_category_tree():
+    """
+    Дерево категорий, собранное один раз на процесс.
+
+    Пересобирается, только когда сменилась общая версия. Внутри транзакции
+    дерево читается заново и не кэшируется: незакоммиченные изменения не
+    должны попасть в общий для потоков снимок.
+    """
+    global _tree
+    from .models import Category
+
+    version = current_version()
+    tree = _tree
+    if tree is not None and tree.version == version:
+        return tree
+
+    if connection.in_atomic_block:
+        return CategoryTree(version, Category.objects.order_by('pk'))
+
+    with _lock:
+        if _tree is None or _tree.version != version:
+            _tree = CategoryTree(version, list(Category.objects.order_by('pk')))
+        return _tree
+
+
+def _bump_version():
+    cache.set(VERSION_KEY, uuid.uuid4().hex, None)
+
+
+def invalidate_category_tree():
+    """
+    Сменить версию дерева во всех процессах.
+
+    Меняем сразу (чтобы текущая транзакция увидела свои изменения) и ещё раз
+    после коммита: процесс, успевший прочитать старые данные между этими
+    моментами, не закэширует их надолго.
+    """
+    _bump_version()
+    transaction.on_commit(_bump_version)
@@ -0,0 +1,370 @@
+"""
+Слой каналов для одного хоста без Redis.
+
+Брокер (manage.py channel_broker) слушает Unix-сокет и хранит только
+группы и то, какому процессу принадлежит канал. Имена каналов, как и в
+channels_redis, процессные: "<префикс процесса>!<случайная часть>".
+Сообщение в канал или группу брокер пересылает процессу-владельцу, а тот
+кладёт его в локальную очередь канала. Если процесс умер, брокер
+забывает его каналы и членство в группах.
+
+Брокер состояния не хранит на диске: после его перезапуска клиент сам
+подключается заново, повторяет hello и group_add своих каналов. Сообщения,
+отправленные, пока брокера не было, теряются.
+
+Кадры на сокете — 4 байта длины и msgpack, как сериализует channels_redis.
+"""
+import asyncio
+import itertools
+import logging
+import os
+import random
+import string
+import struct
+import time
+import uuid
+import weakref
+from collections import defaultdict
+
+import msgpack
+from channels.exceptions import ChannelFull
+from channels.layers import BaseChannelLayer
+
+logger = logging.getLogger(__name__)
+
+HEADER = struct.Struct('>I')
+# Сколько неотправленных байт брокер держит для одного процесса: дальше доставки
+# ему отбрасываются (ChannelFull), а не копятся в памяти брокера
+MAX_BUFFER = 8 * 1024 * 1024
+
+
+async def read_frame(reader):
+    size, = HEADER.unpack(await reader.readexactly(HEADER.size))
+    return msgpack.unpackb(await reader.readexactly(size), raw=False)
+
+
+def write_frame(writer, frame):
+    data = msgpack.packb(frame, use_bin_type=True)
+    writer.write(HEADER.pack(len(data)) + data)
+
+
+def owner_of(channel):
+    return channel.partition('!')[0]
+
+
+class Broker:
+    """Процесс-маршрутизатор: группы и владельцы каналов"""
+
+    def __init__(self, group_expiry=86400, max_buffer=MAX_BUFFER):
+        self.group_expiry = group_expiry
+        self.max_buffer = max_buffer
+        self.owners = {}                 # префикс процесса -> writer его соединения
+        self.groups = defaultdict(dict)  # группа -> {канал: когда истекает}
+        self.stalled = set()             # процессы, чей буфер переполнен (для лога)
+
+    async def handle(self, reader, writer):
+        prefix = None
+        try:
+            while True:
+                try:
+                    frame = await read_frame(reader)
+                except (asyncio.IncompleteReadError, ConnectionError):
+                    break
+                op = frame['op']
+                if op == 'hello':
+                    prefix = frame['prefix']
+                    self.owners[prefix] = writer
+                elif op == 'send':
+                    try:
+                        self.deliver(frame['channel'], frame['message'])
+                    except ChannelFull:
+                        write_frame(writer, {'op': 'ack', 'id': frame['id'], 'error': 'full'})
+                        await writer.drain()
+                        continue
+                elif op == 'group_add':
+                    self.groups[frame['group']][frame['channel']] = time.time() + self.group_expiry
+                elif op == 'group_discard':
+                    self.groups.get(frame['group'], {}).pop(frame['channel'], None)
+                elif op == 'group_send':
+                    self.group_send(frame['group'], frame['message'])
+                elif op == 'flush':
+                    self.groups.clear()
+                write_frame(writer, {'op': 'ack', 'id': frame['id']})
+                await writer.drain()
+        finally:
+            if prefix and self.owners.get(prefix) is writer:
+                del self.owners[prefix]
+                self.stalled.discard(prefix)
+                self.forget(prefix)
+            writer.close()
+
+    def deliver(self, channel, message):
+        """
+        Переслать сообщение процессу-владельцу; False — процесса больше нет.
+
+        Доставки не ждут drain: один зависший воркер не должен тормозить
+        остальных. Вместо этого буфер соединения ограничен max_buffer —
+        сверх него ChannelFull, как у переполненного канала.
+        """
+        prefix = owner_of(channel)
+        writer = self.owners.get(prefix)
+        if writer is None or writer.is_closing():
+            return False
+        if writer.transport.get_write_buffer_size() > self.max_buffer:
+            if prefix not in self.stalled:
+                self.stalled.add(prefix)
+                logger.warning("Процесс %s не читает доставки, сообщения ему отбрасываются", prefix)
+            raise ChannelFull(channel)
+        self.stalled.discard(prefix)
+        write_frame(writer, {'op': 'deliver', 'channel': channel, 'message': message})
+        return True
+
+    def group_send(self, group, message):
+        now = time.time()
+        members = self.groups.get(group, {})
+        for channel, expires in list(members.items()):
+            try:
+                delivered = expires >= now and self.deliver(channel, message)
+            except ChannelFull:
+                continue  # как channels_redis: group_send в полный канал молча теряется
+            if not delivered:
+                del members[channel]
+        if not members:
+            self.groups.pop(group, None)
+
+    def forget(self, prefix):
+        for group, members in list(self.groups.items()):
+            for channel in [c for c in members if owner_of(c) == prefix]:
+                del members[channel]
+            if not members:
+                del self.groups[group]
+
+
+async def serve(path, group_expiry=86400, max_buffer=MAX_BUFFER):
+    """Запустить брокер на Unix-сокете path (старый файл сокета удаляется)"""
+    if os.path.exists(path):
+        os.unlink(path)
+    broker = Broker(group_expiry=group_expiry, max_buffer=max_buffer)
+    server = await asyncio.start_unix_server(broker.handle, path=path)
+    os.chmod(path, 0o660)
+    async with server:
+        await server.serve_forever()
+
+
+class _Connection:
+    """Соединение с брокером в рамках одного event loop"""
+
+    def __init__(self, layer, reader, writer):
+        self.layer = layer
+        self.reader, self.writer = reader, writer
+        self.ids = itertools.count()
+        self.pending = {}
+        self.registered = False
+        self.task = asyncio.ensure_future(self.read_loop())
+
+    async def read_loop(self):
+        try:
+            while True:
+                frame = await read_frame(self.reader)
+                if frame['op'] == 'deliver':
+                    self.layer._put(frame['channel'], frame['message'])
+                else:
+                    future = self.pending.pop(frame['id'], None)
+                    if future and not future.done():
+                        if frame.get('error') == 'full':
+                            future.set_exception(ChannelFull())
+                        else:
+                            future.set_result(None)
+        except (asyncio.IncompleteReadError, ConnectionError) as exc:
+            for future in self.pending.values():
+                if not future.done():
+                    future.set_exception(ConnectionError(f'Брокер каналов закрыл соединение: {exc}'))
+            self.pending.clear()
+            if self.registered:
+                # Брокер забыл владельца каналов и группы — без восстановления открытые сокеты оглохнут
+                logger.warning("Соединение с брокером каналов потеряно, восстанавливаем")
+                asyncio.ensure_future(self.layer._restore())
+
+    async def request(self, op, **fields):
+        if self.task.done():
+            raise ConnectionError('Нет соединения с брокером каналов')
+        request_id = next(self.ids)
+        future = asyncio.get_running_loop().create_future()
+        self.pending[request_id] = future
+        write_frame(self.writer, {'op': op, 'id': request_id, **fields})
+        await self.writer.drain()
+        await future
+
+
+class UnixSocketChannelLayer(BaseChannelLayer):
+    """
+    Клиент брокера core.channel_layers.serve.
+
+    Годится для нескольких процессов одного хоста (воркеры gunicorn/uvicorn).
+    Поддерживаются только процессные каналы (их выдаёт new_channel —
+    ими пользуются консьюмеры) и группы; именованные каналы для runworker
+    требуют channels_redis.
+    """
+
+    extensions = ['groups', 'flush']
+
+    def __init__(self, path, expiry=60, group_expiry=86400, capacity=100, channel_capacity=None):
+        super().__init__(expiry=expiry, capacity=capacity, channel_capacity=channel_capacity)
+        self.path = str(path)
+        self.group_expiry = group_expiry
+        self.client_prefix = f'unix.{uuid.uuid4().hex[:12]}'
+        self._queues = {}                # канал -> очередь (истекает, сообщение)
+        self._groups = defaultdict(set)  # группа -> локальные каналы: повторить group_add после рестарта брокера
+        self._next_clean = 0
+        # async_to_sync в синхронном коде создаёт свой loop — соединение у каждого loop своё
+        self._connections = weakref.WeakKeyDictionary()
+
+    async def _connection(self):
+        loop = asyncio.get_running_loop()
+        connection = self._connections.get(loop)
+        if connection is None or connection.task.done():
+            reader, writer = await asyncio.open_unix_connection(self.path)
+            connection = self._connections[loop] = _Connection(self, reader, writer)
+        return connection
+
+    async def _receiving_connection(self):
+        # Владельцем каналов процесса становится соединение того loop, который их читает
+        connection = await self._connection()
+        if not connection.registered:
+            await connection.request('hello', prefix=self.client_prefix)
+            connection.registered = True
+        return connection
+
+    def _queue(self, channel):
+        if channel not in self._queues:
+            self._queues[channel] = asyncio.Queue(maxsize=self.get_capacity(channel))
+        return self._queues[channel]
+
+    def _put(self, channel, message):
+        self._clean_expired()
+        try:
+            self._queue(channel).put_nowait((time.time() + self.expiry, message))
+        except asyncio.QueueFull:
+            logger.warning("Канал %s переполнен, сообщение отброшено", channel)
+
+    def _clean_expired(self):
+        """
+        Не чаще раза в секунду: сообщения старше expiry никто уже не заберёт.
+
+        Такой канал считается закрытым (консьюмер ушёл, а доставка пришла
+        позже) — очередь удаляется, канал выходит из групп.
+        """
+        now = time.time()
+        if now < self._next_clean:
+            return
+        self._next_clean = now + 1
+        for channel, queue in list(self._queues.items()):
+            if queue.empty() or queue._queue[0][0] >= now:
+                continue
+            while not queue.empty() and queue._queue[0][0] < now:
+                queue.get_nowait()
+            if queue.empty():
+                del self._queues[channel]
+            groups = [group for group, channels in self._groups.items() if channel in channels]
+            for group in groups:
+                self._untrack(group, channel)
+            if groups:
+                asyncio.ensure_future(self._discard_remote(channel, groups))
+
+    async def _discard_remote(self, channel, groups):
+        try:
+            connection = await self._connection()
+            for group in groups:
+                await connection.request('group_discard', group=group, channel=channel)
+        except (ConnectionError, OSError):
+            pass
+
+    def _untrack(self, group, channel):
+        channels = self._groups.get(group)
+        if channels is not None:
+            channels.discard(channel)
+            if not channels:
+                del self._groups[group]
+
+    async def _restore(self):
+        """Заново зарегистрироваться у брокера и вернуть локальные каналы в их группы"""
+        delay = 0.1
+        while True:
+            try:
+                connection = await self._receiving_connection()
+                for group, channels in list(self._groups.items()):
+                    for channel in list(channels):
+                        await connection.request('group_add', group=group, channel=channel)
+            except (ConnectionError, OSError):
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 5)
+                continue
+            logger.info("Соединение с брокером каналов восстановлено")
+            return
+
+    def _is_local(self, channel):
+        return owner_of(channel) == self.client_prefix
+
+    # Channel layer API
+
+    async def new_channel(self, prefix='specific'):
+        await self._receiving_connection()
+        suffix = ''.join(random.choice(string.ascii_letters) for _ in range(12))
+        return f'{self.client_prefix}!{prefix}.{suffix}'
+
+    async def send(self, channel, message):
+        assert isinstance(message, dict), 'message is not a dict'
+        assert self.valid_channel_name(channel), 'Channel name not valid'
+        if self._is_local(channel):
+            self._clean_expired()
+            try:
+                self._queue(channel).put_nowait((time.time() + self.expiry, message))
+            except asyncio.QueueFull:
+                raise ChannelFull(channel)
+            return
+        connection = await self._connection()
+        await connection.request('send', channel=channel, message=message)
+
+    async def receive(self, channel):
+        assert self.valid_channel_name(channel)
+        if not self._is_local(channel):
+            raise NotImplementedError('Именованные каналы поддерживает только channels_redis')
+        await self._receiving_connection()
+        while True:
+            queue = self._queue(channel)
+            try:
+                expires, message = await queue.get()
+            finally:
+                if queue.empty():
+                    self._queues.pop(channel, None)
+            if expires >= time.time():
+                return message
+
+    async def group_add(self, group, channel):
+        assert self.valid_group_name(group), 'Group name not valid'
+        assert self.valid_channel_name(channel), 'Channel name not valid'
+        if self._is_local(channel):
+            self._groups[group].add(channel)
+            connection = await self._receiving_connection()
+        else:
+            connection = await self._connection()
+        await connection.request('group_add', group=group, channel=channel)
+
+    async def group_discard(self, group, channel):
+        assert self.valid_group_name(group), 'Group name not valid'
+        assert self.valid_channel_name(channel), 'Channel name not valid'
+        self._untrack(group, channel)
+        connection = await self._connection()
+        await connection.request('group_discard', group=group, channel=channel)
+
+    async def group_send(self, group, message):
+        assert isinstance(message, dict), 'Message is not a dict'
+        assert self.valid_group_name(group), 'Group name not valid'
+        connection = await self._connection()
+        await connection.request('group_send', group=group, message=message)
+
+    async def flush(self):
+        self._queues.clear()
+        self._groups.clear()
+        connection = await self._connection()
+        await connection.request('flush')
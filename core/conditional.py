@@ -0,0 +1,99 @@
+import hashlib
+import time
+import uuid
+from datetime import datetime, timezone
+
+from django.core.cache import cache
+from django.db import transaction
+
+from .category_tree import current_version as tree_version
+
+CATALOG_VERSION_KEY = 'core:catalog_version'
+
+
+def _new_version():
+    # Время смены впереди — из версии получается Last-Modified (catalog_changed_at)
+    return f'{time.time():.6f}-{uuid.uuid4().hex}'
+
+
+def catalog_version():
+    """Общая версия ленты: меняется при любом изменении товаров"""
+    version = cache.get(CATALOG_VERSION_KEY)
+    if version is None:
+        cache.add(CATALOG_VERSION_KEY, _new_version(), None)
+        version = cache.get(CATALOG_VERSION_KEY)
+    return version
+
+
+def catalog_changed_at():
+    """Момент последней смены версии каталога или None для версий старого формата"""
+    try:
+        return datetime.fromtimestamp(float(catalog_version().split('-', 1)[0]), timezone.utc)
+    except ValueError:
+        return None
+
+
+def _bump_catalog_version():
+    cache.set(CATALOG_VERSION_KEY, _new_version(), None)
+
+
+def invalidate_catalog():
+    """Как и для дерева категорий: сразу и ещё раз после коммита"""
+    _bump_catalog_version()
+    transaction.on_commit(_bump_catalog_version)
+
+
+def _etag(*parts):
+    return hashlib.md5(':'.join(str(p) for p in parts).encode()).hexdigest()
+
+
+def _viewer(request):
+    # Страницы различаются по пользователю (шапка, свои товары) и CSRF-токену в формах
+    return request.user.pk, request.META.get('CSRF_COOKIE', '')
+
+
+def home_etag(request, *args, **kwargs):
+    """ETag ленты без обращения к базе: версии каталога и дерева + параметры запроса"""
+    if request.user.is_authenticated and not request.session.get('onboarded', False):
+        return None
+    return _etag(
+        catalog_version(), tree_version(), *_viewer(request),
+        request.headers.get('Accept', ''), request.GET.urlencode(),
+    )
+
+
+def subcategories_etag(request, category_id):
+    return _etag(tree_version(), category_id)
+
+
+def _product_state(request, product_id):
+    """(updated_at, виден ли товар пользователю) одним запросом по первичному ключу"""
+    from .models import Product
+
+    cached = getattr(request, '_product_state', None)
+    if cached is None:
+        row = Product.objects.filter(pk=product_id).values_list(
+            'updated_at', 'is_approved', 'user_id', 'similarity__updated_at',
+        ).first()
+        cached = request._product_state = row or (None, False, None, None)
+    updated_at, is_approved, user_id, similar_at = cached
+    if similar_at and updated_at:
+        # Блок "похожие" пересчитывается отдельно от самого товара
+        updated_at = max(updated_at, similar_at)
+    return updated_at, bool(updated_at) and (is_approved or user_id == request.user.pk)
+
+
+def product_etag(request, product_id):
+    # Версия каталога — за блок "похожие": их названия, статусы и картинки меняются без товара
+    updated_at, visible = _product_state(request, product_id)
+    if not visible:
+        return None
+    return _etag(updated_at.isoformat(), catalog_version(), tree_version(), *_viewer(request))
+
+
+def product_last_modified(request, product_id):
+    updated_at, visible = _product_state(request, product_id)
+    if not visible:
+        return None
+    changed_at = catalog_changed_at()
+    return max(updated_at, changed_at) if changed_at else updated_at
@@ -0,0 +1,29 @@
+from channels.generic.websocket import AsyncJsonWebsocketConsumer
+
+from .notifications import user_group
+
+
+class NotificationConsumer(AsyncJsonWebsocketConsumer):
+    """
+    Личный канал пользователя: события по заявкам, арендам и дельты списка чатов.
+
+    Клиент ничего не присылает, база при подключении не читается —
+    пользователь уже в scope, группа строится по его id.
+    """
+
+    async def connect(self):
+        user = self.scope.get('user')
+        if not user or user.is_anonymous:
+            await self.close()
+            return
+        self.group_name = user_group(user.id)
+        await self.channel_layer.group_add(self.group_name, self.channel_name)
+        await self.accept()
+
+    async def disconnect(self, close_code):
+        if hasattr(self, 'group_name'):
+            await self.channel_layer.group_discard(self.group_name, self.channel_name)
+
+    # Вызывается через group_send из core.notifications
+    async def notify(self, event):
+        await self.send_json(event['event'])
@@ -0,0 +1,161 @@
+from collections import Counter
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F
+
+from .conditional import invalidate_catalog
+from .similarity import schedule_fold_in, schedule_remove
+
+
+def is_listed(is_approved, status):
+    """Товар учитывается в счётчиках категорий: одобрен и доступен"""
+    return bool(is_approved) and status == 'available'
+
+
+def path_ids(path):
+    """"1/5/12/" -> [1, 5, 12]: узел и все его предки"""
+    return [int(i) for i in path.split('/')[:-1]]
+
+
+def apply_deltas(deltas):
+    """
+    Прибавить к счётчикам веток {category_path: delta}.
+
+    Дельты сначала сводятся по узлам, затем по одному UPDATE ... SET
+    available = available + N на каждое значение N: инкремент делает база,
+    поэтому параллельные изменения не затирают друг друга.
+    """
+    from .models import CategoryCounter
+
+    per_node = Counter()
+    for path, delta in deltas.items():
+        if path and delta:
+            for pk in path_ids(path):
+                per_node[pk] += delta
+
+    by_delta = {}
+    for pk, delta in per_node.items():
+        if delta:
+            by_delta.setdefault(delta, []).append(pk)
+    for delta, ids in by_delta.items():
+        CategoryCounter.objects.filter(category_id__in=ids).update(available=F('available') + delta)
+
+
+def set_approved(queryset, approved):
+    """
+    queryset.update(is_approved=...) с поправкой счётчиков.
+
+    Массовый update не вызывает save() и сигналы, поэтому считаем, сколько
+    доступных товаров в каждой ветке реально меняют статус модерации.
+    """
+    with transaction.atomic():
+        changing = queryset.filter(status='available').exclude(is_approved=approved)
+        sign = 1 if approved else -1
+        deltas = {
+            row['category_path']: sign * row['n']
+            for row in changing.values('category_path').annotate(n=Count('pk')).order_by()
+        }
+        changed_ids = list(queryset.exclude(is_approved=approved).values_list('pk', flat=True))
+        updated = queryset.update(is_approved=approved, version=F('version') + 1)
+        apply_deltas(deltas)
+        invalidate_catalog()
+        if approved:
+            schedule_fold_in(changed_ids)
+        else:
+            schedule_remove(changed_ids)
+    return updated
+
+
+def request_status_deltas(trade_request, old_status, new_status):
+    """Дельты счётчиков заявок при смене статуса (None — заявки не было / больше нет)"""
+    deltas = Counter()
+    for user_id, direction in ((trade_request.owner_id, 'in'), (trade_request.requester_id, 'out')):
+        if old_status:
+            deltas[(user_id, direction, old_status)] -= 1
+        if new_status:
+            deltas[(user_id, direction, new_status)] += 1
+    return deltas
+
+
+def apply_request_deltas(deltas):
+    """{(user_id, direction, status): delta} -> UPDATE count = count + delta, строка создаётся при первом обращении"""
+    from .models import TradeRequestCounter
+
+    for (user_id, direction, status), delta in deltas.items():
+        if not delta:
+            continue
+        counter = TradeRequestCounter.objects.filter(user_id=user_id, direction=direction, status=status)
+        if counter.update(count=F('count') + delta):
+            continue
+        try:
+            with transaction.atomic():
+                TradeRequestCounter.objects.create(user_id=user_id, direction=direction, status=status, count=delta)
+        except IntegrityError:
+            # Строку успел создать параллельный запрос
+            counter.update(count=F('count') + delta)
+
+
+def reconcile(dry_run=False):
+    """
+    Пересчитать счётчики с нуля и исправить расхождения.
+
+    Возвращает {category_id: (было, стало)} для исправленных узлов.
+    """
+    from .models import Category, CategoryCounter, Product
+
+    with transaction.atomic():
+        actual = Counter()
+        rows = (
+            Product.objects.filter(is_approved=True, status='available')
+            .exclude(category_path='')
+            .values('category_path').annotate(n=Count('pk')).order_by()
+        )
+        for row in rows:
+            for pk in path_ids(row['category_path']):
+                actual[pk] += row['n']
+
+        stored = dict(CategoryCounter.objects.values_list('category_id', 'available'))
+        fixes = {}
+        for pk in Category.objects.values_list('pk', flat=True):
+            if stored.get(pk) != actual[pk]:
+                fixes[pk] = (stored.get(pk), actual[pk])
+
+        if not dry_run:
+            for pk, (_, value) in fixes.items():
+                CategoryCounter.objects.update_or_create(category_id=pk, defaults={'available': value})
+    return fixes
+
+
+def reconcile_requests(dry_run=False):
+    """
+    Пересчитать счётчики заявок.
+
+    Возвращает {(user_id, direction, status): (было, стало)} для исправленных строк.
+    """
+    from .models import TradeRequest, TradeRequestCounter
+
+    with transaction.atomic():
+        actual = Counter()
+        for field, direction in (('owner_id', 'in'), ('requester_id', 'out')):
+            rows = TradeRequest.objects.values_list(field, 'status').annotate(n=Count('pk')).order_by()
+            for user_id, status, n in rows:
+                actual[(user_id, direction, status)] = n
+
+        stored = {
+            (user_id, direction, status): count
+            for user_id, direction, status, count in TradeRequestCounter.objects.values_list(
+                'user_id', 'direction', 'status', 'count',
+            )
+        }
+        fixes = {
+            key: (stored.get(key), actual[key])
+            for key in stored.keys() | actual.keys()
+            if stored.get(key, 0) != actual[key]
+        }
+
+        if not dry_run:
+            for (user_id, direction, status), (_, value) in fixes.items():
+                TradeRequestCounter.objects.update_or_create(
+                    user_id=user_id, direction=direction, status=status, defaults={'count': value},
+                )
+    return fixes
@@ -1,5 +1,66 @@
 from django import forms
-from .models import Product, Category
+from django.forms.models import ModelChoiceIterator
+
+from .category_tree import get_category_tree
+from .models import Product
+
+
+class CategoryChoiceIterator(ModelChoiceIterator):
+    def __iter__(self):
+        if self.field.empty_label is not None:
+            yield ("", self.field.empty_label)
+        for node in self.field.nodes():
+            yield self.choice(node)
+
+    def __len__(self):
+        return len(self.field.nodes()) + (self.field.empty_label is not None)
+
+    def __bool__(self):
+        return self.field.empty_label is not None or bool(self.field.nodes())
+
+
+class CategoryChoiceField(forms.ModelChoiceField):
+    """
+    Выбор категории из закэшированного дерева: ни отрисовка вариантов,
+    ни проверка значения не обращаются к базе.
+    """
+    iterator = CategoryChoiceIterator
+
+    def __init__(self, *args, **kwargs):
+        # По умолчанию варианты — корневые категории
+        self.parent_id = None
+        self.hidden = False
+        super().__init__(*args, **kwargs)
+
+    def limit_to_children(self, parent_id):
+        self.parent_id = parent_id
+        self.hidden = False
+
+    def clear(self):
+        self.hidden = True
+
+    def nodes(self):
+        if self.hidden:
+            return []
+        tree = get_category_tree()
+        return tree.roots() if self.parent_id is None else tree.children(self.parent_id)
+
+    def to_python(self, value):
+        if value in self.empty_values:
+            return None
+        try:
+            pk = int(getattr(value, 'pk', value))
+        except (ValueError, TypeError):
+            pk = None
+        node = next((n for n in self.nodes() if n.pk == pk), None)
+        if node is None:
+            raise forms.ValidationError(
+                self.error_messages['invalid_choice'],
+                code='invalid_choice',
+                params={'value': value},
+            )
+        return node
+
 
 class ProductForm(forms.ModelForm):
     class Meta:
@@ -15,33 +76,38 @@ class ProductForm(forms.ModelForm):
             'sub_subcategory',
             'image'
         ]
+        field_classes = {
+            'main_category': CategoryChoiceField,
+            'subcategory': CategoryChoiceField,
+            'sub_subcategory': CategoryChoiceField,
+        }
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
 
         # ✅ Отображать только корневые категории в "Основной категории"
-        self.fields['main_category'].queryset = Category.objects.filter(parent__isnull=True)
+        self.fields['main_category'].limit_to_children(None)
 
         # По умолчанию скрываем подкатегории (отображаются через JS)
-        self.fields['subcategory'].queryset = Category.objects.none()
-        self.fields['sub_subcategory'].queryset = Category.objects.none()
+        self.fields['subcategory'].clear()
+        self.fields['sub_subcategory'].clear()
 
         # Если пользователь выбрал основную категорию — показываем подкатегории
         if 'main_category' in self.data:
             try:
                 main_id = int(self.data.get('main_category'))
-                self.fields['subcategory'].queryset = Category.objects.filter(parent_id=main_id)
+                self.fields['subcategory'].limit_to_children(main_id)
             except (ValueError, TypeError):
                 pass
-        elif self.instance.pk and self.instance.main_category:
-            self.fields['subcategory'].queryset = Category.objects.filter(parent=self.instance.main_category)
+        elif self.instance.pk and self.instance.main_category_id:
+            self.fields['subcategory'].limit_to_children(self.instance.main_category_id)
 
         # Если пользователь выбрал подкатегорию — показываем под-подкатегории
         if 'subcategory' in self.data:
             try:
                 sub_id = int(self.data.get('subcategory'))
-                self.fields['sub_subcategory'].queryset = Category.objects.filter(parent_id=sub_id)
+                self.fields['sub_subcategory'].limit_to_children(sub_id)
             except (ValueError, TypeError):
                 pass
-        elif self.instance.pk and self.instance.subcategory:
-            self.fields['sub_subcategory'].queryset = Category.objects.filter(parent=self.instance.subcategory)
+        elif self.instance.pk and self.instance.subcategory_id:
+            self.fields['sub_subcategory'].limit_to_children(self.instance.subcategory_id)
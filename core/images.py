@@ -0,0 +1,106 @@
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.core.files.base import ContentFile
+from django.db import connections, transaction
+from django.db.models import F
+from django.utils import timezone
+from PIL import Image, ImageOps
+
+from .conditional import invalidate_catalog
+
+logger = logging.getLogger(__name__)
+
+# Имя варианта -> максимальная сторона в пикселях
+VARIANTS = {
+    'grid': 360,      # карточка в ленте: 180px при плотности 2x
+    'detail': 600,    # страница товара
+    'retina': 1200,   # страница товара при плотности 2x
+}
+WEBP_QUALITY = 80
+
+_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='image-variants')
+
+
+def variant_name(name, variant):
+    """product_images/photo.jpg -> product_images/variants/photo.jpg_grid.webp
+
+    Расширение оригинала остаётся в имени, чтобы photo.jpg и photo.png не делили
+    варианты, а отдельный каталог не пересекается с загрузками в upload_to.
+    """
+    head, tail = os.path.split(name)
+    return os.path.join(head, 'variants', f'{tail}_{variant}.webp')
+
+
+def delete_variants(name, storage):
+    """Удалить нарезанные копии изображения name"""
+    for variant in VARIANTS:
+        path = variant_name(name, variant)
+        try:
+            if storage.exists(path):
+                storage.delete(path)
+        except OSError:
+            logger.exception("Не удалось удалить вариант %s", path)
+
+
+def schedule_variant_cleanup(name, storage):
+    """Удаление копий прежней картинки после коммита: при откате они ещё нужны"""
+    if name:
+        transaction.on_commit(lambda: delete_variants(name, storage))
+
+
+def generate_variants(product):
+    """Нарезать WebP-варианты изображения товара и сложить рядом с оригиналом"""
+    from .models import Product
+
+    field = product.image
+    storage = field.storage
+    with storage.open(field.name, 'rb') as f:
+        image = ImageOps.exif_transpose(Image.open(f))
+        image.load()
+
+    if image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA' if 'transparency' in image.info else 'RGB')
+
+    for variant, size in VARIANTS.items():
+        resized = image.copy()
+        resized.thumbnail((size, size), Image.LANCZOS)
+        buffer = BytesIO()
+        resized.save(buffer, 'WEBP', quality=WEBP_QUALITY, method=4)
+
+        name = variant_name(field.name, variant)
+        if storage.exists(name):
+            storage.delete(name)
+        storage.save(name, ContentFile(buffer.getvalue()))
+
+    # Отмечаем готовность, только если картинку не успели заменить;
+    # updated_at сбрасывает закэшированную карточку со старым <img>
+    if Product.objects.filter(pk=product.pk, image=field.name).update(
+        # version растёт, чтобы открытые формы редактирования заметили эту запись
+        image_variants_ready=True, updated_at=timezone.now(), version=F('version') + 1,
+    ):
+        invalidate_catalog()
+    else:
+        # Картинку заменили или товар удалили, пока шла нарезка, — копии никому не нужны
+        delete_variants(field.name, storage)
+
+
+def _generate_in_background(product_id):
+    from .models import Product
+
+    try:
+        product = Product.objects.only('id', 'image').filter(pk=product_id).first()
+        if product and product.image:
+            generate_variants(product)
+    except Exception:
+        logger.exception("Не удалось нарезать изображения товара %s", product_id)
+    finally:
+        # У потока своё соединение с базой — закрываем его сами
+        connections.close_all()
+
+
+def schedule_variants(product_id):
+    """Нарезка после коммита в фоновом потоке, вне цикла запрос/ответ"""
+    transaction.on_commit(lambda: _executor.submit(_generate_in_background, product_id))
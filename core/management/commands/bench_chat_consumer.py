@@ -0,0 +1,103 @@
+import asyncio
+import json
+import time
+import uuid
+
+from asgiref.testing import ApplicationCommunicator
+from channels.db import database_sync_to_async
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+
+from core.apps.chat.consumers import ChatConsumer
+from core.apps.chat.models import Chat, Message
+
+
+class LegacyChatConsumer(ChatConsumer):
+    """Горячий путь ChatConsumer до оптимизации — для сравнения в --legacy"""
+
+    async def receive(self, text_data=None, bytes_data=None):
+        text = json.loads(text_data).get('text', '').strip()
+        user = self.scope['user']
+        message = await self._legacy_create(user.id, self.chat_id, text)
+        payload = {
+            'type': 'chat.message',
+            'id': message.id,
+            'sender': user.username,
+            'sender_id': user.id,
+            'text': message.text,
+            'status': message.status,
+            'is_read': message.is_read,
+            'created_at': message.created_at.isoformat(),
+            'is_own': True,
+        }
+        await self.channel_layer.group_send(self.group_name, {'type': 'chat_message', 'message': payload})
+
+    async def chat_message(self, event):
+        message = event['message']
+        if message.get('sender') != self.scope['user'].username:
+            message['is_own'] = False
+        await self.send(text_data=json.dumps(message))
+
+    @database_sync_to_async
+    def _legacy_create(self, user_id, chat_id, text):
+        user = User.objects.get(id=user_id)
+        chat = Chat.objects.get(id=chat_id)
+        return Message.objects.create(chat=chat, sender=user, text=text)
+
+
+class Command(BaseCommand):
+    help = 'Measure ChatConsumer throughput in one worker: messages sent through a socket and fanned out to every tab'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--messages', type=int, default=500)
+        parser.add_argument('--sockets', type=int, default=4, help='Open tabs in the chat, split between two users')
+        parser.add_argument('--text-size', type=int, default=200)
+        parser.add_argument(
+            '--legacy', action='store_true',
+            help='Use the old receive/chat_message path (per-message SELECTs, per-recipient json.dumps)',
+        )
+
+    def handle(self, *args, **options):
+        tag = uuid.uuid4().hex[:8]
+        users = [User.objects.create_user(username=f'bench-chat-{tag}-{i}') for i in range(2)]
+        chat = Chat.objects.create()
+        chat.participants.add(*users)
+
+        consumer = LegacyChatConsumer if options['legacy'] else ChatConsumer
+        try:
+            elapsed = asyncio.run(self._run(consumer, chat, users, options))
+        finally:
+            chat.delete()
+            User.objects.filter(pk__in=[u.pk for u in users]).delete()
+
+        messages, sockets = options['messages'], options['sockets']
+        mode = 'legacy' if options['legacy'] else 'current'
+        self.stdout.write(
+            f'{mode}: {messages} messages x {sockets} sockets in {elapsed:.2f}s, '
+            f'{messages / elapsed:.0f} messages/s, {messages * sockets / elapsed:.0f} deliveries/s per worker'
+        )
+
+    async def _run(self, consumer, chat, users, options):
+        sockets = []
+        for i in range(options['sockets']):
+            communicator = ApplicationCommunicator(consumer.as_asgi(), {
+                'type': 'websocket', 'path': f'/ws/chat/{chat.pk}/', 'headers': [], 'subprotocols': [],
+                'query_string': b'', 'user': users[i % 2],
+                'url_route': {'args': (), 'kwargs': {'chat_id': str(chat.pk)}},
+            })
+            await communicator.send_input({'type': 'websocket.connect'})
+            await communicator.receive_output()
+            sockets.append(communicator)
+
+        frame = json.dumps({'text': 'x' * options['text_size']})
+        start = time.perf_counter()
+        for _ in range(options['messages']):
+            await sockets[0].send_input({'type': 'websocket.receive', 'text': frame})
+            for communicator in sockets:
+                await communicator.receive_output(timeout=10)
+        elapsed = time.perf_counter() - start
+
+        for communicator in sockets:
+            await communicator.send_input({'type': 'websocket.disconnect', 'code': 1000})
+            await communicator.wait()
+        return elapsed
@@ -0,0 +1,97 @@
+import threading
+import time
+import uuid
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import DatabaseError, connections
+
+from core.models import Product, TradeRequest
+from core.reservations import ReservationError, reserve_product
+
+
+class Command(BaseCommand):
+    help = 'Hammer one product with concurrent reservations and check that exactly one wins each round'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=16)
+        parser.add_argument('--rounds', type=int, default=50)
+        parser.add_argument(
+            '--naive', action='store_true',
+            help='Use the old read-check-write flow instead of the conditional UPDATE, for comparison',
+        )
+
+    def handle(self, *args, **options):
+        threads, rounds = options['threads'], options['rounds']
+        tag = uuid.uuid4().hex[:8]
+        owner = User.objects.create_user(username=f'bench-owner-{tag}')
+        users = [User.objects.create_user(username=f'bench-{tag}-{i}') for i in range(threads)]
+        product = Product.objects.create(
+            user=owner, name='bench', phone='0', title=f'Bench {tag}', description='bench',
+            type='free', is_approved=True,
+        )
+
+        reserve = self._naive if options['naive'] else self._conditional
+        double_booked = errors = attempts = 0
+        elapsed = 0.0
+        try:
+            for _ in range(rounds):
+                Product.objects.filter(pk=product.pk).update(status='available')
+                TradeRequest.objects.filter(product=product).delete()
+
+                results = []
+                barrier = threading.Barrier(threads)
+                workers = [
+                    threading.Thread(target=self._worker, args=(reserve, product.pk, user, barrier, results))
+                    for user in users
+                ]
+                start = time.perf_counter()
+                for worker in workers:
+                    worker.start()
+                for worker in workers:
+                    worker.join()
+                elapsed += time.perf_counter() - start
+
+                attempts += len(results)
+                errors += results.count('error')
+                if TradeRequest.objects.filter(product=product).count() > 1:
+                    double_booked += 1
+        finally:
+            owner.delete()
+            User.objects.filter(pk__in=[u.pk for u in users]).delete()
+
+        mode = 'naive' if options['naive'] else 'conditional UPDATE'
+        self.stdout.write(
+            f'{mode}: {rounds} rounds x {threads} threads, '
+            f'{attempts / elapsed:.0f} attempts/s, {errors} database errors'
+        )
+        if double_booked:
+            self.stdout.write(self.style.ERROR(f'Double-booked in {double_booked} of {rounds} rounds'))
+        else:
+            self.stdout.write(self.style.SUCCESS('Exactly one reservation per round'))
+
+    def _worker(self, reserve, product_id, user, barrier, results):
+        try:
+            barrier.wait()
+            results.append('won' if reserve(product_id, user) else 'lost')
+        except DatabaseError:
+            results.append('error')
+        finally:
+            connections.close_all()
+
+    def _conditional(self, product_id, user):
+        product = Product.objects.get(pk=product_id)
+        try:
+            reserve_product(product, user, 'take')
+        except ReservationError:
+            return False
+        return True
+
+    def _naive(self, product_id, user):
+        # Как было в product_action до брони: проверка в Python, затем запись без условия
+        product = Product.objects.get(pk=product_id)
+        if product.status != 'available':
+            return False
+        TradeRequest.objects.create(product=product, requester=user, owner_id=product.user_id, action='take')
+        Product.objects.filter(pk=product_id).update(status='taken')
+        return True
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+
+from core.models import Product
+from core.similarity import fold_in, rebuild
+
+
+class Command(BaseCommand):
+    help = 'Rebuild precomputed "similar items" for approved products'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--missing', action='store_true',
+            help='Only fold in approved products that have no precomputed row yet',
+        )
+
+    def handle(self, *args, **options):
+        if not options['missing']:
+            count = rebuild()
+            self.stdout.write(self.style.SUCCESS(f'Rebuilt similar items for {count} products'))
+            return
+
+        qs = (
+            Product.objects.filter(is_approved=True, similarity__isnull=True)
+            .only('id', 'title', 'description', 'category_path').order_by('id')
+        )
+        count = 0
+        for product in qs.iterator(chunk_size=200):
+            fold_in(product)
+            count += 1
+        self.stdout.write(self.style.SUCCESS(f'Folded in {count} products'))
@@ -0,0 +1,27 @@
+import asyncio
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from core.channel_layers import MAX_BUFFER, serve
+
+
+class Command(BaseCommand):
+    help = 'Run the single-host channel layer broker (CHANNEL_LAYER=unix) on a Unix socket'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--socket', default=getattr(settings, 'CHANNEL_SOCKET', None),
+            help='Socket path, defaults to settings.CHANNEL_SOCKET',
+        )
+        parser.add_argument(
+            '--max-buffer', type=int, default=MAX_BUFFER,
+            help='Bytes queued for one worker before deliveries to it are dropped',
+        )
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"Channel broker listening on {options['socket']}")
+        try:
+            asyncio.run(serve(options['socket'], max_buffer=options['max_buffer']))
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,125 @@
+import json
+import re
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from core.apps.rentals.models import RentItem
+from core.models import Category, Product, TradeRequest, subtree_q
+
+
+class Command(BaseCommand):
+    help = 'Run EXPLAIN on the queries of the hot views and flag full table scans'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--seed', type=int, default=0,
+            help='Seed N products (plus users, requests and rentals) in a transaction that is rolled back afterwards',
+        )
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            if options['seed']:
+                self._seed(options['seed'])
+            flagged = self._explain_all()
+            # Сидированные данные нужны только для плана — ничего не сохраняем
+            transaction.set_rollback(True)
+
+        if flagged:
+            self.stdout.write(self.style.ERROR(f'Full table scans in: {", ".join(flagged)}'))
+        else:
+            self.stdout.write(self.style.SUCCESS('No full table scans found'))
+
+    def _hot_queries(self):
+        user = User.objects.order_by('id').first()
+        category = Category.objects.filter(parent__isnull=True).order_by('id').first()
+        user_id = user.id if user else 0
+        category_path = category.path if category else '0/'
+
+        feed = Product.objects.filter(is_approved=True).exclude(user_id=user_id)
+        rented = RentItem.objects.filter(status='rented').values_list('product_id', flat=True)
+        return [
+            ('home_view', feed.order_by('-created_at', '-id')[:25]),
+            ('home_view?category', feed.filter(
+                subtree_q(category_path, 'category_path')
+            ).order_by('-created_at', '-id')[:25]),
+            ('rentals_list', Product.objects.filter(
+                type='rental', status='available', is_approved=True,
+            ).exclude(user_id=user_id).exclude(id__in=rented)),
+            ('my_ads', Product.objects.filter(user_id=user_id).order_by('-created_at')),
+            ('requests_view:incoming', TradeRequest.objects.filter(owner_id=user_id)),
+            ('requests_view:outgoing', TradeRequest.objects.filter(requester_id=user_id)),
+            ('my_rentals:renter', RentItem.objects.filter(renter_id=user_id)),
+            ('my_rentals:owner', RentItem.objects.filter(owner_id=user_id)),
+        ]
+
+    def _explain_all(self):
+        flagged = []
+        for name, qs in self._hot_queries():
+            if connection.vendor == 'mysql':
+                plan = qs.explain(format='json')
+                scans = self._mysql_scans(json.loads(plan))
+            else:
+                plan = qs.explain()
+                scans = self._text_scans(plan)
+
+            self.stdout.write(self.style.MIGRATE_HEADING(name))
+            self.stdout.write(plan)
+            if scans:
+                flagged.append(name)
+                for table in scans:
+                    self.stdout.write(self.style.WARNING(f'  FULL SCAN: {table}'))
+        return flagged
+
+    def _text_scans(self, plan):
+        if connection.vendor == 'postgresql':
+            return re.findall(r'Seq Scan on (\w+)', plan)
+        # SQLite: "SCAN core_product" без "USING ... INDEX" — полный проход по таблице
+        return [
+            m.group(1) for m in re.finditer(r'SCAN (\w+)(.*)', plan)
+            if 'USING' not in m.group(2)
+        ]
+
+    def _mysql_scans(self, node):
+        scans = []
+        if isinstance(node, dict):
+            if node.get('access_type') == 'ALL':
+                scans.append(node.get('table_name', '?'))
+            for value in node.values():
+                scans.extend(self._mysql_scans(value))
+        elif isinstance(node, list):
+            for value in node:
+                scans.extend(self._mysql_scans(value))
+        return scans
+
+    def _seed(self, count):
+        User.objects.bulk_create([
+            User(username=f'explain_seed_{i}') for i in range(max(count // 10, 2))
+        ])
+        users = list(User.objects.filter(username__startswith='explain_seed_'))
+        top = Category.objects.create(name='explain_seed_top')
+        child = Category.objects.create(name='explain_seed_child', parent=top)
+
+        types = [t for t, _ in Product.TYPE_CHOICES]
+        statuses = [s for s, _ in Product.STATUS_CHOICES]
+        Product.objects.bulk_create([
+            Product(
+                user=users[i % len(users)], name='seed', phone='0', title=f'seed {i}',
+                description='seed', type=types[i % len(types)], status=statuses[i % len(statuses)],
+                is_approved=i % 3 != 0, main_category=top, subcategory=child if i % 2 else None,
+                category_path=child.path if i % 2 else top.path,
+            )
+            for i in range(count)
+        ])
+        products = list(Product.objects.filter(name='seed').only('id', 'user_id'))
+        TradeRequest.objects.bulk_create([
+            TradeRequest(
+                product=p, owner_id=p.user_id, requester=users[(i + 1) % len(users)], action='take',
+            )
+            for i, p in enumerate(products[::2])
+        ])
+        RentItem.objects.bulk_create([
+            RentItem(product=p, owner_id=p.user_id, renter=users[(i + 1) % len(users)])
+            for i, p in enumerate(products[::5])
+        ])
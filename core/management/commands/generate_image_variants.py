@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+
+from core.images import generate_variants
+from core.models import Product
+
+
+class Command(BaseCommand):
+    help = 'Generate resized WebP variants for product images that do not have them yet'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true', help='Regenerate variants for every product image')
+
+    def handle(self, *args, **options):
+        qs = Product.objects.exclude(image='').only('id', 'image').order_by('id')
+        if not options['force']:
+            qs = qs.filter(image_variants_ready=False)
+
+        done = failed = 0
+        for product in qs.iterator(chunk_size=200):
+            try:
+                generate_variants(product)
+                done += 1
+            except Exception as exc:
+                failed += 1
+                self.stderr.write(f'Product {product.id}: {exc}')
+
+        self.stdout.write(self.style.SUCCESS(f'Generated variants for {done} products, failed: {failed}'))
@@ -0,0 +1,114 @@
+import http.client
+import socket
+import statistics
+import threading
+import time
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client
+
+
+class Command(BaseCommand):
+    help = (
+        'Load-test a running server: concurrent GETs against a URL, optionally while slow clients '
+        'trickle request bodies (a slow upload ties up a whole sync worker)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('url', help='e.g. http://127.0.0.1:8000/')
+        parser.add_argument('--concurrency', type=int, default=16)
+        parser.add_argument('--requests', type=int, default=400)
+        parser.add_argument('--slow-clients', type=int, default=0, help='Connections that upload 1 byte every 0.5s')
+        parser.add_argument('--timeout', type=float, default=30)
+        parser.add_argument(
+            '--user', help='Send the GETs logged in as this user (the session is written to the database in settings, '
+                           'so the server must use the same one)',
+        )
+
+    def handle(self, *args, **options):
+        url = urlsplit(options['url'])
+        path = url.path or '/'
+        if url.query:
+            path += f'?{url.query}'
+        headers = {}
+        if options['user']:
+            headers['Cookie'] = f"{settings.SESSION_COOKIE_NAME}={self._session(options['user'])}"
+        stop = threading.Event()
+        slow = [
+            threading.Thread(target=self._slow_upload, args=(url.hostname, url.port or 80, path, stop), daemon=True)
+            for _ in range(options['slow_clients'])
+        ]
+        for thread in slow:
+            thread.start()
+        time.sleep(1 if slow else 0)  # дать медленным клиентам занять воркеры
+
+        latencies, errors, lock = [], [], threading.Lock()
+        remaining = iter(range(options['requests']))
+
+        def worker():
+            conn = http.client.HTTPConnection(url.hostname, url.port or 80, timeout=options['timeout'])
+            while True:
+                with lock:
+                    if next(remaining, None) is None:
+                        break
+                start = time.perf_counter()
+                try:
+                    conn.request('GET', path, headers=headers)
+                    resp = conn.getresponse()
+                    resp.read()
+                    # Редирект (например, на логин) — тоже промах: страница не отдана
+                    ok = resp.status < 300
+                except (OSError, http.client.HTTPException):
+                    conn.close()
+                    ok = False
+                with lock:
+                    (latencies if ok else errors).append(time.perf_counter() - start)
+            conn.close()
+
+        threads = [threading.Thread(target=worker) for _ in range(options['concurrency'])]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+        stop.set()
+
+        if not latencies:
+            self.stdout.write(self.style.ERROR(f'All {len(errors)} requests failed'))
+            return
+        latencies.sort()
+        ms = [x * 1000 for x in latencies]
+        self.stdout.write(
+            f"{len(latencies)} ok, {len(errors)} failed in {elapsed:.2f}s: {len(latencies) / elapsed:.0f} req/s, "
+            f"p50 {statistics.median(ms):.0f} ms, p95 {ms[int(len(ms) * 0.95) - 1]:.0f} ms, max {ms[-1]:.0f} ms "
+            f"(concurrency {options['concurrency']}, slow clients {options['slow_clients']})"
+        )
+
+    def _session(self, username):
+        try:
+            user = User.objects.get(username=username)
+        except User.DoesNotExist:
+            raise CommandError(f'No user {username!r}')
+        client = Client()
+        client.force_login(user)
+        return client.cookies[settings.SESSION_COOKIE_NAME].value
+
+    def _slow_upload(self, host, port, path, stop):
+        # Форма с большим Content-Length, тело — по байту. CSRF-cookie нужна, чтобы
+        # CsrfViewMiddleware дошёл до чтения request.POST: sync-воркер ждёт тело целиком
+        token = 'a' * 32
+        try:
+            with socket.create_connection((host, port)) as sock:
+                sock.sendall(
+                    f'POST {path} HTTP/1.1\r\nHost: {host}\r\n'
+                    f'Content-Type: application/x-www-form-urlencoded\r\nCookie: csrftoken={token}\r\n'
+                    f'Content-Length: 100000\r\n\r\n'.encode()
+                )
+                while not stop.wait(0.5):
+                    sock.sendall(b'x')
+        except OSError:
+            pass
@@ -1,11 +1,33 @@
-from django.core.management.base import BaseCommand
-from core.populate_categories import create_categories
+from django.core.management.base import BaseCommand, CommandError
+
+from core.populate_categories import DEFAULT_FILE, load_tree, sync_categories
 
 
 class Command(BaseCommand):
-    help = 'Populate the database with product categories'
+    help = 'Sync product categories with a JSON/YAML tree file'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--file', default=str(DEFAULT_FILE), help='Category tree file (JSON or YAML)')
+        parser.add_argument('--dry-run', action='store_true', help='Show the changes without applying them')
 
     def handle(self, *args, **options):
-        self.stdout.write('Creating categories...')
-        create_categories()
-        self.stdout.write(self.style.SUCCESS('Successfully populated categories'))
+        try:
+            report = sync_categories(load_tree(options['file']), dry_run=options['dry_run'])
+        except (OSError, ValueError, ImportError) as exc:
+            raise CommandError(exc)
+
+        for name in report['created']:
+            self.stdout.write(f'+ {name}')
+        for old, new in report['renamed']:
+            self.stdout.write(f'~ {old} -> {new}')
+        for name in report['moved']:
+            self.stdout.write(f'> {name}')
+
+        summary = (
+            f"created {len(report['created'])}, renamed {len(report['renamed'])}, "
+            f"moved {len(report['moved'])}, unchanged {report['unchanged']}"
+        )
+        if options['dry_run']:
+            self.stdout.write(self.style.WARNING(f'Dry run, nothing saved: {summary}'))
+        else:
+            self.stdout.write(self.style.SUCCESS(f'Categories synced: {summary}'))
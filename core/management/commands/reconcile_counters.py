@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from core.counters import reconcile, reconcile_requests
+
+
+class Command(BaseCommand):
+    help = 'Recount per-category listing counters and per-user request counters, repairing drift'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Report drift without fixing it')
+
+    def handle(self, *args, **options):
+        fixes = reconcile(dry_run=options['dry_run'])
+        for pk, (stored, actual) in sorted(fixes.items()):
+            self.stdout.write(f'Category {pk}: {stored} -> {actual}')
+
+        request_fixes = reconcile_requests(dry_run=options['dry_run'])
+        for (user_id, direction, status), (stored, actual) in sorted(request_fixes.items()):
+            self.stdout.write(f'User {user_id} {direction}/{status}: {stored} -> {actual}')
+
+        verb = 'Found' if options['dry_run'] else 'Fixed'
+        self.stdout.write(self.style.SUCCESS(
+            f'{verb} {len(fixes)} drifted category counters, {len(request_fixes)} drifted request counters'
+        ))
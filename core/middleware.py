@@ -0,0 +1,99 @@
+import logging
+import time
+from collections import Counter
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import connection
+
+logger = logging.getLogger(__name__)
+
+
+class QueryStats:
+    """Обёртка над выполнением SQL: число запросов, суммарное время, повторы"""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.statements = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - start
+            self.count += 1
+            self.statements[sql] += 1
+
+    @property
+    def duplicates(self):
+        """Сколько запросов повторяли уже выполненный SQL (признак N+1)"""
+        return sum(n - 1 for n in self.statements.values() if n > 1)
+
+    def header(self):
+        return f'count={self.count}; time={self.duration * 1000:.2f}ms; duplicates={self.duplicates}'
+
+
+class QueryBudgetMiddleware:
+    """
+    Считает запросы к базе за время обработки запроса.
+
+    При DEBUG или для staff-пользователя итог уходит в заголовок
+    X-DB-Queries. Запросы дороже QUERY_BUDGET_WARN пишутся в лог.
+
+    Под ASGI работает асинхронно и не переводит в поток всю цепочку до
+    view. Соединения с базой у каждого потока свои, а ORM из async-кода
+    ходит в базу из потока запроса (sync_to_async). Поэтому счётчик
+    ставится на соединение этого потока.
+    """
+    header_name = 'X-DB-Queries'
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.warn_threshold = getattr(settings, 'QUERY_BUDGET_WARN', 50)
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        stats = QueryStats()
+        with connection.execute_wrapper(stats):
+            response = self.get_response(request)
+        return self._report(request, response, stats)
+
+    async def __acall__(self, request):
+        stats = QueryStats()
+        await sync_to_async(self._install)(stats)
+        try:
+            response = await self.get_response(request)
+        except BaseException:
+            await sync_to_async(self._uninstall)(stats)
+            raise
+        return await sync_to_async(self._finish)(request, response, stats)
+
+    def _install(self, stats):
+        connection.execute_wrappers.append(stats)
+
+    def _uninstall(self, stats):
+        connection.execute_wrappers.remove(stats)
+
+    def _finish(self, request, response, stats):
+        # Снимаем счётчик и проверяем staff за один переход в поток запроса
+        self._uninstall(stats)
+        return self._report(request, response, stats)
+
+    def _report(self, request, response, stats):
+        if settings.DEBUG or self._is_staff(request):
+            response[self.header_name] = stats.header()
+        if stats.count > self.warn_threshold:
+            logger.warning("%s %s: %s", request.method, request.path, stats.header())
+        return response
+
+    def _is_staff(self, request):
+        user = getattr(request, 'user', None)
+        return bool(user and user.is_authenticated and user.is_staff)
@@ -0,0 +1,47 @@
+# Generated by Django 5.2.8 on 2026-10-18 12:36
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_alter_product_type'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['created_at', 'id', 'is_approved'], name='product_feed_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['main_category', 'created_at'], name='product_main_cat_feed_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['subcategory', 'created_at'], name='product_sub_cat_feed_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['sub_subcategory', 'created_at'], name='product_subsub_cat_feed_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['type', 'status', 'is_approved', 'created_at'], name='product_type_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['user', 'created_at'], name='product_user_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='traderequest',
+            index=models.Index(fields=['owner', 'created_at'], name='traderequest_owner_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='traderequest',
+            index=models.Index(fields=['requester', 'created_at'], name='traderequest_requester_idx'),
+        ),
+    ]
@@ -0,0 +1,70 @@
+# Generated by Django 5.2.8 on 2026-10-18 12:37
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def fill_paths(apps, schema_editor):
+    Category = apps.get_model('core', 'Category')
+    Product = apps.get_model('core', 'Product')
+
+    # Проходим дерево сверху вниз, чтобы путь родителя был уже известен
+    paths = {}
+    level = list(Category.objects.filter(parent__isnull=True))
+    depth = 0
+    while level:
+        for cat in level:
+            cat.path = f"{paths.get(cat.parent_id, '')}{cat.pk}/"
+            cat.depth = depth
+            paths[cat.pk] = cat.path
+        Category.objects.bulk_update(level, ['path', 'depth'])
+        level = list(Category.objects.filter(parent_id__in=[c.pk for c in level]))
+        depth += 1
+
+    # Путь товара — путь самой глубокой категории: более глубокие уровни перезаписывают
+    for field in ('main_category', 'subcategory', 'sub_subcategory'):
+        for cat_id, path in paths.items():
+            Product.objects.filter(**{f'{field}_id': cat_id}).update(category_path=path)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0008_product_traderequest_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='product',
+            name='product_main_cat_feed_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='product',
+            name='product_sub_cat_feed_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='product',
+            name='product_subsub_cat_feed_idx',
+        ),
+        migrations.AddField(
+            model_name='category',
+            name='depth',
+            field=models.PositiveSmallIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='category',
+            name='path',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=255),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='category_path',
+            field=models.CharField(blank=True, default='', editable=False, max_length=255),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['category_path', 'created_at'], name='product_category_path_idx'),
+        ),
+        migrations.RunPython(fill_paths, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+from django.db import migrations
+
+
+def create_index(apps, schema_editor):
+    from core.search import ensure_search_index
+    ensure_search_index(schema_editor.connection)
+
+
+def drop_index(apps, schema_editor):
+    from core.search import drop_search_index
+    drop_search_index(schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0009_category_materialized_path'),
+    ]
+
+    operations = [
+        # FTS5 на SQLite, FULLTEXT на MySQL; на остальных базах поиск работает без индекса
+        migrations.RunPython(create_index, drop_index),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.8 on 2026-10-18 12:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0010_product_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='image_variants_ready',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 5.2.8 on 2026-10-18 12:48
+
+import django.db.models.deletion
+from collections import Counter
+
+from django.db import migrations, models
+
+
+def fill_counters(apps, schema_editor):
+    Category = apps.get_model('core', 'Category')
+    CategoryCounter = apps.get_model('core', 'CategoryCounter')
+    Product = apps.get_model('core', 'Product')
+
+    counts = Counter()
+    rows = Product.objects.filter(is_approved=True, status='available').values_list('category_path', flat=True)
+    for path in rows.iterator():
+        for pk in path.split('/')[:-1]:
+            counts[int(pk)] += 1
+    CategoryCounter.objects.bulk_create(
+        CategoryCounter(category_id=pk, available=counts[pk])
+        for pk in Category.objects.values_list('pk', flat=True)
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0012_product_updated_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CategoryCounter',
+            fields=[
+                ('category', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='counter', serialize=False, to='core.category')),
+                ('available', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
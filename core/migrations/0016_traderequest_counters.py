@@ -0,0 +1,58 @@
+# Generated by Django 5.2.8 on 2026-10-18 13:06
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def fill_counters(apps, schema_editor):
+    TradeRequest = apps.get_model('core', 'TradeRequest')
+    TradeRequestCounter = apps.get_model('core', 'TradeRequestCounter')
+
+    counters = []
+    for field, direction in (('owner_id', 'in'), ('requester_id', 'out')):
+        rows = TradeRequest.objects.values_list(field, 'status').annotate(n=Count('pk')).order_by()
+        counters += [
+            TradeRequestCounter(user_id=user_id, direction=direction, status=status, count=n)
+            for user_id, status, n in rows
+        ]
+    TradeRequestCounter.objects.bulk_create(counters, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0015_product_version'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TradeRequestCounter',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('direction', models.CharField(choices=[('in', 'Входящие'), ('out', 'Исходящие')], max_length=3)),
+                ('status', models.CharField(choices=[('pending', 'Ожидает'), ('accepted', 'Подтверждена'), ('rejected', 'Отклонена'), ('completed', 'Завершена'), ('cancelled', 'Отменена')], max_length=10)),
+                ('count', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='traderequest',
+            index=models.Index(fields=['owner', 'status', 'created_at'], name='traderequest_owner_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='traderequest',
+            index=models.Index(fields=['requester', 'status', 'created_at'], name='traderequest_req_status_idx'),
+        ),
+        migrations.AddField(
+            model_name='traderequestcounter',
+            name='user',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='request_counters', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddConstraint(
+            model_name='traderequestcounter',
+            constraint=models.UniqueConstraint(fields=('user', 'direction', 'status'), name='traderequestcounter_unique'),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,19 @@
+from django.db import migrations
+
+
+def reset_image_variants(apps, schema_editor):
+    # Варианты переехали в product_images/variants/ с расширением оригинала в имени —
+    # старые копии не найдутся; шаблоны покажут оригинал до generate_image_variants
+    Product = apps.get_model('core', 'Product')
+    Product.objects.filter(image_variants_ready=True).update(image_variants_ready=False)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0016_traderequest_counters'),
+    ]
+
+    operations = [
+        migrations.RunPython(reset_image_variants, migrations.RunPython.noop),
+    ]
@@ -1,15 +1,122 @@
 # models.py
 
-from django.db import models
+from django.db import models, transaction
+from django.db.models import F, Q, Value
+from django.db.models.functions import Concat, Substr
+from django.db.models.signals import post_delete, post_migrate, post_save, pre_delete
+from django.dispatch import receiver
 from django.contrib.auth.models import User
 
+from .category_tree import invalidate_category_tree
+from .conditional import invalidate_catalog
+from .counters import apply_deltas, apply_request_deltas, is_listed, path_ids, request_status_deltas
+from .images import VARIANTS, schedule_variant_cleanup, schedule_variants, variant_name
+from .notifications import notify, request_events
+from .similarity import remove as remove_from_similarity, schedule_fold_in, schedule_remove
+
+
+def subtree_q(path, field='path'):
+    """
+    Условие "узел и все его потомки" для материализованного пути.
+
+    Путь имеет вид "3/17/42/", поэтому все потомки лежат в диапазоне
+    [path, path без последнего "/" + "0"): "/" в таблице символов идёт
+    сразу перед "0". Диапазон, в отличие от LIKE, использует индекс на
+    любой базе.
+    """
+    return Q(**{f'{field}__gte': path, f'{field}__lt': path[:-1] + '0'})
+
+
+class ConcurrentModification(Exception):
+    """Строку изменили после того, как её прочитали: сохранение отменено"""
+
+
 class Category(models.Model):
     name = models.CharField(max_length=100)
     parent = models.ForeignKey('self', null=True, blank=True, on_delete=models.CASCADE)
+    # Материализованный путь от корня: "id_корня/.../id_узла/"
+    path = models.CharField(max_length=255, db_index=True, blank=True, editable=False)
+    depth = models.PositiveSmallIntegerField(default=0, editable=False)
 
     def __str__(self):
         return self.name
 
+    def save(self, *args, **kwargs):
+        # Одна транзакция: кэш дерева сбрасывается после коммита уже с новым путём
+        with transaction.atomic(using=kwargs.get('using')):
+            super().save(*args, **kwargs)
+
+            parent_path = ''
+            if self.parent_id:
+                parent_path = Category.objects.filter(pk=self.parent_id).values_list('path', flat=True).get()
+            new_path = f'{parent_path}{self.pk}/'
+            if new_path != self.path:
+                self._move_subtree(new_path)
+
+    def _move_subtree(self, new_path):
+        """Переписать путь узла, всех его потомков и товаров под ними"""
+        old_path = self.path
+        new_depth = new_path.count('/') - 1
+
+        if not old_path:
+            Category.objects.filter(pk=self.pk).update(path=new_path, depth=new_depth)
+        else:
+            if new_path.startswith(old_path):
+                raise ValueError("Категорию нельзя вложить в её же потомка")
+            tail = Substr('path', len(old_path) + 1)
+            Category.objects.filter(subtree_q(old_path)).update(
+                path=Concat(Value(new_path), tail),
+                depth=F('depth') + (new_depth - self.depth),
+            )
+            Product.objects.filter(subtree_q(old_path, 'category_path')).update(
+                category_path=Concat(Value(new_path), Substr('category_path', len(old_path) + 1)),
+            )
+            # Товары ветки переезжают к новым предкам; счётчики внутри ветки не меняются
+            moved = CategoryCounter.objects.filter(category_id=self.pk).values_list('available', flat=True).first()
+            if moved:
+                own = f'{self.pk}/'
+                apply_deltas({old_path[:-len(own)]: -moved, new_path[:-len(own)]: moved})
+
+        self.path = new_path
+        self.depth = new_depth
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def invalidate_category_cache(sender, **kwargs):
+    """Любое изменение категории сбрасывает кэш дерева во всех процессах"""
+    invalidate_category_tree()
+
+
+@receiver(post_save, sender=Category)
+def create_category_counter(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        CategoryCounter.objects.get_or_create(category=instance)
+
+
+@receiver(post_delete, sender=Category)
+def detach_products_from_deleted_category(sender, instance, **kwargs):
+    """Товары удалённой ветки поднимаем к её родителю (FK уже обнулены SET_NULL)"""
+    if instance.path:
+        parent_path = instance.path[:-len(f'{instance.pk}/')]
+        Product.objects.filter(subtree_q(instance.path, 'category_path')).update(category_path=parent_path)
+
+
+class CategoryCounter(models.Model):
+    """
+    Число одобренных доступных товаров в категории вместе с потомками.
+
+    Отдельная таблица, а не поле Category: счётчики меняются с каждым товаром
+    и не должны сбрасывать кэш дерева категорий. Поддерживается в
+    Product.save()/delete и core.counters.set_approved; расхождения чинит
+    команда reconcile_counters.
+    """
+    category = models.OneToOneField(Category, on_delete=models.CASCADE, primary_key=True, related_name='counter')
+    available = models.IntegerField(default=0)
+
+    def __str__(self):
+        return f'{self.category_id}: {self.available}'
+
 
 class Product(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
@@ -62,12 +169,159 @@ class Product(models.Model):
 
     image = models.ImageField(upload_to='product_images/')
     created_at = models.DateTimeField(auto_now_add=True)
+    # Меняется при каждом сохранении — входит в ключ кэша карточки (core.cards)
+    updated_at = models.DateTimeField(auto_now=True)
 
     is_approved = models.BooleanField(default=False, verbose_name='Одобрено модератором')  
+    # Путь самой глубокой выбранной категории: вся ветка ищется одним диапазоном
+    category_path = models.CharField(max_length=255, blank=True, default='', editable=False)
+    # Уменьшенные WebP-копии изображения уже нарезаны (см. core.images)
+    image_variants_ready = models.BooleanField(default=False, editable=False)
+    # Оптимистичная блокировка: растёт при каждом сохранении и брони (core.reservations)
+    version = models.PositiveIntegerField(default=0, editable=False)
+
+    class Meta:
+        indexes = [
+            # Лента на главной: обход по (created_at, id) с конца до первых N одобренных.
+            # is_approved в хвосте индекса, чтобы фильтр проверялся без чтения строк
+            # (Django пишет boolean-фильтр как "WHERE is_approved", по нему индекс не ищет)
+            models.Index(fields=['created_at', 'id', 'is_approved'], name='product_feed_idx'),
+            # Фильтр ленты по ветке категорий (диапазон по пути)
+            models.Index(fields=['category_path', 'created_at'], name='product_category_path_idx'),
+            # Каталог аренды: type='rental', status='available', is_approved
+            models.Index(fields=['type', 'status', 'is_approved', 'created_at'], name='product_type_status_idx'),
+            # "Мои объявления"
+            models.Index(fields=['user', 'created_at'], name='product_user_created_idx'),
+        ]
+
+    # Поля, от которых зависит учёт товара в CategoryCounter
+    COUNTER_FIELDS = {'is_approved', 'status', 'main_category', 'subcategory', 'sub_subcategory'}
+    # Поля, из которых строится вектор в матрице похожих (core.similarity)
+    SIMILARITY_FIELDS = ('title', 'description', 'category_path')
 
     def __str__(self):
         return self.title
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Запоминаем исходную картинку, чтобы заметить её замену при сохранении
+        instance._loaded_image = instance.__dict__.get('image')
+        instance._loaded_approved = instance.__dict__.get('is_approved')
+        instance._loaded_version = instance.__dict__.get('version')
+        if {'is_approved', 'status', 'category_path'} <= set(field_names):
+            instance._counted_path = instance._listed_path()
+        if set(cls.SIMILARITY_FIELDS) <= set(field_names):
+            instance._indexed_text = instance._similarity_source()
+        return instance
+
+    def _similarity_source(self):
+        return tuple(getattr(self, name) for name in self.SIMILARITY_FIELDS)
+
+    def _listed_path(self):
+        """Путь, в счётчиках которого учтён товар, или None"""
+        return self.category_path if is_listed(self.is_approved, self.status) else None
+
+    def save(self, *args, check_version=False, **kwargs):
+        """
+        check_version=True — сохранять только поверх прочитанной версии, иначе
+        ConcurrentModification (формы редактирования). Без него версия просто
+        увеличивается, чтобы открытые формы заметили эту запись.
+        """
+        adding = self._state.adding
+        self._check_version = check_version
+        update_fields = kwargs.get('update_fields')
+        if not adding and getattr(self, '_loaded_version', None) is not None:
+            self.version = self._loaded_version + 1
+            if update_fields is not None:
+                kwargs['update_fields'] = update_fields = {*update_fields, 'version'}
+        if update_fields is None or {'main_category', 'subcategory', 'sub_subcategory'} & set(update_fields):
+            self.category_path = self._build_category_path()
+            if update_fields is not None:
+                kwargs['update_fields'] = {*update_fields, 'category_path'}
+
+        image_changed = (
+            (update_fields is None or 'image' in update_fields)
+            and self.image.name != getattr(self, '_loaded_image', None)
+        )
+        if image_changed:
+            self.image_variants_ready = False
+            if update_fields is not None:
+                kwargs['update_fields'] = {*kwargs['update_fields'], 'image_variants_ready'}
+        self._image_changed = image_changed
+
+        super().save(*args, **kwargs)
+
+        # Без исходного состояния (товар загружен через only/defer) учёт не трогаем — поправит reconcile
+        known = adding or hasattr(self, '_counted_path')
+        if known and (update_fields is None or self.COUNTER_FIELDS & set(update_fields)):
+            old_path = None if adding else self._counted_path
+            new_path = self._listed_path()
+            if old_path != new_path:
+                apply_deltas({old_path: -1, new_path: 1})
+            self._counted_path = new_path
+
+        just_approved = self.is_approved and not getattr(self, '_loaded_approved', False) and (
+            update_fields is None or 'is_approved' in update_fields
+        )
+        # Отложенные (only/defer) поля не читаем — лишний запрос; такой товар пересчитываем,
+        # если поля могли быть записаны
+        source = None if self.get_deferred_fields() & set(self.SIMILARITY_FIELDS) else self._similarity_source()
+        text_changed = (source is None or getattr(self, '_indexed_text', None) != source) and (
+            update_fields is None or set(self.SIMILARITY_FIELDS) & set(kwargs['update_fields'])
+        )
+        if self.is_approved and (just_approved or text_changed):
+            # Новый или отредактированный одобренный товар заново вкладываем в матрицу похожих
+            schedule_fold_in([self.pk])
+        elif not self.is_approved and getattr(self, '_loaded_approved', False) and (
+            update_fields is None or 'is_approved' in update_fields
+        ):
+            schedule_remove([self.pk])
+        self._loaded_approved = self.is_approved
+        self._indexed_text = source
+
+        if image_changed:
+            schedule_variant_cleanup(getattr(self, '_loaded_image', None), self.image.storage)
+            self._loaded_image = self.image.name
+            if self.image:
+                schedule_variants(self.pk)
+        self._loaded_version = self.version
+
+    def _do_update(self, base_qs, using, pk_val, values, update_fields, forced_update):
+        if update_fields is None and not getattr(self, '_image_changed', True):
+            # Флаг ставит фоновая нарезка (core.images); полное сохранение с прочитанным
+            # до неё значением не должно его сбросить, раз картинка та же
+            values = [item for item in values if item[0].attname != 'image_variants_ready']
+        loaded = getattr(self, '_loaded_version', None)
+        if loaded is None or not values:
+            return super()._do_update(base_qs, using, pk_val, values, update_fields, forced_update)
+        if not getattr(self, '_check_version', False):
+            # Инкремент в базе, а не loaded + 1: версия не откатится назад поверх чужой записи
+            values = [
+                (field, model, F('version') + 1 if field.attname == 'version' else value)
+                for field, model, value in values
+            ]
+            return super()._do_update(base_qs, using, pk_val, values, update_fields, forced_update)
+        # UPDATE ... WHERE id = %s AND version = <прочитанная>: чужая запись между
+        # чтением и сохранением (бронь, модерация) не будет молча перезаписана
+        if base_qs.filter(pk=pk_val, version=loaded)._update(values) > 0:
+            return True
+        if base_qs.filter(pk=pk_val).exists():
+            self.version = loaded
+            raise ConcurrentModification(f"Товар {pk_val} изменён другим запросом")
+        return False
+
+    def image_variant_urls(self):
+        """URL уменьшенных копий по именам вариантов (grid, detail, retina)"""
+        storage = self.image.storage
+        return {v: storage.url(variant_name(self.image.name, v)) for v in VARIANTS}
+
+    def _build_category_path(self):
+        leaf_id = self.sub_subcategory_id or self.subcategory_id or self.main_category_id
+        if not leaf_id:
+            return ''
+        return Category.objects.filter(pk=leaf_id).values_list('path', flat=True).first() or ''
+
 
 class TradeRequest(models.Model):
     ACTION_CHOICES = (
@@ -92,6 +346,120 @@ class TradeRequest(models.Model):
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # Входящие и исходящие заявки пользователя, от новых к старым
+            models.Index(fields=['owner', 'created_at'], name='traderequest_owner_idx'),
+            models.Index(fields=['requester', 'created_at'], name='traderequest_requester_idx'),
+            # Те же списки с фильтром по статусу (вкладки на странице заявок)
+            models.Index(fields=['owner', 'status', 'created_at'], name='traderequest_owner_status_idx'),
+            models.Index(fields=['requester', 'status', 'created_at'], name='traderequest_req_status_idx'),
+        ]
 
     def __str__(self):
         return f"{self.requester} → {self.product.title} ({self.get_action_display()})"
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_status = instance.__dict__.get('status')
+        return instance
+
+    def save(self, *args, **kwargs):
+        adding = self._state.adding
+        super().save(*args, **kwargs)
+        old_status = None if adding else getattr(self, '_loaded_status', None)
+        if adding or (old_status and old_status != self.status):
+            apply_request_deltas(request_status_deltas(self, old_status, self.status))
+            notify(request_events(self, 'created' if adding else 'status'))
+        self._loaded_status = self.status
+
+
+class TradeRequestCounter(models.Model):
+    """Число заявок пользователя по направлению и статусу — для вкладок без COUNT(*)"""
+    DIRECTION_CHOICES = (
+        ('in', 'Входящие'),
+        ('out', 'Исходящие'),
+    )
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='request_counters')
+    direction = models.CharField(max_length=3, choices=DIRECTION_CHOICES)
+    status = models.CharField(max_length=10, choices=TradeRequest.STATUS_CHOICES)
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'direction', 'status'], name='traderequestcounter_unique'),
+        ]
+
+    def __str__(self):
+        return f'{self.user_id} {self.direction} {self.status}: {self.count}'
+
+
+class ProductSimilarity(models.Model):
+    """Заранее посчитанные похожие товары: [[id, score], ...] по убыванию сходства"""
+    product = models.OneToOneField(Product, on_delete=models.CASCADE, primary_key=True, related_name='similarity')
+    neighbours = models.JSONField(default=list)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f'{self.product_id}: {len(self.neighbours)}'
+
+
+class SimilarityPosting(models.Model):
+    """
+    Разреженная TF-IDF матрица, хранимая по столбцам: вес терма в товаре.
+
+    Индекс по term даёт список товаров с этим термом — по нему новый товар
+    сравнивается только с теми, с кем у него есть общие слова (core.similarity).
+    """
+    term = models.CharField(max_length=64)
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='similarity_postings')
+    weight = models.FloatField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['term'], name='similarity_term_idx'),
+        ]
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def invalidate_catalog_version(sender, **kwargs):
+    """Меняет ETag ленты (core.conditional)"""
+    invalidate_catalog()
+
+
+@receiver(pre_delete, sender=Product)
+def unindex_deleted_product(sender, instance, **kwargs):
+    # До каскадного удаления: по столбцам товара находим чужие списки, где он стоит
+    if instance.is_approved:
+        remove_from_similarity([instance.pk])
+
+
+@receiver(post_delete, sender=Product)
+def uncount_deleted_product(sender, instance, **kwargs):
+    path = getattr(instance, '_counted_path', None)
+    if path:
+        apply_deltas({path: -1})
+
+
+@receiver(post_delete, sender=Product)
+def delete_image_variants(sender, instance, **kwargs):
+    if instance.image:
+        schedule_variant_cleanup(instance.image.name, instance.image.storage)
+
+
+@receiver(post_delete, sender=TradeRequest)
+def uncount_deleted_request(sender, instance, **kwargs):
+    apply_request_deltas(request_status_deltas(instance, instance.status, None))
+
+
+@receiver(post_migrate)
+def ensure_product_search_index(sender, using, **kwargs):
+    """SQLite теряет триггеры FTS при пересоздании таблицы в миграциях — восстанавливаем"""
+    if sender.label != 'core':
+        return
+    from django.db import connections
+
+    from .search import ensure_search_index
+    ensure_search_index(connections[using])
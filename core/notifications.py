@@ -0,0 +1,98 @@
+import logging
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.db import transaction
+from django.utils.text import Truncator
+
+logger = logging.getLogger(__name__)
+
+
+def user_group(user_id):
+    """Группа канального слоя со всеми вкладками пользователя"""
+    return f'user_{user_id}'
+
+
+async def anotify(messages):
+    """[(user_id, event), ...] -> группам пользователей сразу: для async-кода вне транзакции"""
+    layer = get_channel_layer()
+    if layer is None:
+        return
+    for user_id, event in messages:
+        try:
+            await layer.group_send(user_group(user_id), {'type': 'notify', 'event': event})
+        except Exception:
+            # Уведомление — подсказка клиенту, а не данные: потеря не должна ронять запрос
+            logger.exception("Не удалось отправить уведомление пользователю %s", user_id)
+
+
+def _send(messages):
+    # Один переход в event loop на все события коммита
+    async_to_sync(anotify)(messages)
+
+
+def notify(messages):
+    """[(user_id, event), ...] -> группам пользователей после коммита"""
+    messages = list(messages)
+    if messages:
+        transaction.on_commit(lambda: _send(messages))
+
+
+def request_events(trade_request, event):
+    """
+    События заявки для обеих сторон: владельцу (direction='in') и автору ('out').
+
+    О новой заявке узнаёт только владелец — автор и так видит её у себя.
+    """
+    payload = {
+        'kind': 'trade_request',
+        'event': event,
+        'id': trade_request.pk,
+        'product_id': trade_request.product_id,
+        'status': trade_request.status,
+    }
+    messages = [(trade_request.owner_id, {**payload, 'direction': 'in'})]
+    if event != 'created':
+        messages.append((trade_request.requester_id, {**payload, 'direction': 'out'}))
+    return messages
+
+
+def rental_events(rental, event):
+    """То же для аренды: владелец товара ('in') и арендатор ('out')"""
+    payload = {
+        'kind': 'rental',
+        'event': event,
+        'id': rental.pk,
+        'product_id': rental.product_id,
+        'status': rental.status,
+    }
+    messages = [(rental.owner_id, {**payload, 'direction': 'in'})]
+    if event != 'created':
+        messages.append((rental.renter_id, {**payload, 'direction': 'out'}))
+    return messages
+
+
+def chat_events(message, members):
+    """
+    Дельта списка чатов для всех участников: в чате id новое сообщение.
+
+    members — {user_id: username} участников. preview — как в списке чатов
+    (первые слова текста), unread — на сколько вырос счётчик непрочитанных
+    (у отправителя 0: событие для него не новость).
+    """
+    payload = {
+        'kind': 'chat',
+        'event': 'message',
+        'id': message.chat_id,
+        'message_id': message.pk,
+        'sender': members.get(message.sender_id, ''),
+        'sender_id': message.sender_id,
+        'preview': Truncator(message.text).words(3, truncate=' …'),
+        'created_at': message.created_at.isoformat(),
+    }
+    return [(user_id, {**payload, 'unread': int(user_id != message.sender_id)}) for user_id in members]
+
+
+def chat_read_event(chat_id):
+    """Пользователь прочитал чат — в других вкладках счётчик обнуляется"""
+    return {'kind': 'chat', 'event': 'read', 'id': chat_id, 'unread': 0}
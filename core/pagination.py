@@ -0,0 +1,88 @@
+import base64
+from datetime import datetime
+
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Q, QuerySet
+from django.utils.functional import cached_property
+
+PAGE_SIZE = 24
+
+
+def encode_cursor(obj):
+    """Курсор на запись: base64 от "created_at|id" последнего элемента страницы"""
+    raw = f"{obj.created_at.isoformat()}|{obj.pk}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Разобрать курсор; для битого значения возвращаем None (первая страница)"""
+    if not cursor:
+        return None
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        created_at, pk = base64.urlsafe_b64decode(padded.encode()).decode().split('|')
+        return datetime.fromisoformat(created_at), int(pk)
+    except (ValueError, TypeError, UnicodeDecodeError):
+        return None
+
+
+def keyset_page(qs, cursor=None, page_size=PAGE_SIZE):
+    """
+    Страница по ключу (created_at, id) от новых к старым.
+
+    Вместо OFFSET берём записи строго "после" курсора, поэтому стоимость
+    запроса не зависит от того, насколько глубоко пролистана лента.
+    Возвращает (items, next_cursor); next_cursor = None на последней странице.
+    """
+    qs = qs.order_by('-created_at', '-id')
+    position = decode_cursor(cursor)
+    if position:
+        created_at, pk = position
+        qs = qs.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=pk))
+
+    # Берём на одну запись больше, чтобы узнать, есть ли следующая страница
+    items = list(qs[:page_size + 1])
+    has_next = len(items) > page_size
+    items = items[:page_size]
+    next_cursor = encode_cursor(items[-1]) if has_next else None
+    return items, next_cursor
+
+
+def estimated_row_count(model, using='default'):
+    """Оценка числа строк таблицы по статистике базы (без COUNT(*)); None, если оценки нет"""
+    connection = connections[using]
+    table = model._meta.db_table
+    with connection.cursor() as cursor:
+        if connection.vendor == 'mysql':
+            cursor.execute(
+                "SELECT table_rows FROM information_schema.tables "
+                "WHERE table_schema = DATABASE() AND table_name = %s",
+                [table],
+            )
+        elif connection.vendor == 'postgresql':
+            cursor.execute("SELECT reltuples::bigint FROM pg_class WHERE oid = to_regclass(%s)", [table])
+        else:
+            return None
+        row = cursor.fetchone()
+    return row[0] if row and row[0] is not None and row[0] >= 0 else None
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Пагинатор админки для больших таблиц.
+
+    Для списка без фильтров число строк берётся из статистики базы: точный
+    COUNT(*) по сотням тысяч строк занимает секунды, а для номеров страниц
+    хватает оценки. Небольшие таблицы и отфильтрованные списки считаются как обычно.
+    """
+    threshold = 10000
+
+    @cached_property
+    def count(self):
+        qs = self.object_list
+        if isinstance(qs, QuerySet) and not qs.query.where:
+            estimate = estimated_row_count(qs.model, qs.db)
+            if estimate is not None and estimate > self.threshold:
+                return estimate
+        return super().count
@@ -1,54 +1,151 @@
-from .models import Category
-
-def create_categories():
-    categories = {
-        "Одежда": {
-            "Женская одежда": ["Платья", "Юбки", "Блузки", "Брюки", "Верхняя одежда", "Футболки", "Пиджаки", "Джинсы"],
-            "Мужская одежда": ["Рубашки", "Брюки", "Куртки", "Костюмы", "Футболки", "Пиджаки", "Джинсы"],
-            "Детская одежда": ["Для девочек", "Для мальчиков"]
-        },
-        "Обувь": {
-            "Женская обувь": ["Кроссовки", "Босоножки", "Сапоги", "Балетки"],
-            "Мужская обувь": ["Кроссовки", "Ботинки", "Туфли"],
-            "Детская обувь": []
-        },
-        "Электроника": {
-            "": ["Смартфоны", "Ноутбуки и ПК", "Аксессуары"],
-            "Аксессуары": ["Наушники", "Кабели", "Зарядные устройства", "Чехлы"]
-        },
-        "Книги": {
-            "": ["Художественная литература", "Учебники", "Детские книги", "Саморазвитие", "Комиксы и манга"]
-        },
-        "Для дома": {
-            "Мебель": ["Столы", "Стулья", "Кровати", "Шкафы"],
-            "Текстиль": ["Шторы", "Пледы", "Постельное белье", "Полотенца"],
-            "Декор": ["Картины", "Вазы", "Свечи"]
-        },
-        "Косметика и уход": {
-            "": ["Макияж", "Уход за кожей", "Уход за волосами", "Аксессуары"]
-        },
-        "Ручная работа (Handmade)": {
-            "": ["Украшения", "Одежда", "Аксессуары", "Декор"]
-        },
-        "Для учебы": {
-            "": ["Канцелярия", "Рюкзаки и сумки", "Электроника"]
-        },
-        "Прочее": {
-            "": ["Игрушки", "Хобби и творчество", "Аксессуары для животных"]
+import json
+from pathlib import Path
+
+from django.db import connection, transaction
+
+from .category_tree import invalidate_category_tree
+from .models import Category, CategoryCounter
+
+DEFAULT_FILE = Path(__file__).resolve().parent / 'data' / 'categories.json'
+
+
+def load_tree(path=DEFAULT_FILE):
+    """
+    Прочитать дерево категорий из JSON (или YAML, если установлен PyYAML).
+
+    Формат — список узлов. Узел: {"name": ..., "children": [...]} или просто
+    строка-имя для листа. Необязательный "id" привязывает узел к существующей
+    категории: так переименовываются и переносятся категории с товарами.
+    """
+    path = Path(path)
+    with path.open(encoding='utf-8') as f:
+        if path.suffix in ('.yaml', '.yml'):
+            import yaml
+            return yaml.safe_load(f)
+        return json.load(f)
+
+
+def _normalize(node):
+    if isinstance(node, str):
+        return {'id': None, 'name': node, 'children': []}
+    return {'id': node.get('id'), 'name': node['name'], 'children': node.get('children') or []}
+
+
+def sync_categories(tree, dry_run=False):
+    """
+    Привести таблицу категорий к дереву из файла.
+
+    Существующие строки читаются одним запросом и сравниваются в памяти;
+    новые узлы вставляются bulk_create по уровням (потомкам нужен id
+    родителя), переименования — одним bulk_update, переносы — через
+    Category._move_subtree. Узлы, которых нет в файле, не удаляются: на них
+    могут ссылаться товары. В dry_run изменения откатываются.
+
+    Возвращает отчёт {'created': [...], 'renamed': [...], 'moved': [...], 'unchanged': n}.
+    """
+    report = {'created': [], 'renamed': [], 'moved': [], 'unchanged': 0}
+
+    with transaction.atomic():
+        existing = {c.pk: c for c in Category.objects.only('id', 'name', 'parent_id', 'path', 'depth')}
+        by_name = {}
+        for cat in sorted(existing.values(), key=lambda c: c.pk):
+            by_name.setdefault((cat.parent_id, cat.name), cat)
+
+        renamed = []
+        seen = set()
+        level = [(None, _normalize(node)) for node in tree]
+        while level:
+            resolved, new, pending = [], [], set()
+            for parent, node in level:
+                parent_id = parent.pk if parent else None
+                if node['id'] is not None:
+                    cat = existing.get(node['id'])
+                    if cat is None:
+                        raise ValueError(f"Категории с id={node['id']} нет в базе")
+                else:
+                    cat = by_name.get((parent_id, node['name']))
+
+                if cat is None:
+                    if (parent_id, node['name']) in pending:
+                        raise ValueError(f"Категория «{node['name']}» встречается в файле дважды")
+                    pending.add((parent_id, node['name']))
+                    cat = Category(name=node['name'], parent_id=parent_id)
+                    new.append(cat)
+                else:
+                    if cat.pk in seen:
+                        raise ValueError(f"Категория «{node['name']}» встречается в файле дважды")
+                    changed = False
+                    if cat.name != node['name']:
+                        report['renamed'].append((cat.name, node['name']))
+                        cat.name = node['name']
+                        renamed.append(cat)
+                        changed = True
+                    if cat.parent_id != parent_id:
+                        report['moved'].append(node['name'])
+                        _reparent(cat, parent, existing)
+                        changed = True
+                    report['unchanged'] += not changed
+                    seen.add(cat.pk)
+                resolved.append((cat, node))
+
+            if new:
+                _insert_level(new, existing)
+                report['created'] += [c.name for c in new]
+                for cat in new:
+                    seen.add(cat.pk)
+                    by_name[(cat.parent_id, cat.name)] = cat
+
+            level = [(cat, _normalize(child)) for cat, node in resolved for child in node['children']]
+
+        if renamed:
+            Category.objects.bulk_update(renamed, ['name'])
+
+        if dry_run:
+            transaction.set_rollback(True)
+        elif report['created'] or report['renamed'] or report['moved']:
+            # bulk-операции не шлют сигналов — кэш дерева сбрасываем сами
+            invalidate_category_tree()
+
+    return report
+
+
+def _insert_level(new, existing):
+    """Вставить узлы одного уровня и проставить им путь"""
+    last_pk = max(existing, default=0)
+    Category.objects.bulk_create(new)
+    if not connection.features.can_return_rows_from_bulk_insert:
+        # MySQL не возвращает id вставленных строк — дочитываем их
+        ids = {
+            (parent_id, name): pk
+            for pk, parent_id, name in Category.objects.filter(
+                pk__gt=last_pk, name__in={c.name for c in new},
+            ).values_list('pk', 'parent_id', 'name')
         }
-    }
-
-    def add_category(name, parent=None):
-        cat, created = Category.objects.get_or_create(name=name, parent=parent)
-        return cat
-
-    for top, sub in categories.items():
-        top_cat = add_category(top)
-        for mid, bottoms in sub.items():
-            if mid:
-                mid_cat = add_category(mid, parent=top_cat)
-                for bottom in bottoms:
-                    add_category(bottom, parent=mid_cat)
-            else:
-                for bottom in bottoms:
-                    add_category(bottom, parent=top_cat)
+        for cat in new:
+            cat.pk = ids[(cat.parent_id, cat.name)]
+
+    for cat in new:
+        parent_path = existing[cat.parent_id].path if cat.parent_id else ''
+        cat.path = f'{parent_path}{cat.pk}/'
+        cat.depth = cat.path.count('/') - 1
+        existing[cat.pk] = cat
+    Category.objects.bulk_update(new, ['path', 'depth'])
+    CategoryCounter.objects.bulk_create([CategoryCounter(category_id=cat.pk) for cat in new])
+
+
+def _reparent(cat, parent, existing):
+    """Перенести узел с веткой; пути потомков в памяти обновляем вслед за базой"""
+    old_path = cat.path
+    cat.parent_id = parent.pk if parent else None
+    Category.objects.filter(pk=cat.pk).update(parent_id=cat.parent_id)
+    cat._move_subtree(f"{parent.path if parent else ''}{cat.pk}/")
+
+    for other in existing.values():
+        if other is not cat and other.path.startswith(old_path):
+            other.path = cat.path + other.path[len(old_path):]
+            other.depth = other.path.count('/') - 1
+
+
+def create_categories(dry_run=False):
+    """Стандартное дерево категорий из core/data/categories.json"""
+    return sync_categories(load_tree(), dry_run=dry_run)
@@ -0,0 +1,100 @@
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .conditional import invalidate_catalog
+from .counters import apply_deltas, apply_request_deltas, request_status_deltas
+from .models import Product, TradeRequest
+from .notifications import notify, request_events
+
+ACTION_STATUS = {
+    'take': 'taken',
+    'exchange': 'exchanged',
+}
+
+
+class ReservationError(Exception):
+    """Товар нельзя забронировать: уже занят, снят с модерации или свой"""
+
+
+def reserve_product(product, requester, action):
+    """
+    Забронировать товар и создать заявку.
+
+    Бронь — один условный UPDATE ... WHERE status='available': из
+    одновременных запросов строку меняет только первый, остальные получают
+    0 обновлённых строк. Блокировка держится только на время этого UPDATE и
+    вставки заявки. Остальные поля товара не перезаписываются, а version
+    растёт, чтобы сохранение формы по устаревшей копии товара не вернуло
+    ему статус "доступно".
+    """
+    if action not in ACTION_STATUS:
+        raise ReservationError("Неизвестное действие.")
+
+    with transaction.atomic():
+        reserved = (
+            Product.objects
+            .filter(pk=product.pk, status='available', is_approved=True)
+            .exclude(user=requester)
+            .update(status=ACTION_STATUS[action], version=F('version') + 1, updated_at=timezone.now())
+        )
+        if not reserved:
+            raise ReservationError("Этот товар уже забронирован.")
+
+        # Путь и владельца перечитываем под блокировкой строки: копия товара у
+        # вызывающего прочитана до UPDATE, категорию могли сменить
+        owner_id, category_path = Product.objects.filter(pk=product.pk).values_list(
+            'user_id', 'category_path',
+        ).get()
+        trade_request = TradeRequest.objects.create(
+            product=product,
+            requester=requester,
+            owner_id=owner_id,
+            action=action,
+        )
+        # update() обходит save() и сигналы: товар уходит из счётчиков и ленты
+        apply_deltas({category_path: -1})
+        invalidate_catalog()
+    return trade_request
+
+
+# Решение -> (кто принимает, из какого статуса, в какой)
+DECISIONS = {
+    'accept': ('owner', 'pending', 'accepted'),
+    'reject': ('owner', 'pending', 'rejected'),
+    'cancel': ('requester', 'pending', 'cancelled'),
+    'complete': ('requester', 'accepted', 'completed'),
+}
+
+
+def decide_request(request_id, user, decision):
+    """
+    Применить решение по заявке одним условным UPDATE одного столбца.
+
+    Роль пользователя и допустимый исходный статус входят в WHERE, поэтому
+    повторный клик или гонка двух вкладок ничего не перезаписывают.
+    Возвращает True, если статус изменился.
+    """
+    if decision not in DECISIONS:
+        return False
+    try:
+        request_id = int(request_id)
+    except (TypeError, ValueError):
+        return False
+    role, from_status, to_status = DECISIONS[decision]
+
+    with transaction.atomic():
+        updated = TradeRequest.objects.filter(pk=request_id, status=from_status, **{role: user}).update(
+            status=to_status, updated_at=timezone.now(),
+        )
+        if not updated:
+            return False
+        owner_id, requester_id, product_id = TradeRequest.objects.filter(pk=request_id).values_list(
+            'owner_id', 'requester_id', 'product_id',
+        ).get()
+        trade_request = TradeRequest(
+            pk=request_id, owner_id=owner_id, requester_id=requester_id, product_id=product_id, status=to_status,
+        )
+        apply_request_deltas(request_status_deltas(trade_request, from_status, to_status))
+        notify(request_events(trade_request, 'status'))
+    return True
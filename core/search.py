@@ -0,0 +1,208 @@
+import re
+
+from django.db import connection
+
+from .models import Product
+
+PAGE_SIZE = 24
+MAX_TERMS = 8
+
+FTS_TABLE = 'core_product_fts'
+
+# Окончания для лёгкого стемминга: отрезаем самое длинное подходящее,
+# остаток ищем как префикс ("куртк*" найдёт "куртка", "куртки", "куртками")
+RU_ENDINGS = sorted([
+    'иями', 'ями', 'ами', 'иях', 'ях', 'ах', 'ией', 'ей', 'ой', 'ый', 'ий', 'ая', 'яя',
+    'ое', 'ее', 'ые', 'ие', 'ых', 'их', 'ого', 'его', 'ому', 'ему', 'ым', 'им', 'ую', 'юю',
+    'ом', 'ем', 'ам', 'ям', 'ов', 'ев', 'ия', 'ье', 'ья', 'ью', 'ию', 'ии',
+    'ость', 'ости', 'ться', 'тся', 'ешь', 'ете', 'ет', 'ут', 'ют', 'ат', 'ят',
+    'ить', 'ать', 'ять', 'еть', 'ть',
+    'ю', 'я', 'а', 'о', 'е', 'ы', 'и', 'у', 'й', 'ь',
+], key=len, reverse=True)
+
+MIN_STEM = 3
+# innodb_ft_min_token_size по умолчанию: более короткие слова не попадают в FULLTEXT
+MYSQL_MIN_TOKEN = 3
+
+
+def stem(word):
+    if re.search('[а-я]', word):
+        for ending in RU_ENDINGS:
+            if word.endswith(ending) and len(word) - len(ending) >= MIN_STEM:
+                return word[:-len(ending)]
+        return word
+    if len(word) > 4 and word.endswith('s'):
+        return word[:-1]
+    return word
+
+
+def query_terms(query):
+    """Слова запроса, приведённые к основам"""
+    words = re.findall(r'\w+', query.lower().replace('ё', 'е'))
+    terms = []
+    for word in words:
+        term = stem(word)
+        if len(term) >= 2 and term not in terms:
+            terms.append(term)
+    return terms[:MAX_TERMS]
+
+
+def search_products(query, category_path=None, exclude_user_id=None, page=1, page_size=PAGE_SIZE):
+    """
+    Одобренные товары по запросу, от более релевантных к менее.
+
+    Поиск идёт по полнотекстовому индексу: FTS5 на SQLite, FULLTEXT на
+    MySQL. Фильтры по ветке категорий и автору применяются в том же
+    запросе, до LIMIT. Возвращает (products, has_next).
+    """
+    terms = query_terms(query)
+    if not terms:
+        return [], False
+
+    offset = (page - 1) * page_size
+    if connection.vendor == 'sqlite':
+        ids = _sqlite_ids(terms, category_path, exclude_user_id, page_size + 1, offset)
+    elif connection.vendor == 'mysql':
+        ids = _mysql_ids(terms, category_path, exclude_user_id, page_size + 1, offset)
+    else:
+        ids = _fallback_ids(terms, category_path, exclude_user_id, page_size + 1, offset)
+
+    has_next = len(ids) > page_size
+    ids = ids[:page_size]
+    found = Product.objects.select_related(
+        'main_category', 'subcategory', 'sub_subcategory'
+    ).in_bulk(ids)
+    return [found[pk] for pk in ids if pk in found], has_next
+
+
+def _filters(category_path, exclude_user_id, alias='p'):
+    where, params = [f'{alias}.is_approved'], []
+    if category_path:
+        where.append(f'{alias}.category_path >= %s AND {alias}.category_path < %s')
+        params += [category_path, category_path[:-1] + '0']
+    if exclude_user_id:
+        where.append(f'{alias}.user_id <> %s')
+        params.append(exclude_user_id)
+    return where, params
+
+
+def _sqlite_ids(terms, category_path, exclude_user_id, limit, offset):
+    match = ' '.join(f'"{t}"*' for t in terms)
+    where, params = _filters(category_path, exclude_user_id)
+    sql = (
+        f'SELECT p.id FROM {FTS_TABLE} JOIN {Product._meta.db_table} p ON p.id = {FTS_TABLE}.rowid '
+        f'WHERE {FTS_TABLE} MATCH %s AND {" AND ".join(where)} '
+        # Совпадение в заголовке весит больше, чем в описании
+        f'ORDER BY bm25({FTS_TABLE}, 5.0, 1.0) LIMIT %s OFFSET %s'
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [match, *params, limit, offset])
+        return [row[0] for row in cursor.fetchall()]
+
+
+def _mysql_ids(terms, category_path, exclude_user_id, limit, offset):
+    # Основы короче innodb_ft_min_token_size не проиндексированы: обязательный
+    # "+ab*" обнулил бы выдачу, поэтому их проверяем подстрокой, как _fallback_ids
+    indexed = [t for t in terms if len(t) >= MYSQL_MIN_TOKEN]
+    if not indexed:
+        return _fallback_ids(terms, category_path, exclude_user_id, limit, offset)
+    where, params = _filters(category_path, exclude_user_id)
+    for term in (t for t in terms if len(t) < MYSQL_MIN_TOKEN):
+        like = '%' + term.replace('_', '\\_') + '%'
+        where.append('(p.title LIKE %s OR p.description LIKE %s)')
+        params += [like, like]
+
+    against = ' '.join(f'+{t}*' for t in indexed)
+    sql = (
+        f'SELECT p.id FROM {Product._meta.db_table} p '
+        f'WHERE MATCH(p.title, p.description) AGAINST (%s IN BOOLEAN MODE) AND {" AND ".join(where)} '
+        f'ORDER BY 5 * MATCH(p.title) AGAINST (%s IN BOOLEAN MODE) '
+        f'+ MATCH(p.title, p.description) AGAINST (%s IN BOOLEAN MODE) DESC '
+        f'LIMIT %s OFFSET %s'
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [against, *params, against, against, limit, offset])
+        return [row[0] for row in cursor.fetchall()]
+
+
+def _fallback_ids(terms, category_path, exclude_user_id, limit, offset):
+    # Для баз без полнотекстового индекса (например, PostgreSQL в разработке)
+    from django.db.models import Q
+
+    from .models import subtree_q
+
+    qs = Product.objects.filter(is_approved=True)
+    for term in terms:
+        qs = qs.filter(Q(title__icontains=term) | Q(description__icontains=term))
+    if category_path:
+        qs = qs.filter(subtree_q(category_path, 'category_path'))
+    if exclude_user_id:
+        qs = qs.exclude(user_id=exclude_user_id)
+    return list(qs.order_by('-created_at').values_list('id', flat=True)[offset:offset + limit])
+
+
+def ensure_search_index(schema_connection=None):
+    """
+    Создать полнотекстовый индекс, если его нет.
+
+    На SQLite индекс — внешняя таблица FTS5 с триггерами. Django пересоздаёт
+    таблицу core_product при части миграций и теряет триггеры, поэтому
+    функция идемпотентна и вызывается после каждого migrate.
+    """
+    conn = schema_connection or connection
+    table = Product._meta.db_table
+    with conn.cursor() as cursor:
+        if conn.vendor == 'sqlite':
+            cursor.execute(
+                "SELECT count(*) FROM sqlite_master WHERE type = 'trigger' AND name LIKE %s",
+                [f'{FTS_TABLE}_%'],
+            )
+            if cursor.fetchone()[0] == 3:
+                return
+            cursor.execute(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+                f"title, description, content='{table}', content_rowid='id', "
+                f"tokenize='unicode61 remove_diacritics 2')"
+            )
+            cursor.execute(
+                f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ai AFTER INSERT ON {table} BEGIN "
+                f"INSERT INTO {FTS_TABLE}(rowid, title, description) VALUES (new.id, new.title, new.description); END"
+            )
+            cursor.execute(
+                f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ad AFTER DELETE ON {table} BEGIN "
+                f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, title, description) "
+                f"VALUES ('delete', old.id, old.title, old.description); END"
+            )
+            cursor.execute(
+                f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_au AFTER UPDATE OF title, description ON {table} BEGIN "
+                f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, title, description) "
+                f"VALUES ('delete', old.id, old.title, old.description); "
+                f"INSERT INTO {FTS_TABLE}(rowid, title, description) VALUES (new.id, new.title, new.description); END"
+            )
+            # Триггеров не было — индекс мог отстать от таблицы
+            cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+        elif conn.vendor == 'mysql':
+            cursor.execute(
+                "SELECT count(*) FROM information_schema.statistics "
+                "WHERE table_schema = DATABASE() AND table_name = %s AND index_type = 'FULLTEXT'",
+                [table],
+            )
+            if cursor.fetchone()[0]:
+                return
+            cursor.execute(
+                f"ALTER TABLE {table} "
+                f"ADD FULLTEXT INDEX product_title_ft (title), "
+                f"ADD FULLTEXT INDEX product_text_ft (title, description)"
+            )
+
+
+def drop_search_index(schema_connection=None):
+    conn = schema_connection or connection
+    table = Product._meta.db_table
+    with conn.cursor() as cursor:
+        if conn.vendor == 'sqlite':
+            for suffix in ('ai', 'ad', 'au'):
+                cursor.execute(f"DROP TRIGGER IF EXISTS {FTS_TABLE}_{suffix}")
+            cursor.execute(f"DROP TABLE IF EXISTS {FTS_TABLE}")
+        elif conn.vendor == 'mysql':
+            cursor.execute(f"ALTER TABLE {table} DROP INDEX product_title_ft, DROP INDEX product_text_ft")
@@ -0,0 +1,308 @@
+import heapq
+import logging
+import math
+import re
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.cache import cache
+from django.db import connections, transaction
+from django.db.models import Count
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+TOP_K = 12
+MAX_TERMS = 50         # терминов на товар после отсечения по весу
+TITLE_WEIGHT = 2       # слово в заголовке считается дважды
+MAX_DF_RATIO = 0.5     # термы из половины товаров почти не различают, их пропускаем при сравнении
+CATEGORY_WEIGHT = 0.3  # прибавка за общую ветку категорий (доля общих уровней пути)
+NEIGHBOUR_UPDATES = 200
+# Число товаров в матрице (N для IDF): ведут rebuild, fold_in и remove
+INDEXED_COUNT_KEY = 'core:similarity_indexed'
+
+# Один поток: дозагрузки правят списки соседей и не должны гоняться друг с другом
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='similarity')
+
+
+def document_terms(title, description):
+    """Частоты основ слов товара (тот же стемминг, что и в поиске)"""
+    from .search import stem
+
+    terms = Counter()
+    for text, weight in ((title, TITLE_WEIGHT), (description, 1)):
+        for word in re.findall(r'\w+', text.lower().replace('ё', 'е')):
+            term = stem(word)[:64]
+            if len(term) >= 2 and not term.isdigit():
+                terms[term] += weight
+    return terms
+
+
+def tfidf(terms, df, n):
+    """Нормированный TF-IDF вектор {term: weight}, не длиннее MAX_TERMS"""
+    vector = {
+        term: (1 + math.log(tf)) * (math.log((1 + n) / (1 + df.get(term, 0))) + 1)
+        for term, tf in terms.items()
+    }
+    if len(vector) > MAX_TERMS:
+        vector = dict(heapq.nlargest(MAX_TERMS, vector.items(), key=lambda item: item[1]))
+    norm = math.sqrt(sum(w * w for w in vector.values())) or 1.0
+    return {term: w / norm for term, w in vector.items()}
+
+
+def category_bonus(path_a, path_b):
+    a, b = path_a.split('/')[:-1], path_b.split('/')[:-1]
+    depth = max(len(a), len(b))
+    if not depth:
+        return 0.0
+    common = 0
+    for x, y in zip(a, b):
+        if x != y:
+            break
+        common += 1
+    return CATEGORY_WEIGHT * common / depth
+
+
+def _top(scores, paths, own_path):
+    ranked = ((pk, score + category_bonus(own_path, paths[pk])) for pk, score in scores.items() if pk in paths)
+    return [[pk, round(score, 4)] for pk, score in heapq.nlargest(TOP_K, ranked, key=lambda item: item[1])]
+
+
+def indexed_count():
+    """Сколько товаров в матрице; без ключа в кэше — один COUNT и кэшируем"""
+    from .models import ProductSimilarity
+
+    n = cache.get(INDEXED_COUNT_KEY)
+    if n is None:
+        n = ProductSimilarity.objects.count()
+        cache.add(INDEXED_COUNT_KEY, n, None)
+    return n
+
+
+def _adjust_indexed_count(delta):
+    if delta:
+        try:
+            cache.incr(INDEXED_COUNT_KEY, delta)
+        except ValueError:
+            pass  # ключа нет — indexed_count пересчитает
+
+
+def _sharing_terms(product_id, n):
+    """
+    Товары с общими с product_id термами (кроме слишком частых) — только в их
+    списках соседей он может стоять: без общих термов сходство не считается.
+    """
+    from .models import SimilarityPosting
+
+    terms = SimilarityPosting.objects.filter(product_id=product_id).values('term')
+    rare = (
+        SimilarityPosting.objects.filter(term__in=terms).values('term')
+        .annotate(n=Count('product')).filter(n__lte=max(2, MAX_DF_RATIO * n)).values('term')
+    )
+    return set(
+        SimilarityPosting.objects.filter(term__in=rare).exclude(product_id=product_id)
+        .values_list('product_id', flat=True).distinct()
+    )
+
+
+def rebuild():
+    """
+    Пересчитать матрицу и соседей всех одобренных товаров.
+
+    Скалярные произведения считаются по инвертированному индексу (строка
+    разреженной матрицы на её транспонированную): каждый товар сравнивается
+    только с товарами, у которых есть общие термы. Возвращает число товаров.
+    """
+    from .models import Product, ProductSimilarity, SimilarityPosting
+
+    rows = Product.objects.filter(is_approved=True).values_list('id', 'title', 'description', 'category_path')
+    docs, paths, df = {}, {}, Counter()
+    for pk, title, description, path in rows.iterator(chunk_size=2000):
+        docs[pk] = document_terms(title, description)
+        paths[pk] = path
+        df.update(docs[pk].keys())
+
+    n = len(docs)
+    vectors = {pk: tfidf(terms, df, n) for pk, terms in docs.items()}
+    postings = defaultdict(list)
+    for pk, vector in vectors.items():
+        for term, weight in vector.items():
+            postings[term].append((pk, weight))
+
+    max_df = max(2, MAX_DF_RATIO * n)
+    neighbours = {}
+    for pk, vector in vectors.items():
+        scores = defaultdict(float)
+        for term, weight in vector.items():
+            column = postings[term]
+            if len(column) > max_df:
+                continue
+            for other, other_weight in column:
+                if other != pk:
+                    scores[other] += weight * other_weight
+        neighbours[pk] = _top(scores, paths, paths[pk])
+
+    with transaction.atomic():
+        SimilarityPosting.objects.all().delete()
+        SimilarityPosting.objects.bulk_create(
+            (SimilarityPosting(term=term, product_id=pk, weight=weight)
+             for pk, vector in vectors.items() for term, weight in vector.items()),
+            batch_size=1000,
+        )
+        ProductSimilarity.objects.all().delete()
+        ProductSimilarity.objects.bulk_create(
+            (ProductSimilarity(product_id=pk, neighbours=top) for pk, top in neighbours.items()),
+            batch_size=1000,
+        )
+    cache.set(INDEXED_COUNT_KEY, n, None)
+    return n
+
+
+def fold_in(product):
+    """
+    Добавить один товар к готовой матрице без полного пересчёта.
+
+    IDF берётся по уже сохранённым столбцам, сравнение — только с товарами,
+    у которых есть общие термы. Новый товар попадает и в списки соседей
+    самых близких к нему товаров. Повторный вызов после правки текста
+    заменяет вектор товара и его места в чужих списках. Полный rebuild по
+    расписанию выравнивает накопленный дрейф IDF.
+    """
+    from .models import Product, ProductSimilarity, SimilarityPosting
+
+    with transaction.atomic():
+        indexed = ProductSimilarity.objects.filter(product=product).exists()
+        n = indexed_count() + (0 if indexed else 1)
+        # Списки, где товар мог стоять по прежнему тексту
+        previous = _sharing_terms(product.pk, n) if indexed else set()
+        SimilarityPosting.objects.filter(product=product).delete()
+        terms = document_terms(product.title, product.description)
+        df = dict(
+            SimilarityPosting.objects.filter(term__in=terms).values('term')
+            .annotate(n=Count('product')).order_by().values_list('term', 'n')
+        )
+        vector = tfidf(terms, df, n)
+        SimilarityPosting.objects.bulk_create(
+            SimilarityPosting(term=term, product=product, weight=weight) for term, weight in vector.items()
+        )
+
+        max_df = max(2, MAX_DF_RATIO * n)
+        common = [term for term in vector if df.get(term, 0) <= max_df]
+        scores = defaultdict(float)
+        column = SimilarityPosting.objects.filter(term__in=common).exclude(product=product)
+        for other, term, weight in column.values_list('product_id', 'term', 'weight'):
+            scores[other] += vector[term] * weight
+
+        paths = dict(
+            Product.objects.filter(pk__in=scores, is_approved=True).values_list('id', 'category_path')
+        )
+        top = _top(scores, paths, product.category_path)
+        ProductSimilarity.objects.update_or_create(product=product, defaults={'neighbours': top})
+
+        # Сходство симметрично: новый товар может войти в топ своих соседей,
+        # а из списков, куда он попал по старому тексту, уходит прежняя оценка
+        changed, now = [], timezone.now()
+        candidates = heapq.nlargest(NEIGHBOUR_UPDATES, (pk for pk in scores if pk in paths), key=scores.get)
+        for row in ProductSimilarity.objects.filter(pk__in=previous.union(candidates)):
+            current = [item for item in row.neighbours if item[0] != product.pk]
+            if row.pk in paths and row.pk in scores:
+                score = round(scores[row.pk] + category_bonus(product.category_path, paths[row.pk]), 4)
+                if len(current) < TOP_K or score > current[-1][1]:
+                    current.append([product.pk, score])
+                    current.sort(key=lambda item: item[1], reverse=True)
+                    current = current[:TOP_K]
+            if current != row.neighbours:
+                row.neighbours = current
+                row.updated_at = now
+                changed.append(row)
+        ProductSimilarity.objects.bulk_update(changed, ['neighbours', 'updated_at'])
+    if not indexed:
+        _adjust_indexed_count(1)
+    return top
+
+
+def remove(product_ids):
+    """
+    Убрать товары из матрицы: их столбцы (df остальных термов не копит
+    снятые товары), строки соседей и места в чужих списках.
+    """
+    from .models import ProductSimilarity, SimilarityPosting
+
+    product_ids = set(product_ids)
+    if not product_ids:
+        return 0
+    with transaction.atomic():
+        n = indexed_count()
+        referencing = set()
+        for pk in product_ids:
+            referencing |= _sharing_terms(pk, n)
+        SimilarityPosting.objects.filter(product_id__in=product_ids).delete()
+        removed, _ = ProductSimilarity.objects.filter(pk__in=product_ids).delete()
+
+        changed, now = [], timezone.now()
+        for row in ProductSimilarity.objects.filter(pk__in=referencing - product_ids):
+            current = [item for item in row.neighbours if item[0] not in product_ids]
+            if len(current) != len(row.neighbours):
+                row.neighbours = current
+                row.updated_at = now
+                changed.append(row)
+        ProductSimilarity.objects.bulk_update(changed, ['neighbours', 'updated_at'])
+    _adjust_indexed_count(-removed)
+    return removed
+
+
+def similar_products(product, limit=6):
+    """Похожие одобренные товары из заранее посчитанной строки"""
+    from .models import Product, ProductSimilarity
+
+    try:
+        neighbours = product.similarity.neighbours
+    except ProductSimilarity.DoesNotExist:
+        return []
+    ids = [pk for pk, _ in neighbours]
+    if not ids:
+        return []
+    found = Product.objects.filter(is_approved=True, status='available').in_bulk(ids)
+    return [found[pk] for pk in ids if pk in found][:limit]
+
+
+def _fold_in_background(product_ids):
+    from .models import Product
+
+    try:
+        products = Product.objects.filter(pk__in=product_ids, is_approved=True).only(
+            'id', 'title', 'description', 'category_path',
+        )
+        for product in products:
+            fold_in(product)
+    except Exception:
+        logger.exception("Не удалось посчитать похожие товары для %s", product_ids)
+    finally:
+        connections.close_all()
+
+
+def schedule_fold_in(product_ids):
+    """Дозагрузка после коммита в фоновом потоке (как нарезка изображений)"""
+    product_ids = list(product_ids)
+    if product_ids:
+        transaction.on_commit(lambda: _executor.submit(_fold_in_background, product_ids))
+
+
+def _remove_in_background(product_ids):
+    from .models import Product
+
+    try:
+        # Товар могли снова одобрить до запуска — тогда его уже дозагружает fold_in
+        approved = Product.objects.filter(pk__in=product_ids, is_approved=True).values_list('pk', flat=True)
+        remove(set(product_ids) - set(approved))
+    except Exception:
+        logger.exception("Не удалось убрать товары %s из похожих", product_ids)
+    finally:
+        connections.close_all()
+
+
+def schedule_remove(product_ids):
+    """Снятые с модерации товары — из матрицы после коммита, в том же потоке, что и fold_in"""
+    product_ids = list(product_ids)
+    if product_ids:
+        transaction.on_commit(lambda: _executor.submit(_remove_in_background, product_ids))
@@ -0,0 +1,35 @@
+from contextlib import contextmanager
+
+from django.db import connection
+
+from .middleware import QueryStats
+
+
+class QueryBudgetMixin:
+    """
+    Проверка бюджета запросов для TestCase.
+
+        with self.assertQueryBudget(6):
+            self.client.get(url)
+
+    В отличие от assertNumQueries, задаёт верхнюю границу, а не точное
+    число: бюджет не ломается от оптимизаций, но ловит N+1 — тест нужно
+    гонять на нескольких строках, чтобы лишние запросы на строку вылезли.
+    """
+
+    @contextmanager
+    def assertQueryBudget(self, max_queries, max_duplicates=None):
+        stats = QueryStats()
+        with connection.execute_wrapper(stats):
+            yield stats
+
+        problems = []
+        if stats.count > max_queries:
+            problems.append(f'{stats.count} queries, budget is {max_queries}')
+        if max_duplicates is not None and stats.duplicates > max_duplicates:
+            problems.append(f'{stats.duplicates} duplicate queries, budget is {max_duplicates}')
+        if problems:
+            repeated = '\n'.join(
+                f'  {n}x {sql}' for sql, n in stats.statements.most_common() if n > 1
+            )
+            self.fail('; '.join(problems) + (f'\nRepeated SQL:\n{repeated}' if repeated else ''))
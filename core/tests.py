@@ -1,3 +1,1058 @@
-from django.test import TestCase
+import asyncio
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from io import BytesIO, StringIO
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from asgiref.testing import ApplicationCommunicator
+from channels.exceptions import ChannelFull
+from django.contrib.auth.models import AnonymousUser, User
+from django.core.cache import cache, caches
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.db.models import F
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from PIL import Image
+
+from core import cards
+from core.channel_layers import Broker, UnixSocketChannelLayer, read_frame, write_frame
+from core.category_tree import current_version, get_category_tree
+from core.consumers import NotificationConsumer
+from core.forms import ProductForm
+from core.images import generate_variants, variant_name
+from core.counters import set_approved
+from core.pagination import EstimatedCountPaginator
+from core.populate_categories import create_categories, sync_categories
+from core.reservations import decide_request, reserve_product
+from core.similarity import fold_in, indexed_count, rebuild
+from core.notifications import _send as send_notifications
+from core.models import (
+    Category, CategoryCounter, ConcurrentModification, Product, ProductSimilarity, SimilarityPosting, TradeRequest,
+    TradeRequestCounter, subtree_q,
+)
+from core.testing import QueryBudgetMixin
+
+
+class HomeFeedPaginationTest(TestCase):
+    def setUp(self):
+        self.owner = User.objects.create_user(username='owner', password='pass')
+        self.books = Category.objects.create(name='Книги')
+        self.clothes = Category.objects.create(name='Одежда')
+        for i in range(30):
+            Product.objects.create(
+                user=self.owner, name='Owner', phone='000', title=f'Item {i}',
+                description='desc', type='free', is_approved=True,
+                main_category=self.books if i % 2 else self.clothes,
+            )
+
+    def _walk(self, **params):
+        seen, cursor = [], None
+        while True:
+            query = dict(params, format='json')
+            if cursor:
+                query['cursor'] = cursor
+            data = self.client.get(reverse('home'), query).json()
+            seen.extend(p['id'] for p in data['products'])
+            cursor = data['next_cursor']
+            if not cursor:
+                return seen
+
+    def test_cursor_walks_whole_feed_without_duplicates(self):
+        seen = self._walk()
+        expected = list(Product.objects.order_by('-created_at', '-id').values_list('id', flat=True))
+        self.assertEqual(seen, expected)
+
+    def test_cursor_respects_category_filter(self):
+        seen = self._walk(category=self.books.id)
+        self.assertEqual(len(seen), 15)
+        self.assertEqual(set(seen), set(Product.objects.filter(main_category=self.books).values_list('id', flat=True)))
+
+    def test_broken_cursor_falls_back_to_first_page(self):
+        data = self.client.get(reverse('home'), {'format': 'json', 'cursor': '!!'}).json()
+        self.assertEqual(len(data['products']), 24)
+
+
+class HotQueryPlanTest(TestCase):
+    def test_hot_views_do_not_scan_tables(self):
+        out = StringIO()
+        call_command('explain_hot_queries', seed=200, stdout=out)
+        self.assertIn('No full table scans found', out.getvalue())
+
+
+class CategoryPathTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='u', password='pass')
+        self.electronics = Category.objects.create(name='Электроника')
+        self.accessories = Category.objects.create(name='Аксессуары', parent=self.electronics)
+        self.cables = Category.objects.create(name='Кабели', parent=self.accessories)
+        self.usb = Category.objects.create(name='USB', parent=self.cables)
+        self.books = Category.objects.create(name='Книги')
+
+    def _product(self, **cats):
+        return Product.objects.create(
+            user=self.user, name='n', phone='0', title='t', description='d', type='free', **cats
+        )
+
+    def test_paths_support_any_depth(self):
+        self.assertEqual(self.usb.path, f'{self.electronics.pk}/{self.accessories.pk}/{self.cables.pk}/{self.usb.pk}/')
+        self.assertEqual(self.usb.depth, 3)
+
+    def test_subtree_lookup_uses_deepest_category(self):
+        deep = self._product(main_category=self.electronics, subcategory=self.accessories, sub_subcategory=self.cables)
+        self._product(main_category=self.books)
+        under = Product.objects.filter(subtree_q(self.electronics.path, 'category_path'))
+        self.assertEqual(list(under), [deep])
+
+    def test_reparent_rewrites_descendants_and_products(self):
+        product = self._product(main_category=self.electronics, subcategory=self.accessories, sub_subcategory=self.cables)
+        self.accessories.parent = self.books
+        self.accessories.save()
+
+        self.usb.refresh_from_db()
+        product.refresh_from_db()
+        self.assertTrue(self.usb.path.startswith(f'{self.books.pk}/{self.accessories.pk}/'))
+        self.assertEqual(self.usb.depth, 3)
+        self.assertTrue(product.category_path.startswith(f'{self.books.pk}/'))
+
+    def test_deleting_branch_lifts_products_to_parent(self):
+        product = self._product(main_category=self.electronics, subcategory=self.accessories, sub_subcategory=self.cables)
+        self.accessories.delete()
+        product.refresh_from_db()
+        self.assertEqual(product.category_path, self.electronics.path)
+
+
+class CategoryTreeCacheTest(TransactionTestCase):
+    def setUp(self):
+        self.top = Category.objects.create(name='Top')
+        self.child = Category.objects.create(name='Child', parent=self.top)
+
+    def test_version_is_shared_between_processes(self):
+        # Другой воркер сбрасывает дерево — этот процесс видит новую версию
+        before = current_version()
+        subprocess.run([sys.executable, '-c', (
+            "import django; django.setup(); "
+            "from core.category_tree import _bump_version; _bump_version()"
+        )], check=True, env={**os.environ, 'DJANGO_SETTINGS_MODULE': 'CharityAlmaWeb.settings'})
+        self.assertNotEqual(current_version(), before)
+
+    def test_steady_state_lookups_cost_no_queries(self):
+        get_category_tree()
+        with self.assertNumQueries(0):
+            resp = self.client.get(reverse('get_subcategories', args=[self.top.id]))
+            form = ProductForm(initial={'main_category': self.top.id})
+            str(form['main_category'])
+            form = ProductForm(data={'main_category': self.top.id, 'subcategory': self.child.id})
+            self.assertEqual(form.fields['subcategory'].clean(self.child.id), self.child)
+        self.assertEqual(resp.json(), [{'id': self.child.id, 'name': 'Child'}])
+
+    def test_save_and_delete_invalidate_tree(self):
+        get_category_tree()
+        extra = Category.objects.create(name='Extra', parent=self.top)
+        self.assertIn(extra, get_category_tree().children(self.top.id))
+        extra.delete()
+        self.assertNotIn(extra.pk, get_category_tree().nodes)
+
+    def test_form_rejects_category_outside_selected_branch(self):
+        other = Category.objects.create(name='Other')
+        form = ProductForm(data={'main_category': self.top.id, 'subcategory': other.id})
+        form.is_valid()
+        self.assertIn('subcategory', form.errors)
+
+
+class ProductSearchTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='seller', password='pass')
+        self.clothes = Category.objects.create(name='Одежда')
+        self.books = Category.objects.create(name='Книги')
+        self.jacket = self._product('Зимняя куртка', 'Тёплая, почти новая', self.clothes)
+        self.mention = self._product('Шапка', 'Подойдёт к любой куртке', self.clothes)
+        self.book = self._product('Книга про куртки', 'Учебник', self.books)
+        self._product('Куртка на модерации', 'desc', self.clothes, is_approved=False)
+
+    def _product(self, title, description, category, is_approved=True):
+        return Product.objects.create(
+            user=self.user, name='n', phone='0', title=title, description=description,
+            type='free', main_category=category, is_approved=is_approved,
+        )
+
+    def _search(self, **params):
+        data = self.client.get(reverse('search'), dict(params, format='json')).json()
+        return [p['id'] for p in data['products']]
+
+    def test_matches_word_forms_and_ranks_title_first(self):
+        found = self._search(q='куртки')
+        self.assertEqual(set(found), {self.jacket.id, self.mention.id, self.book.id})
+        self.assertEqual(found[-1], self.mention.id)
+
+    def test_combines_with_category_filter(self):
+        self.assertEqual(self._search(q='куртка', category=self.books.id), [self.book.id])
+
+    def test_index_follows_title_updates(self):
+        self.jacket.title = 'Пальто'
+        self.jacket.save()
+        self.assertIn(self.jacket.id, self._search(q='пальто'))
+        self.assertNotIn(self.jacket.id, self._search(q='зимняя'))
+
+    def test_html_page_renders_results(self):
+        resp = self.client.get(reverse('search'), {'q': 'шапку'})
+        self.assertContains(resp, 'Шапка')
+
+    def test_mysql_short_terms_are_not_required_fulltext_words(self):
+        # InnoDB не индексирует слова короче 3 символов: "+тв*" вернул бы пустую выдачу
+        from core import search
+
+        with mock.patch.object(search, 'connection') as conn:
+            cursor = conn.cursor.return_value.__enter__.return_value
+            cursor.fetchall.return_value = []
+            search._mysql_ids(['тв', 'samsung'], None, None, 10, 0)
+        sql, params = cursor.execute.call_args[0]
+        self.assertEqual(params[0], '+samsung*')
+        self.assertIn('LIKE', sql)
+        self.assertIn('%тв%', params)
+
+
+class ImageVariantsTest(TestCase):
+    def setUp(self):
+        self.media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media)
+        override = override_settings(MEDIA_ROOT=self.media)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.user = User.objects.create_user(username='u', password='pass')
+
+    def _upload(self, size=(2000, 1500)):
+        buffer = BytesIO()
+        Image.new('RGB', size, 'red').save(buffer, 'JPEG')
+        return SimpleUploadedFile('photo.jpg', buffer.getvalue(), content_type='image/jpeg')
+
+    def test_new_image_is_scheduled_after_commit(self):
+        with mock.patch('core.images._executor') as executor, self.captureOnCommitCallbacks(execute=True):
+            product = Product.objects.create(
+                user=self.user, name='n', phone='0', title='t', description='d', type='free', image=self._upload(),
+            )
+        self.assertEqual(executor.submit.call_count, 1)
+        self.assertFalse(product.image_variants_ready)
+
+        with mock.patch('core.images._executor') as executor, self.captureOnCommitCallbacks(execute=True):
+            product.title = 'renamed'
+            product.save()
+        executor.submit.assert_not_called()
+
+    def test_generate_variants_writes_webp_copies(self):
+        product = Product.objects.create(
+            user=self.user, name='n', phone='0', title='t', description='d', type='free', image=self._upload(),
+        )
+        generate_variants(product)
+
+        product.refresh_from_db()
+        self.assertTrue(product.image_variants_ready)
+        with product.image.storage.open(variant_name(product.image.name, 'grid')) as f:
+            grid = Image.open(f)
+            self.assertEqual(grid.format, 'WEBP')
+            self.assertEqual(max(grid.size), 360)
+
+    def test_stale_full_save_keeps_variants_ready(self):
+        product = Product.objects.create(
+            user=self.user, name='n', phone='0', title='t', description='d', type='free', image=self._upload(),
+        )
+        opened = Product.objects.get(pk=product.pk)
+        generate_variants(product)
+        self.assertEqual(Product.objects.get(pk=product.pk).version, opened.version + 1)
+
+        # Форма прочитала товар до окончания нарезки и сохраняет его целиком
+        opened.title = 'Edited'
+        with self.assertRaises(ConcurrentModification), transaction.atomic():
+            opened.save(check_version=True)
+        opened.save()
+        self.assertTrue(Product.objects.get(pk=product.pk).image_variants_ready)
+
+    def test_variants_do_not_collide_across_extensions(self):
+        self.assertNotEqual(
+            variant_name('product_images/photo.jpg', 'grid'), variant_name('product_images/photo.png', 'grid'),
+        )
+
+    @mock.patch('core.images._executor')
+    def test_old_variants_are_removed(self, executor):
+        with self.captureOnCommitCallbacks(execute=True):
+            product = Product.objects.create(
+                user=self.user, name='n', phone='0', title='t', description='d', type='free', image=self._upload(),
+            )
+        generate_variants(product)
+        storage = product.image.storage
+        first = variant_name(product.image.name, 'grid')
+        self.assertTrue(storage.exists(first))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            product.image = self._upload()
+            product.save()
+        self.assertFalse(storage.exists(first))
+
+        generate_variants(product)
+        second = variant_name(product.image.name, 'grid')
+        self.assertTrue(storage.exists(second))
+        with self.captureOnCommitCallbacks(execute=True):
+            product.delete()
+        self.assertFalse(storage.exists(second))
+
+
+class ProductCardCacheTest(TestCase):
+    def setUp(self):
+        caches['fragments'].clear()
+        owner = User.objects.create_user(username='owner', password='pass')
+        self.category = Category.objects.create(name='Книги')
+        self.products = [
+            Product.objects.create(
+                user=owner, name='n', phone='0', title=f'Item {i}', description='desc',
+                type='free', is_approved=True, main_category=self.category,
+            )
+            for i in range(3)
+        ]
+
+    def _render(self):
+        with mock.patch.object(cards, 'render_to_string', wraps=cards.render_to_string) as render:
+            html = cards.render_product_cards(self.products)
+        return html, render.call_count
+
+    def test_warm_cache_renders_nothing(self):
+        cold, rendered = self._render()
+        self.assertEqual(rendered, 3)
+        warm, rendered = self._render()
+        self.assertEqual(rendered, 0)
+        self.assertEqual(cold, warm)
+
+    def test_save_and_category_rename_refresh_card(self):
+        self._render()
+        self.products[0].title = 'Renamed'
+        self.products[0].save()
+        html, rendered = self._render()
+        self.assertEqual(rendered, 1)
+        self.assertIn('Renamed', html[0])
+
+        self.category.name = 'Журналы'
+        self.category.save()
+        html, rendered = self._render()
+        self.assertEqual(rendered, 3)
+        self.assertIn('Журналы', html[1])
+
+
+class CategoryCounterTest(TestCase):
+    def setUp(self):
+        self.owner = User.objects.create_user(username='owner', password='pass')
+        self.top = Category.objects.create(name='Top')
+        self.sub = Category.objects.create(name='Sub', parent=self.top)
+        self.other = Category.objects.create(name='Other')
+
+    def _product(self, **kwargs):
+        fields = dict(user=self.owner, name='n', phone='0', title='t', description='d',
+                      type='free', main_category=self.top, subcategory=self.sub)
+        fields.update(kwargs)
+        return Product.objects.create(**fields)
+
+    def counts(self):
+        return dict(CategoryCounter.objects.values_list('category_id', 'available'))
+
+    def test_save_status_and_delete(self):
+        p = self._product(is_approved=True)
+        self.assertEqual(self.counts(), {self.top.pk: 1, self.sub.pk: 1, self.other.pk: 0})
+
+        p = Product.objects.get(pk=p.pk)
+        p.status = 'taken'
+        p.save()
+        self.assertEqual(self.counts()[self.top.pk], 0)
+
+        p.status = 'available'
+        p.main_category, p.subcategory = self.other, None
+        p.save()
+        self.assertEqual(self.counts(), {self.top.pk: 0, self.sub.pk: 0, self.other.pk: 1})
+
+        Product.objects.get(pk=p.pk).delete()
+        self.assertEqual(self.counts()[self.other.pk], 0)
+
+    def test_bulk_moderation_and_subtree_move(self):
+        for _ in range(3):
+            self._product()
+        self._product(status='taken')
+        set_approved(Product.objects.all(), True)
+        self.assertEqual(self.counts()[self.sub.pk], 3)
+
+        self.sub.parent = self.other
+        self.sub.save()
+        self.assertEqual(self.counts(), {self.top.pk: 0, self.sub.pk: 3, self.other.pk: 3})
+
+        set_approved(Product.objects.all(), False)
+        self.assertEqual(self.counts(), {self.top.pk: 0, self.sub.pk: 0, self.other.pk: 0})
+
+    def test_reconcile_repairs_drift(self):
+        self._product(is_approved=True)
+        CategoryCounter.objects.filter(pk=self.top.pk).update(available=7)
+        out = StringIO()
+        call_command('reconcile_counters', stdout=out)
+        self.assertIn(f'Category {self.top.pk}: 7 -> 1', out.getvalue())
+        self.assertIn('0 drifted request counters', out.getvalue())
+        self.assertEqual(self.counts()[self.top.pk], 1)
+
+
+class ConditionalGetTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='viewer', password='pass')
+        self.client.force_login(self.user)
+        session = self.client.session
+        session['onboarded'] = True
+        session.save()
+        owner = User.objects.create_user(username='owner', password='pass')
+        self.top = Category.objects.create(name='Top')
+        self.product = Product.objects.create(
+            user=owner, name='n', phone='0', title='Item', description='d',
+            type='free', is_approved=True, main_category=self.top,
+        )
+
+    def _revalidate(self, url):
+        # Первый ответ выдаёт CSRF-cookie, она входит в ETag
+        self.client.get(url)
+        first = self.client.get(url)
+        self.assertEqual(first.status_code, 200)
+        again = self.client.get(url, HTTP_IF_NONE_MATCH=first['ETag'])
+        return first, again
+
+    def test_home_not_modified_until_catalog_changes(self):
+        url = reverse('home')
+        first, again = self._revalidate(url)
+        self.assertEqual(again.status_code, 304)
+
+        self.product.title = 'Changed'
+        self.product.save()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=first['ETag']).status_code, 200)
+
+    def test_product_detail_validators(self):
+        url = reverse('product_detail', args=[self.product.id])
+        first, again = self._revalidate(url)
+        self.assertEqual(again.status_code, 304)
+        self.assertIn('Last-Modified', first)
+
+        self.top.name = 'Renamed'
+        self.top.save()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=first['ETag']).status_code, 200)
+
+    def test_product_detail_follows_other_products(self):
+        # Соседний товар из блока "похожие" сменил название — страница не должна отдать 304
+        other = Product.objects.create(
+            user=self.product.user, name='n', phone='0', title='Other', description='d',
+            type='free', is_approved=True, main_category=self.top,
+        )
+        url = reverse('product_detail', args=[self.product.id])
+        first, again = self._revalidate(url)
+        self.assertEqual(again.status_code, 304)
+
+        other.title = 'Renamed'
+        # Last-Modified с точностью до секунды — переводим часы, чтобы смена не попала в ту же
+        with mock.patch('core.conditional._new_version', return_value=f'{time.time() + 60:.6f}-next'):
+            other.save()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=first['ETag']).status_code, 200)
+        self.assertEqual(self.client.get(url, HTTP_IF_MODIFIED_SINCE=first['Last-Modified']).status_code, 200)
+
+    def test_subcategories_cache_headers(self):
+        Category.objects.create(name='Sub', parent=self.top)
+        url = reverse('get_subcategories', args=[self.top.id])
+        first, again = self._revalidate(url)
+        self.assertEqual(again.status_code, 304)
+        self.assertIn('max-age=86400', first['Cache-Control'])
+        self.assertIn('public', first['Cache-Control'])
+
+
+class CategoryLoaderTest(TestCase):
+    def test_default_tree_is_idempotent_and_bulk(self):
+        with self.assertNumQueries(12):
+            report = create_categories()
+        self.assertEqual(len(report['created']), Category.objects.count())
+        self.assertEqual(CategoryCounter.objects.count(), Category.objects.count())
+        phones = Category.objects.get(name='Смартфоны')
+        self.assertEqual(phones.path, f'{phones.parent.path}{phones.pk}/')
+
+        with self.assertNumQueries(3):
+            report = create_categories()
+        self.assertEqual(report['created'], [])
+        self.assertEqual(report['unchanged'], Category.objects.count())
+
+    def test_rename_move_and_dry_run(self):
+        sync_categories([{'name': 'A', 'children': ['Leaf']}, 'B'])
+        leaf = Category.objects.get(name='Leaf')
+        owner = User.objects.create_user(username='owner', password='pass')
+        Product.objects.create(
+            user=owner, name='n', phone='0', title='t', description='d', type='free',
+            is_approved=True, main_category=leaf.parent, subcategory=leaf,
+        )
+        b = Category.objects.get(name='B')
+
+        tree = ['A', {'name': 'B', 'children': [{'id': leaf.pk, 'name': 'Renamed'}, 'New']}]
+        report = sync_categories(tree, dry_run=True)
+        self.assertEqual(report['moved'], ['Renamed'])
+        self.assertEqual(Category.objects.get(pk=leaf.pk).name, 'Leaf')
+        self.assertFalse(Category.objects.filter(name='New').exists())
+
+        sync_categories(tree)
+        leaf.refresh_from_db()
+        self.assertEqual((leaf.name, leaf.parent_id, leaf.path), ('Renamed', b.pk, f'{b.pk}/{leaf.pk}/'))
+        self.assertEqual(Product.objects.get().category_path, leaf.path)
+        self.assertEqual(CategoryCounter.objects.get(pk=b.pk).available, 1)
+
+    def test_admin_action_reports_renames_and_moves(self):
+        from django.contrib import admin as django_admin
+        from core.admin import CategoryAdmin
+
+        report = {'created': ['New'], 'renamed': [('Leaf', 'Renamed')], 'moved': ['Renamed'], 'unchanged': 4}
+        model_admin = CategoryAdmin(Category, django_admin.site)
+        with mock.patch('core.admin.create_categories', return_value=report):
+            with mock.patch.object(model_admin, 'message_user') as message_user:
+                model_admin.load_default_categories(None, Category.objects.none())
+        text = message_user.call_args[0][1]
+        self.assertIn('переименовано 1', text)
+        self.assertIn('перемещено 1', text)
+
+    def test_command_dry_run(self):
+        out = StringIO()
+        call_command('populate_categories', '--dry-run', stdout=out)
+        self.assertIn('Dry run, nothing saved', out.getvalue())
+        self.assertFalse(Category.objects.exists())
+
+
+class SimilarProductsTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.owner = User.objects.create_user(username='owner', password='pass')
+        self.books = Category.objects.create(name='Книги')
+        self.clothes = Category.objects.create(name='Одежда')
+
+    def _product(self, title, description, category, approved=True):
+        return Product.objects.create(
+            user=self.owner, name='n', phone='0', title=title, description=description,
+            type='free', is_approved=approved, main_category=category,
+        )
+
+    def neighbours(self, product):
+        return [pk for pk, _ in ProductSimilarity.objects.get(pk=product.pk).neighbours]
+
+    def test_rebuild_ranks_by_text_and_category(self):
+        novel = self._product('Роман Толстого', 'Война и мир, первый том', self.books)
+        second = self._product('Толстой, роман', 'Война и мир, второй том', self.books)
+        jacket = self._product('Куртка зимняя', 'Тёплая куртка, размер M', self.clothes)
+        coat = self._product('Зимняя куртка', 'Тёплая, почти новая', self.clothes)
+        self._product('Роман черновик', 'Не одобрен', self.books, approved=False)
+
+        self.assertEqual(rebuild(), 4)
+        self.assertEqual(self.neighbours(novel)[0], second.pk)
+        self.assertEqual(self.neighbours(jacket), [coat.pk])
+
+    def test_fold_in_without_rebuild(self):
+        jacket = self._product('Куртка зимняя', 'Тёплая куртка', self.clothes)
+        self._product('Учебник физики', 'Для первого курса', self.books)
+        rebuild()
+
+        coat = self._product('Куртка демисезонная', 'Лёгкая куртка', self.clothes)
+        fold_in(coat)
+        self.assertEqual(self.neighbours(coat), [jacket.pk])
+        self.assertEqual(self.neighbours(jacket), [coat.pk])
+
+    def test_refold_replaces_old_entries(self):
+        jacket = self._product('Куртка зимняя', 'Тёплая куртка', self.clothes)
+        coat = self._product('Куртка демисезонная', 'Лёгкая куртка', self.clothes)
+        book = self._product('Учебник физики', 'Для первого курса', self.books)
+        rebuild()
+        self.assertEqual(self.neighbours(jacket), [coat.pk])
+
+        # N берётся из счётчика, повторная дозагрузка его не увеличивает
+        coat.title, coat.description = 'Учебник химии', 'Для первого курса'
+        with CaptureQueriesContext(connection) as queries:
+            fold_in(coat)
+        self.assertFalse([q for q in queries if 'COUNT(*)' in q['sql']])
+        self.assertEqual(indexed_count(), 3)
+        self.assertEqual(self.neighbours(jacket), [])
+        self.assertEqual(self.neighbours(coat), [book.pk])
+
+    def test_unapproved_and_deleted_products_leave_matrix(self):
+        jacket = self._product('Куртка зимняя', 'Тёплая', self.clothes)
+        coat = self._product('Куртка осенняя', 'Лёгкая', self.clothes)
+        parka = self._product('Парка зимняя', 'С капюшоном', self.clothes)
+        rebuild()
+        self.assertEqual(sorted(self.neighbours(jacket)), sorted([coat.pk, parka.pk]))
+
+        with mock.patch('core.similarity._executor') as executor, self.captureOnCommitCallbacks(execute=True):
+            set_approved(Product.objects.filter(pk=coat.pk), False)
+        (task, ids), _ = executor.submit.call_args
+        task(ids)
+        self.assertFalse(SimilarityPosting.objects.filter(product=coat).exists())
+        self.assertNotIn(coat.pk, self.neighbours(jacket))
+        self.assertEqual(indexed_count(), 2)
+
+        parka.delete()
+        self.assertEqual(self.neighbours(jacket), [])
+        self.assertEqual(indexed_count(), 1)
+
+    def test_edited_text_is_folded_in_again(self):
+        jacket = Product.objects.get(pk=self._product('Куртка зимняя', 'Тёплая куртка', self.clothes).pk)
+        with mock.patch('core.models.schedule_fold_in') as schedule:
+            jacket.status = 'taken'
+            jacket.save()
+            schedule.assert_not_called()
+
+            jacket.title = 'Пальто зимнее'
+            jacket.save(update_fields=['title'])
+            schedule.assert_called_once_with([jacket.pk])
+
+            schedule.reset_mock()
+            draft = Product.objects.get(pk=self._product('Черновик', 'Не одобрен', self.books, approved=False).pk)
+            draft.description = 'Правка'
+            draft.save()
+            schedule.assert_not_called()
+
+    def test_detail_page_reads_precomputed_row(self):
+        viewer = User.objects.create_user(username='viewer', password='pass')
+        self.client.force_login(viewer)
+        jacket = self._product('Куртка зимняя', 'Тёплая куртка', self.clothes)
+        self._product('Куртка демисезонная', 'Лёгкая куртка', self.clothes)
+        rebuild()
+
+        resp = self.client.get(reverse('product_detail', args=[jacket.pk]))
+        self.assertContains(resp, 'Похожие объявления')
+        self.assertEqual([p.title for p in resp.context['similar']], ['Куртка демисезонная'])
+
+
+class ProductReservationTest(TestCase):
+    def setUp(self):
+        self.owner = User.objects.create_user(username='owner', password='pass')
+        self.first = User.objects.create_user(username='first', password='pass')
+        self.second = User.objects.create_user(username='second', password='pass')
+        self.category = Category.objects.create(name='Книги')
+        self.product = Product.objects.create(
+            user=self.owner, name='n', phone='0', title='t', description='d',
+            type='free', is_approved=True, main_category=self.category,
+        )
+
+    def _take(self, user):
+        self.client.force_login(user)
+        return self.client.get(reverse('product_action', args=[self.product.id, 'take']))
+
+    def test_only_first_request_wins(self):
+        self.assertRedirects(self._take(self.first), reverse('requests'))
+        resp = self._take(self.second)
+        self.assertRedirects(resp, reverse('product_detail', args=[self.product.id]), fetch_redirect_response=False)
+
+        self.assertEqual(list(TradeRequest.objects.values_list('requester__username', flat=True)), ['first'])
+        product = Product.objects.get(pk=self.product.pk)
+        self.assertEqual((product.status, product.version), ('taken', 1))
+        self.assertEqual(CategoryCounter.objects.get(pk=self.category.pk).available, 0)
+
+    def test_reservation_uncounts_current_category(self):
+        stale = Product.objects.get(pk=self.product.pk)
+        other = Category.objects.create(name='Одежда')
+        moved = Product.objects.get(pk=self.product.pk)
+        moved.main_category = other
+        moved.save()
+
+        reserve_product(stale, self.first, 'take')
+        self.assertEqual(CategoryCounter.objects.get(pk=self.category.pk).available, 0)
+        self.assertEqual(CategoryCounter.objects.get(pk=other.pk).available, 0)
+
+    def test_stale_save_does_not_undo_reservation(self):
+        stale = Product.objects.get(pk=self.product.pk)
+        self._take(self.first)
+
+        stale.title = 'Edited'
+        with self.assertRaises(ConcurrentModification), transaction.atomic():
+            stale.save(check_version=True)
+        self.assertEqual(Product.objects.get(pk=self.product.pk).status, 'taken')
+
+        fresh = Product.objects.get(pk=self.product.pk)
+        fresh.title = 'Edited'
+        fresh.save(check_version=True)
+        fresh.save(update_fields=['title'], check_version=True)
+        self.assertEqual(Product.objects.get(pk=self.product.pk).version, 3)
+
+    def test_unchecked_save_still_bumps_version(self):
+        stale = Product.objects.get(pk=self.product.pk)
+        self._take(self.first)
+
+        # Служебные сохранения без check_version не падают, а версия растёт от текущей
+        stale.save(update_fields=['title'])
+        self.assertEqual(Product.objects.get(pk=self.product.pk).version, 2)
+
+    def test_edit_form_reports_conflict(self):
+        Product.objects.filter(pk=self.product.pk).update(image='product_images/photo.jpg')
+        self.client.force_login(self.owner)
+        data = {
+            'name': 'n', 'title': 'Edited', 'description': 'd', 'phone': '0', 'type': 'free',
+            'main_category': self.category.pk,
+        }
+        original_save = Product.save
+
+        def reserve_first(product, *args, **kwargs):
+            # Бронь проходит между чтением товара формой и её сохранением
+            Product.objects.filter(pk=product.pk).update(version=F('version') + 1)
+            return original_save(product, *args, **kwargs)
+
+        with mock.patch.object(Product, 'save', reserve_first):
+            resp = self.client.post(reverse('edit_product', args=[self.product.id]), data)
+        self.assertRedirects(resp, reverse('edit_product', args=[self.product.id]), fetch_redirect_response=False)
+        self.assertEqual(Product.objects.get(pk=self.product.pk).title, 't')
+
+
+class RequestsDashboardTest(QueryBudgetMixin, TestCase):
+    def setUp(self):
+        self.owner = User.objects.create_user(username='owner', password='pass')
+        self.requester = User.objects.create_user(username='requester', password='pass')
+        self.requests = []
+        for i in range(25):
+            product = Product.objects.create(
+                user=self.owner, name='n', phone='0', title=f'Item {i}', description='d', type='free',
+            )
+            self.requests.append(TradeRequest.objects.create(
+                product=product, requester=self.requester, owner=self.owner, action='take',
+            ))
+
+    def counts(self, user):
+        return {
+            (d, s): n for d, s, n in
+            TradeRequestCounter.objects.filter(user=user, count__gt=0).values_list('direction', 'status', 'count')
+        }
+
+    def test_decisions_are_conditional_and_counted(self):
+        self.client.force_login(self.owner)
+        url = reverse('requests')
+        tr = self.requests[0]
+        self.client.post(url, {'req_id': tr.id, 'decision': 'accept'})
+        # Повторное решение по уже принятой заявке ничего не меняет
+        self.client.post(url, {'req_id': tr.id, 'decision': 'reject'})
+        tr.refresh_from_db()
+        self.assertEqual(tr.status, 'accepted')
+        self.assertEqual(self.counts(self.owner), {('in', 'pending'): 24, ('in', 'accepted'): 1})
+
+        self.client.force_login(self.requester)
+        self.client.post(url, {'req_id': tr.id, 'decision': 'complete'})
+        self.client.post(url, {'req_id': self.requests[1].id, 'decision': 'accept'})
+        self.assertEqual(
+            self.counts(self.requester), {('out', 'pending'): 24, ('out', 'completed'): 1},
+        )
+
+        tr.product.delete()
+        self.assertEqual(self.counts(self.requester), {('out', 'pending'): 24})
+
+    def test_tabs_are_cursor_paginated(self):
+        self.client.force_login(self.owner)
+        with self.assertQueryBudget(6, max_duplicates=0):
+            resp = self.client.get(reverse('requests'))
+        self.assertEqual(len(resp.context['requests']), 20)
+        self.assertEqual(resp.context['tabs'], [('incoming', 'Входящие', 25), ('outgoing', 'Исходящие', 0)])
+
+        resp = self.client.get(reverse('requests'), {'cursor': resp.context['next_cursor']})
+        self.assertEqual(len(resp.context['requests']), 5)
+        self.assertIsNone(resp.context['next_cursor'])
+
+        resp = self.client.get(reverse('requests'), {'tab': 'incoming', 'status': 'accepted'})
+        self.assertEqual(list(resp.context['requests']), [])
+
+
+class NotificationChannelTest(TestCase):
+    def setUp(self):
+        self.owner = User.objects.create_user(username='owner', password='pass')
+        self.requester = User.objects.create_user(username='requester', password='pass')
+        self.product = Product.objects.create(
+            user=self.owner, name='n', phone='0', title='Item', description='d', type='free', is_approved=True,
+        )
+
+    async def connect(self, user):
+        """
+        Подключиться к каналу уведомлений; None, если сервер закрыл сокет.
+
+        channels.testing тянет daphne, поэтому говорим с консьюмером по ASGI напрямую.
+        """
+        communicator = ApplicationCommunicator(NotificationConsumer.as_asgi(), {
+            'type': 'websocket', 'path': '/ws/notifications/', 'headers': [], 'subprotocols': [],
+            'user': user,
+        })
+        await communicator.send_input({'type': 'websocket.connect'})
+        response = await communicator.receive_output()
+        return communicator if response['type'] == 'websocket.accept' else None
+
+    async def receive(self, communicator):
+        return json.loads((await communicator.receive_output())['text'])
+
+    def committed(self, func, *args):
+        with self.captureOnCommitCallbacks(execute=True):
+            return func(*args)
+
+    async def test_request_events_reach_both_sides(self):
+        owner, requester = await self.connect(self.owner), await self.connect(self.requester)
+
+        trade_request = await sync_to_async(self.committed)(reserve_product, self.product, self.requester, 'take')
+        self.assertEqual(await self.receive(owner), {
+            'kind': 'trade_request', 'event': 'created', 'id': trade_request.pk,
+            'product_id': self.product.pk, 'status': 'pending', 'direction': 'in',
+        })
+        self.assertTrue(await requester.receive_nothing())
+
+        await sync_to_async(self.committed)(decide_request, trade_request.pk, self.owner, 'accept')
+        self.assertEqual((await self.receive(owner))['status'], 'accepted')
+        self.assertEqual((await self.receive(requester))['direction'], 'out')
+
+        for communicator in (owner, requester):
+            await communicator.send_input({'type': 'websocket.disconnect', 'code': 1000})
+            await communicator.wait()
+
+    async def test_anonymous_is_rejected(self):
+        self.assertIsNone(await self.connect(AnonymousUser()))
+
+
+# Процесс-"воркер": NotificationConsumer, подключённый к брокеру, ждёт одно событие
+NOTIFICATION_WORKER = """
+import asyncio, sys, django
+from types import SimpleNamespace
+django.setup()
+from asgiref.testing import ApplicationCommunicator
+from channels.exceptions import ChannelFull
+from core.consumers import NotificationConsumer
+
+async def main():
+    user = SimpleNamespace(id=int(sys.argv[1]), is_anonymous=False)
+    communicator = ApplicationCommunicator(NotificationConsumer.as_asgi(), {
+        'type': 'websocket', 'path': '/ws/notifications/', 'headers': [], 'subprotocols': [], 'user': user,
+    })
+    await communicator.send_input({'type': 'websocket.connect'})
+    print((await communicator.receive_output())['type'], flush=True)
+    print((await communicator.receive_output(timeout=20))['text'], flush=True)
+
+asyncio.run(main())
+"""
+
+
+class UnixChannelLayerIntegrationTest(SimpleTestCase):
+    """Брокер и несколько процессов с консьюмерами: group_send доходит до сокетов в других процессах"""
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.socket = os.path.join(self.tmp, 'channels.sock')
+        self.env = {**os.environ, 'CHANNEL_LAYER': 'unix', 'CHANNEL_SOCKET': self.socket}
+        self.processes = []
+
+    def tearDown(self):
+        for process in self.processes:
+            process.kill()
+            process.wait()
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+    def spawn(self, *args):
+        process = subprocess.Popen(
+            [sys.executable, *args], env=self.env, stdout=subprocess.PIPE, text=True,
+            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        )
+        self.processes.append(process)
+        return process
+
+    def test_group_send_reaches_other_processes(self):
+        self.start_broker()
+
+        workers = [self.spawn('-c', NOTIFICATION_WORKER, str(user_id)) for user_id in (1, 1, 2)]
+        for worker in workers:
+            self.assertEqual(worker.stdout.readline().strip(), 'websocket.accept')
+
+        layer = {'default': {
+            'BACKEND': 'core.channel_layers.UnixSocketChannelLayer', 'CONFIG': {'path': self.socket},
+        }}
+        with override_settings(CHANNEL_LAYERS=layer):
+            send_notifications([(1, {'kind': 'rental', 'id': 1}), (2, {'kind': 'rental', 'id': 2})])
+
+        received = [json.loads(worker.communicate(timeout=20)[0]) for worker in workers]
+        self.assertEqual([event['id'] for event in received], [1, 1, 2])
+
+    def start_broker(self):
+        broker = self.spawn('manage.py', 'channel_broker', '--socket', self.socket)
+        deadline = time.monotonic() + 20
+        while not os.path.exists(self.socket):
+            self.assertLess(time.monotonic(), deadline, 'брокер не запустился')
+            time.sleep(0.05)
+        return broker
+
+    def test_open_sockets_survive_broker_restart(self):
+        broker = self.start_broker()
+        worker = self.spawn('-c', NOTIFICATION_WORKER, '1')
+        self.assertEqual(worker.stdout.readline().strip(), 'websocket.accept')
+
+        broker.kill()
+        broker.wait()
+        os.unlink(self.socket)
+        self.start_broker()
+
+        # Воркер переподключается сам; шлём, пока событие не дойдёт до уже открытого сокета
+        layer = {'default': {
+            'BACKEND': 'core.channel_layers.UnixSocketChannelLayer', 'CONFIG': {'path': self.socket},
+        }}
+        deadline = time.monotonic() + 20
+        with override_settings(CHANNEL_LAYERS=layer):
+            while worker.poll() is None:
+                self.assertLess(time.monotonic(), deadline, 'сокет не вернулся в группу')
+                send_notifications([(1, {'kind': 'rental', 'id': 7})])
+                time.sleep(0.2)
+        self.assertEqual(json.loads(worker.stdout.read())['id'], 7)
+
+    async def test_undelivered_messages_expire(self):
+        layer = UnixSocketChannelLayer(self.socket, expiry=0)
+        layer._put(f'{layer.client_prefix}!specific.gone', {'type': 'notify'})
+        await asyncio.sleep(0.01)
+        layer._next_clean = 0  # чистка не чаще раза в секунду
+        layer._clean_expired()
+        self.assertEqual(layer._queues, {})
+
+    async def test_stuck_worker_does_not_grow_broker_buffer(self):
+        broker = Broker(max_buffer=1024 * 1024)
+        server = await asyncio.start_unix_server(broker.handle, path=self.socket)
+        # Процесс зарегистрировался и перестал читать сокет
+        reader, stuck = await asyncio.open_unix_connection(self.socket)
+        layer = UnixSocketChannelLayer(self.socket)
+        try:
+            write_frame(stuck, {'op': 'hello', 'id': 0, 'prefix': 'unix.stuck'})
+            await stuck.drain()
+            self.assertEqual((await read_frame(reader))['op'], 'ack')
+            channel = 'unix.stuck!specific.abc'
+            write_frame(stuck, {'op': 'group_add', 'id': 1, 'group': 'g', 'channel': channel})
+            await stuck.drain()
+            await read_frame(reader)
+
+            payload = {'type': 'notify', 'data': 'x' * 256 * 1024}
+            with self.assertRaises(ChannelFull):
+                for _ in range(100):
+                    await layer.send(channel, payload)
+            buffered = broker.owners['unix.stuck'].transport.get_write_buffer_size()
+            self.assertLess(buffered, 2 * 1024 * 1024)
+
+            # group_send в переполненный канал теряется, но членство в группе остаётся
+            await layer.group_send('g', payload)
+            self.assertIn(channel, broker.groups['g'])
+        finally:
+            stuck.close()
+            for connection in layer._connections.values():
+                connection.writer.close()
+            server.close()
+            await asyncio.sleep(0.1)  # обработчики брокера доходят до EOF и закрываются
+
+
+class CoreViewQueryBudgetTest(QueryBudgetMixin, TestCase):
+    """Бюджеты запросов не зависят от числа строк: данных заводим с запасом"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='viewer', password='pass', is_staff=True)
+        self.client.force_login(self.user)
+        session = self.client.session
+        session['onboarded'] = True
+        session.save()
+
+        owner = User.objects.create_user(username='owner', password='pass')
+        top = Category.objects.create(name='Top')
+        sub = Category.objects.create(name='Sub', parent=top)
+        for i in range(10):
+            p = Product.objects.create(
+                user=owner if i % 2 else self.user, name='n', phone='0', title=f'Item {i}',
+                description='desc', type='free', is_approved=True, main_category=top, subcategory=sub,
+            )
+            TradeRequest.objects.create(product=p, requester=self.user, owner=owner, action='take')
+        self.product = p
+
+    def test_home(self):
+        with self.assertQueryBudget(5, max_duplicates=0):
+            self.client.get(reverse('home'))
+
+    def test_my_ads(self):
+        with self.assertQueryBudget(3, max_duplicates=0):
+            self.client.get(reverse('my_ads'))
+
+    def test_requests(self):
+        with self.assertQueryBudget(4, max_duplicates=0):
+            self.client.get(reverse('requests'))
+
+    def test_product_detail(self):
+        with self.assertQueryBudget(5, max_duplicates=0):
+            self.client.get(reverse('product_detail', args=[self.product.id]))
+
+    def test_staff_sees_query_header(self):
+        resp = self.client.get(reverse('my_ads'))
+        self.assertRegex(resp['X-DB-Queries'], r'^count=\d+; time=[\d.]+ms; duplicates=\d+$')
+
+    async def test_query_header_under_asgi(self):
+        # Под ASGI счётчик видит запросы, выполненные в потоке запроса
+        await self.async_client.aforce_login(self.user)
+        sync_count = (await sync_to_async(self.client.get)(reverse('my_ads')))['X-DB-Queries'].split(';')[0]
+        resp = await self.async_client.get(reverse('my_ads'))
+        self.assertEqual(resp['X-DB-Queries'].split(';')[0], sync_count)
+        self.assertNotEqual(sync_count, 'count=0')
+
+
+class AdminChangelistTest(QueryBudgetMixin, TestCase):
+    def setUp(self):
+        self.admin = User.objects.create_superuser(username='admin', password='pass')
+        self.client.force_login(self.admin)
+        top = Category.objects.create(name='Top')
+        for i in range(6):
+            owner = User.objects.create_user(username=f'owner{i}', password='pass')
+            self.product = Product.objects.create(
+                user=owner, name='n', phone='0', title=f'Item {i}', description='d',
+                type='free', main_category=top,
+            )
+            TradeRequest.objects.create(product=self.product, requester=self.admin, owner=owner, action='take')
+        for i in range(25):
+            TradeRequest.objects.create(product=self.product, requester=self.admin, owner=owner, action='take')
+
+    def test_changelists_do_not_grow_with_rows(self):
+        with self.assertQueryBudget(5, max_duplicates=0):
+            self.client.get(reverse('admin:core_product_changelist'))
+        with self.assertQueryBudget(4, max_duplicates=0):
+            self.client.get(reverse('admin:core_traderequest_changelist'))
+
+    def test_stale_admin_form_is_rejected(self):
+        from core.admin import ProductAdminForm
+
+        opened = ProductAdminForm(instance=self.product).fields['loaded_version'].initial
+        Product.objects.filter(pk=self.product.pk).update(status='taken', version=opened + 1)
+        form = ProductAdminForm(
+            {'loaded_version': opened, 'title': 'Edited'}, instance=Product.objects.get(pk=self.product.pk),
+        )
+        self.assertFalse(form.is_valid())
+        self.assertIn('товар изменили', str(form.non_field_errors()))
+
+    def test_admin_save_checks_version(self):
+        from django.contrib import admin as django_admin
+        from core.admin import ProductAdmin
+
+        model_admin = ProductAdmin(Product, django_admin.site)
+        stale = Product.objects.get(pk=self.product.pk)
+        Product.objects.filter(pk=self.product.pk).update(status='taken', version=F('version') + 1)
+        form = mock.Mock(cleaned_data={'loaded_version': stale.version})
+        stale.title = 'Edited'
+        with self.assertRaises(ConcurrentModification), transaction.atomic():
+            model_admin.save_model(None, stale, form, change=True)
+
+        # Гонку между проверкой формы и сохранением админка показывает сообщением, а не 500
+        url = reverse('admin:core_product_change', args=[self.product.pk])
+        with mock.patch('django.contrib.admin.ModelAdmin.changeform_view', side_effect=ConcurrentModification):
+            resp = self.client.post(url)
+        self.assertRedirects(resp, url, fetch_redirect_response=False)
+
+    def test_product_inline_is_limited(self):
+        # Срез заявок — один запрос на всю инлайн-таблицу, а не по запросу на строку
+        with self.assertQueryBudget(8, max_duplicates=0):
+            resp = self.client.get(reverse('admin:core_product_change', args=[self.product.pk]))
+        self.assertEqual(resp.context['inline_admin_formsets'][0].formset.total_form_count(), 20)
+        self.assertContains(resp, f'?product__id__exact={self.product.pk}')
+
+    def test_estimated_count_only_for_large_unfiltered_lists(self):
+        with mock.patch('core.pagination.estimated_row_count', return_value=250000):
+            self.assertEqual(EstimatedCountPaginator(Product.objects.all(), 100).count, 250000)
+            self.assertEqual(EstimatedCountPaginator(Product.objects.filter(type='free'), 100).count, 6)
+        with mock.patch('core.pagination.estimated_row_count', return_value=None):
+            self.assertEqual(EstimatedCountPaginator(Product.objects.all(), 100).count, 6)
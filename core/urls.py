@@ -1,13 +1,14 @@
 from django.urls import path, include
 from .views import (
     login_view, register_view, onboarding_view,
-    home_view, logout_view, my_ads, edit_product,
+    home_view, search_view, logout_view, my_ads, edit_product,
     requests_view, add_product, product_detail,
     product_action, get_subcategories
 )
 
 urlpatterns = [
     path('', home_view, name='home'),
+    path('search/', search_view, name='search'),
     path('login/', login_view, name='login'),
     path('register/', register_view, name='register'),
     path('onboarding/', onboarding_view, name='onboarding'),
@@ -5,11 +5,22 @@ from django.contrib.auth.decorators import login_required
 from django.contrib.auth import login, logout
 from django.contrib import messages
 from django.http import JsonResponse, HttpResponseBadRequest
-from django.db.models import Q
+from django.db import transaction
 from django.urls import reverse, NoReverseMatch
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition, etag
 
-from .models import Category, Product, TradeRequest
+from .models import (
+    CategoryCounter, ConcurrentModification, Product, TradeRequest, TradeRequestCounter, subtree_q,
+)
 from .forms import ProductForm
+from .cards import render_product_cards
+from .category_tree import get_category_tree
+from .conditional import home_etag, product_etag, product_last_modified, subcategories_etag
+from .pagination import keyset_page
+from .reservations import ReservationError, decide_request, reserve_product
+from .search import search_products
+from .similarity import similar_products
 
 
 def _ms_login_url():
@@ -58,30 +69,116 @@ def onboarding_view(request):
     return render(request, 'onboarding.html')
 
 
+def _selected_category(request):
+    selected = request.GET.get('category')
+    try:
+        return int(selected) if selected else None
+    except (ValueError, TypeError):
+        return None
+
+
+def _wants_json(request):
+    return request.headers.get('Accept') == 'application/json' or request.GET.get('format') == 'json'
+
+
+def _product_json(product):
+    return {
+        'id': product.id,
+        'title': product.title,
+        'description': product.description,
+        'type': product.type,
+        'type_display': product.get_type_display(),
+        'image': product.image.url if product.image else None,
+        'thumbnail': product.image_variant_urls()['grid'] if product.image_variants_ready else None,
+        'categories': [
+            c.name for c in (product.main_category, product.subcategory, product.sub_subcategory) if c
+        ],
+        'url': reverse('product_detail', args=[product.id]),
+        'created_at': product.created_at.isoformat(),
+    }
+
+
+def _main_categories():
+    """Корневые категории с числом доступных товаров: [(category, count), ...]"""
+    roots = get_category_tree().roots()
+    counts = dict(
+        CategoryCounter.objects.filter(category_id__in=[c.pk for c in roots]).values_list('category_id', 'available')
+    )
+    return [(cat, counts.get(cat.pk, 0)) for cat in roots]
+
+
+@etag(home_etag)
 def home_view(request):
     if request.user.is_authenticated and not request.session.get('onboarded', False):
         return redirect('onboarding')
 
-    selected = request.GET.get('category')
-    try:
-        selected_id = int(selected) if selected else None
-    except (ValueError, TypeError):
-        selected_id = None
+    selected_id = _selected_category(request)
 
     qs = Product.objects.filter(is_approved=True)
     if request.user.is_authenticated:
         qs = qs.exclude(user=request.user)
     if selected_id:
-        qs = qs.filter(
-            Q(main_category_id=selected_id) |
-            Q(subcategory_id=selected_id) |
-            Q(sub_subcategory_id=selected_id)
-        )
+        # Вся ветка выбранной категории — один диапазон по индексированному пути
+        selected = get_category_tree().get(selected_id)
+        qs = qs.filter(subtree_q(selected.path, 'category_path')) if selected else qs.none()
+
+    qs = qs.select_related('main_category', 'subcategory', 'sub_subcategory')
+    products, next_cursor = keyset_page(qs, request.GET.get('cursor'))
+
+    # JSON-лента для бесконечной прокрутки
+    if _wants_json(request):
+        return JsonResponse({
+            'products': [_product_json(p) for p in products],
+            'next_cursor': next_cursor,
+        })
+
+    return render(request, 'home.html', {
+        'products': products,
+        'cards': render_product_cards(products),
+        'next_cursor': next_cursor,
+        'main_categories': _main_categories(),
+        'selected_id': selected_id,
+    })
+
+
+def search_view(request):
+    query = request.GET.get('q', '').strip()
+    selected_id = _selected_category(request)
+    if not query:
+        # Пустой поиск — обычная лента с тем же фильтром
+        home_url = reverse('home')
+        return redirect(f'{home_url}?category={selected_id}' if selected_id else home_url)
+
+    try:
+        page = max(int(request.GET.get('page', 1)), 1)
+    except (ValueError, TypeError):
+        page = 1
+
+    category_path = None
+    if selected_id:
+        selected = get_category_tree().get(selected_id)
+        category_path = selected.path if selected else '0/'
+
+    products, has_next = search_products(
+        query,
+        category_path=category_path,
+        exclude_user_id=request.user.id if request.user.is_authenticated else None,
+        page=page,
+    )
+    next_page = page + 1 if has_next else None
+
+    if _wants_json(request):
+        return JsonResponse({
+            'products': [_product_json(p) for p in products],
+            'next_page': next_page,
+        })
 
-    cats = Category.objects.filter(parent__isnull=True)
     return render(request, 'home.html', {
-        'products': qs,
-        'main_categories': cats,
+        'products': products,
+        'cards': render_product_cards(products),
+        'next_page': next_page,
+        'query': query,
+        'main_categories': _main_categories(),
         'selected_id': selected_id,
     })
 
@@ -96,7 +193,7 @@ def my_ads(request):
             messages.success(request, "Объявление удалено.")
         return redirect('my_ads')
 
-    own_products = Product.objects.filter(user=request.user)
+    own_products = Product.objects.filter(user=request.user).order_by('-created_at')
     return render(request, 'my_ads.html', {
         'own_products': own_products
     })
@@ -108,7 +205,12 @@ def edit_product(request, product_id):
     if request.method == 'POST':
         form = ProductForm(request.POST, request.FILES, instance=product)
         if form.is_valid():
-            form.save()
+            try:
+                with transaction.atomic():
+                    form.save(commit=False).save(check_version=True)
+            except ConcurrentModification:
+                messages.error(request, "Объявление только что изменилось, проверьте его и сохраните ещё раз.")
+                return redirect('edit_product', product_id=product.id)
             messages.success(request, "Объявление обновлено.")
             return redirect('my_ads')
     else:
@@ -119,36 +221,52 @@ def edit_product(request, product_id):
     })
 
 
+REQUEST_TABS = (
+    ('incoming', 'Входящие', 'in', 'owner', 'requester'),
+    ('outgoing', 'Исходящие', 'out', 'requester', 'owner'),
+)
+
+
 @login_required
 def requests_view(request):
     if request.method == 'POST':
-        req_id = request.POST['req_id']
-        decision = request.POST['decision']
-        tr = get_object_or_404(TradeRequest, id=req_id)
-
-        if decision in ('accept', 'reject') and request.user == tr.owner and tr.status == 'pending':
-            tr.status = 'accepted' if decision == 'accept' else 'rejected'
-            tr.save()
-        elif decision == 'cancel' and request.user == tr.requester and tr.status == 'pending':
-            tr.status = 'cancelled'
-            tr.save()
-        elif decision == 'complete' and request.user == tr.requester and tr.status == 'accepted':
-            tr.status = 'completed'
-            tr.save()
-
-        return redirect('requests')
-
-    incoming = TradeRequest.objects.filter(owner=request.user).select_related('product', 'requester')
-    outgoing = TradeRequest.objects.filter(requester=request.user).select_related('product', 'owner')
+        if not decide_request(request.POST.get('req_id'), request.user, request.POST.get('decision')):
+            messages.error(request, "Заявка уже обработана или недоступна.")
+        return redirect(request.get_full_path())
+
+    tabs = {key: (label, direction, role, other) for key, label, direction, role, other in REQUEST_TABS}
+    tab = request.GET.get('tab') if request.GET.get('tab') in tabs else 'incoming'
+    label, direction, role, other = tabs[tab]
+    statuses = dict(TradeRequest.STATUS_CHOICES)
+    status = request.GET.get('status') if request.GET.get('status') in statuses else None
+
+    # Счётчики вкладок и статусов — одна выборка из TradeRequestCounter вместо COUNT(*)
+    counts = {
+        (d, s): n for d, s, n in
+        TradeRequestCounter.objects.filter(user=request.user).values_list('direction', 'status', 'count')
+    }
+
+    qs = TradeRequest.objects.filter(**{role: request.user}).select_related('product', other)
+    if status:
+        qs = qs.filter(status=status)
+    items, next_cursor = keyset_page(qs, request.GET.get('cursor'), page_size=20)
+
     return render(request, 'requests.html', {
-        'incoming': incoming,
-        'outgoing': outgoing,
+        'tab': tab,
+        'status': status,
+        'requests': items,
+        'next_cursor': next_cursor,
+        'tabs': [
+            (key, tab_label, sum(n for (d, _), n in counts.items() if d == tab_direction))
+            for key, tab_label, tab_direction, _, _ in REQUEST_TABS
+        ],
+        'statuses': [(value, name, counts.get((direction, value), 0)) for value, name in statuses.items()],
     })
 
 
 @login_required
 def add_product(request):
-    main_categories = Category.objects.filter(parent__isnull=True)
+    main_categories = get_category_tree().roots()
     if request.method == 'POST':
         form = ProductForm(request.POST, request.FILES)
         if form.is_valid():
@@ -166,21 +284,31 @@ def add_product(request):
     })
 
 
+# Категории почти не меняются: кэшируем надолго, после истечения — проверка по ETag
+@cache_control(public=True, max_age=60 * 60 * 24)
+@etag(subcategories_etag)
 def get_subcategories(request, category_id):
-    subs = Category.objects.filter(parent_id=category_id).values('id', 'name')
-    return JsonResponse(list(subs), safe=False)
+    subs = [{'id': c.id, 'name': c.name} for c in get_category_tree().children(category_id)]
+    return JsonResponse(subs, safe=False)
 
 
 @login_required
+@condition(etag_func=product_etag, last_modified_func=product_last_modified)
 def product_detail(request, product_id):
-    product = get_object_or_404(Product, id=product_id)
+    product = get_object_or_404(
+        Product.objects.select_related('user', 'main_category', 'subcategory', 'sub_subcategory', 'similarity'),
+        id=product_id,
+    )
 
     # Только автор может просматривать свой неободренный товар
     if not product.is_approved and product.user != request.user:
         messages.error(request, "Этот товар ещё не прошёл модерацию.")
         return redirect('home')
 
-    return render(request, 'product_detail.html', {'product': product})
+    return render(request, 'product_detail.html', {
+        'product': product,
+        'similar': similar_products(product),
+    })
 
 
 @login_required
@@ -195,17 +323,11 @@ def product_action(request, product_id, action):
         messages.error(request, "Этот товар ещё не одобрен.")
         return redirect('home')
 
-    tr = TradeRequest.objects.create(
-        product=product,
-        requester=request.user,
-        owner=product.user,
-        action=action
-    )
-    if action == 'take':
-        product.status = 'taken'
-    else:
-        product.status = 'exchanged'
-    product.save()
+    try:
+        reserve_product(product, request.user, action)
+    except ReservationError as exc:
+        messages.error(request, str(exc))
+        return redirect('product_detail', product_id=product.id)
 
     messages.success(request, "Заявка отправлена!")
     return redirect('requests')
@@ -0,0 +1,34 @@
+"""
+Настройки gunicorn: ASGI-приложение (HTTP и WebSocket) в воркерах uvicorn.
+
+    gunicorn CharityAlmaWeb.asgi:application -c gunicorn.conf.py
+
+Всё настраивается переменными окружения; значения по умолчанию — для
+небольшой машины. Воркеры асинхронные: медленная загрузка или открытый
+сокет не занимают воркер целиком, поэтому их нужно меньше, чем sync-воркеров.
+Группы каналов между воркерами требуют общего слоя (CHANNEL_LAYER=redis/unix).
+"""
+import multiprocessing
+import os
+
+
+def _int(name, default):
+    return int(os.getenv(name, default))
+
+
+bind = os.getenv("GUNICORN_BIND", "0.0.0.0:8000")
+worker_class = os.getenv("GUNICORN_WORKER_CLASS", "uvicorn_worker.UvicornWorker")
+workers = _int("WEB_CONCURRENCY", min(multiprocessing.cpu_count() + 1, 4))
+
+# Keep-alive HTTP-соединений за прокси, секунды
+keepalive = _int("GUNICORN_KEEPALIVE", 5)
+# Перезапуск воркера после N запросов (0 — никогда) с разбросом, чтобы не все сразу
+max_requests = _int("GUNICORN_MAX_REQUESTS", 2000)
+max_requests_jitter = _int("GUNICORN_MAX_REQUESTS_JITTER", 200)
+# Сколько ждать завершения запросов и сокетов при перезапуске/остановке
+graceful_timeout = _int("GUNICORN_GRACEFUL_TIMEOUT", 30)
+# Воркер, не отвечающий мастеру дольше timeout, перезапускается
+timeout = _int("GUNICORN_TIMEOUT", 60)
+
+accesslog = os.getenv("GUNICORN_ACCESS_LOG", "-")
+forwarded_allow_ips = os.getenv("FORWARDED_ALLOW_IPS", "127.0.0.1")